@@ -0,0 +1,80 @@
+# catalog_memory.py
+
+# Measures the memory the catalog holds per track: the formatted track dicts
+# the service used to keep against the slotted TrackRecords it keeps now.
+# Both are built the way the service builds them (streamed out of the setlist
+# and formatted one item at a time) and measured with tracemalloc, so only
+# what stays referenced by the catalog list is counted. Each variant runs in
+# its own interpreter, so shared tables (such as the interned strings) grow
+# the same way for both.
+#
+# Run from backend/:
+#   python benchmarks/catalog_memory.py [path/to/AI_Setlist.json]
+
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.apify_data_service import ApifyDataService
+from services.setlist_reader import SetlistReader
+from services.track_record import TrackRecord
+
+DEFAULT_SETLIST = os.path.join(os.path.dirname(__file__), "..", "..", "AI_Setlist.json")
+
+VARIANTS = ("dicts", "TrackRecord")
+
+
+def load_tracks(service, path, as_records):
+    """Formatted tracks of the setlist, as dicts or as TrackRecords"""
+    tracks = []
+    for item in SetlistReader(path):
+        track = service._format_track(item)
+        if track:
+            tracks.append(TrackRecord.from_dict(track) if as_records else track)
+    return tracks
+
+
+def measure(path, variant):
+    """(track count, bytes still allocated for them once loaded)"""
+    service = ApifyDataService()
+    try:
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracks = load_tracks(service, path, variant == "TrackRecord")
+        # Parser garbage still waiting for a collection is not held by the catalog
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+    finally:
+        service.shutdown()
+    return len(tracks), held
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--variant":
+        # Child process: measure one variant and report it as JSON
+        print(json.dumps(measure(sys.argv[3], sys.argv[2])))
+        return
+    
+    path = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SETLIST)
+    print(f"Catalog memory for {path}")
+    results = {}
+    for variant in VARIANTS:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--variant", variant, path],
+                                check=True, capture_output=True, text=True).stdout
+        count, held = json.loads(output.strip().splitlines()[-1])
+        results[variant] = held
+        per_track = held / count if count else 0
+        print(f"  {variant:<12} {count} tracks, {held / 1024 / 1024:.1f} MiB, {per_track:.0f} bytes per track")
+    if results["dicts"]:
+        print(f"  TrackRecord saves {1 - results['TrackRecord'] / results['dicts']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
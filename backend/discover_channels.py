@@ -3,9 +3,18 @@
 # This script searches YouTube for AI music-related channels
 # It filters by subscriber count and video count to find reliable sources
 # Output is saved as a JSON list of promising channels
+#
+# YouTube Data API quota is the bottleneck, so every run:
+# - asks for the maximum page size, since a search costs 100 units however many results it returns
+# - looks up channel details 50 IDs per request (1 unit) instead of one request per channel
+# - caches API responses on disk and only spends quota on what is missing or stale
+# - merges its results into the existing JSON files instead of starting over
 
 import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
 
@@ -13,12 +22,6 @@ from googleapiclient.discovery import build
 load_dotenv()
 API_KEY = os.getenv("YOUTUBE_API_KEY")
 
-if not API_KEY:
-    raise ValueError("YouTube API key not found in .env file")
-
-# YouTube API client
-youtube = build("youtube", "v3", developerKey=API_KEY)
-
 # List of AI music search terms
 SEARCH_TERMS = [
     "AI generated pop song",
@@ -40,16 +43,157 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, "data")
 CHANNELS_FILE = os.path.join(DATA_DIR, "ai_music_channels.json")
 PLAYLISTS_FILE = os.path.join(DATA_DIR, "ai_music_playlists.json")
+CACHE_FILE = os.path.join(DATA_DIR, "youtube_api_cache.json")
+
+# Quota units per call (https://developers.google.com/youtube/v3/determine_quota_cost)
+QUOTA_COSTS = {
+    "search.list": 100,
+    "channels.list": 1,
+}
+# Units one run may spend; calls past the budget are skipped
+QUOTA_BUDGET = int(os.getenv("YOUTUBE_QUOTA_BUDGET", "10000"))
+
+# How long cached responses stay fresh, in seconds
+SEARCH_TTL = 7 * 24 * 3600
+CHANNEL_TTL = 24 * 3600
+
+SEARCH_MAX_RESULTS = 50  # The API maximum; a search costs the same whatever the page size
+CHANNELS_PER_REQUEST = 50  # The API maximum for channels().list(id=...)
+MAX_WORKERS = int(os.getenv("DISCOVERY_WORKERS", "4"))
+MIN_VIDEO_COUNT = 10
+
+COVER_KEYWORDS = ["cover", "in the style", "tribute", "beatles", "metallica"]
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of making a call that would overrun the run's quota budget"""
+
+
+class QuotaTracker:
+    """Counts the quota units and calls spent by a run, refusing calls past the budget"""
+
+    def __init__(self, budget=QUOTA_BUDGET):
+        self.budget = budget
+        self.spent = 0
+        self.calls = {}
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+
+    def charge(self, method):
+        cost = QUOTA_COSTS[method]
+        with self._lock:
+            if self.spent + cost > self.budget:
+                raise QuotaExceeded(f"{method} would exceed the {self.budget} unit budget ({self.spent} spent)")
+            self.spent += cost
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def summary(self):
+        calls = ", ".join(f"{count} {method}" for method, count in sorted(self.calls.items())) or "no calls"
+        return f"{self.spent}/{self.budget} quota units ({calls}, {self.cache_hits} cache hits)"
+
+
+class ResponseCache:
+    """API responses kept on disk with a time-to-live, shared by all worker threads"""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            print(f"Warning: Ignoring unreadable API cache: {e}")
+
+    def get(self, key, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and time.time() - entry["fetched_at"] < ttl:
+            return entry["response"]
+        return None
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = {"fetched_at": time.time(), "response": response}
+
+    def save(self, max_age=max(SEARCH_TTL, CHANNEL_TTL)):
+        """Write the cache, dropping entries too old to ever be used again"""
+        now = time.time()
+        with self._lock:
+            entries = {key: entry for key, entry in self._entries.items() if now - entry["fetched_at"] < max_age}
+        write_json(self.path, entries, indent=None)
+
+
+class YouTubeClient:
+    """
+    Cached, quota-tracked access to the API calls discovery needs.
+
+    googleapiclient clients are not thread-safe, so every worker thread builds
+    its own from build_client (the real googleapiclient build by default, or a
+    fake one in tests).
+    """
+
+    def __init__(self, build_client=build, developer_key=None, cache=None, quota=None):
+        self._build_client = build_client
+        self._developer_key = developer_key
+        self._local = threading.local()
+        self.cache = cache if cache is not None else ResponseCache()
+        self.quota = quota if quota is not None else QuotaTracker()
+
+    def _youtube(self):
+        youtube = getattr(self._local, "youtube", None)
+        if youtube is None:
+            youtube = self._local.youtube = self._build_client("youtube", "v3", developerKey=self._developer_key)
+        return youtube
+
+    def search(self, query, result_type, max_results=SEARCH_MAX_RESULTS):
+        key = f"search:{result_type}:{max_results}:{query}"
+        response = self.cache.get(key, SEARCH_TTL)
+        if response is not None:
+            self.quota.hit()
+            return response
+        self.quota.charge("search.list")
+        response = self._youtube().search().list(
+            part="snippet",
+            q=query,
+            type=result_type,
+            maxResults=max_results
+        ).execute()
+        self.cache.put(key, response)
+        return response
+
+    def channels(self, channel_ids):
+        """Channel items by ID for up to CHANNELS_PER_REQUEST IDs, fetching only uncached ones"""
+        items = {}
+        missing = []
+        for channel_id in channel_ids:
+            item = self.cache.get(f"channel:{channel_id}", CHANNEL_TTL)
+            if item is not None:
+                self.quota.hit()
+                items[channel_id] = item
+            else:
+                missing.append(channel_id)
+        if missing:
+            self.quota.charge("channels.list")
+            response = self._youtube().channels().list(
+                part="snippet,statistics",
+                id=",".join(missing)
+            ).execute()
+            for item in response.get("items", []):
+                self.cache.put(f"channel:{item['id']}", item)
+                items[item["id"]] = item
+        return items
+
 
 # Function to fetch channels matching a query
-def search_channels(query, max_results=10):
-    request = youtube.search().list(
-        part="snippet",
-        q=query,
-        type="channel",
-        maxResults=max_results
-    )
-    response = request.execute()
+def search_channels(client, query, max_results=SEARCH_MAX_RESULTS):
+    response = client.search(query, "channel", max_results)
 
     channels = []
     for item in response["items"]:
@@ -60,20 +204,14 @@ def search_channels(query, max_results=10):
     return channels
 
 # Function to fetch playlists
-def search_playlists(query, max_results=10):
-    request = youtube.search().list(
-        part="snippet",
-        q=query,
-        type="playlist",
-        maxResults=max_results
-    )
-    response = request.execute()
+def search_playlists(client, query, max_results=SEARCH_MAX_RESULTS):
+    response = client.search(query, "playlist", max_results)
 
     playlists = []
     for item in response["items"]:
         try:
             title = item["snippet"]["title"].lower()
-            if any(keyword in title for keyword in ["cover", "in the style", "tribute", "beatles", "metallica"]):
+            if any(keyword in title for keyword in COVER_KEYWORDS):
                 continue  # Skip likely covers or parody references
 
             # Extract playlist ID safely
@@ -95,69 +233,112 @@ def search_playlists(query, max_results=10):
             continue
     return playlists
 
-# Function to fetch channel statistics like subscriber count
-def get_channel_details(channel_id):
-    request = youtube.channels().list(
-        part="snippet,statistics",
-        id=channel_id
-    )
-    response = request.execute()
+# Function to fetch statistics like subscriber count for a batch of channels
+def get_channel_details(client, channel_ids):
+    details = []
+    for channel_id, item in client.channels(channel_ids).items():
+        stats = item["statistics"]
+        details.append({
+            "channel_title": item["snippet"]["title"],
+            "channel_id": channel_id,
+            "channel_url": f"https://youtube.com/channel/{channel_id}",
+            "subscribers": int(stats.get("subscriberCount", 0)),
+            "video_count": int(stats.get("videoCount", 0))
+        })
+    return details
 
-    if not response["items"]:
-        return None
+def load_json_list(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def write_json(path, data, indent=2):
+    """Write JSON to a temporary file and rename it into place"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def run_searches(client, terms, workers):
+    """Run the channel and playlist search for every term on a bounded pool"""
+    def search_term(term):
+        print(f"🔍 Searching for: {term}")
+        results = []
+        for search in (search_channels, search_playlists):
+            try:
+                results.append(search(client, term))
+            except QuotaExceeded as e:
+                print(f"⚠️ Skipping {search.__name__} for '{term}': {e}")
+                results.append([])
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(search_term, terms))
+
+def fetch_channel_details(client, channel_ids, workers):
+    """Look up channel details in batches of CHANNELS_PER_REQUEST IDs on a bounded pool"""
+    batches = [channel_ids[i:i + CHANNELS_PER_REQUEST] for i in range(0, len(channel_ids), CHANNELS_PER_REQUEST)]
+
+    def fetch_batch(batch):
+        try:
+            return get_channel_details(client, batch)
+        except QuotaExceeded as e:
+            print(f"⚠️ Skipping details for {len(batch)} channels: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [details for batch in pool.map(fetch_batch, batches) for details in batch]
+
+def main(build_client=None, terms=SEARCH_TERMS, workers=MAX_WORKERS, cache=None, quota=None):
+    if build_client is None:
+        if not API_KEY:
+            raise ValueError("YouTube API key not found in .env file")
+        build_client = build
 
-    item = response["items"][0]
-    stats = item["statistics"]
-    return {
-        "channel_title": item["snippet"]["title"],
-        "channel_id": channel_id,
-        "channel_url": f"https://youtube.com/channel/{channel_id}",
-        "subscribers": int(stats.get("subscriberCount", 0)),
-        "video_count": int(stats.get("videoCount", 0))
-    }
-
-def main():
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
     print(f"Data directory: {DATA_DIR}")
 
-    seen_channel_ids = set()
-    seen_playlist_ids = set()
-    result_channels = []
-    result_playlists = []
+    client = YouTubeClient(build_client, API_KEY, cache=cache, quota=quota)
+    existing_channels = {ch["channel_id"]: ch for ch in load_json_list(CHANNELS_FILE)}
+    existing_playlists = {pl["playlist_id"]: pl for pl in load_json_list(PLAYLISTS_FILE)}
 
-    for term in SEARCH_TERMS:
-        print(f"🔍 Searching for: {term}")
-        
-        # Search for channels
-        channels = search_channels(term)
-        for ch in channels:
-            if ch["channel_id"] in seen_channel_ids:
-                continue
-            seen_channel_ids.add(ch["channel_id"])
-            details = get_channel_details(ch["channel_id"])
-            if not details:
-                continue
-            if details["video_count"] >= 10:
-                result_channels.append(details)
-        
-        # Search for playlists
-        playlists = search_playlists(term)
+    found_channel_ids = []
+    found_playlists = {}
+    for channels, playlists in run_searches(client, terms, workers):
+        found_channel_ids.extend(ch["channel_id"] for ch in channels)
         for pl in playlists:
-            if pl["playlist_id"] in seen_playlist_ids:
-                continue
-            seen_playlist_ids.add(pl["playlist_id"])
-            result_playlists.append(pl)
+            found_playlists.setdefault(pl["playlist_id"], pl)
+
+    # Refresh known channels along with new ones; batching makes that nearly free
+    channel_ids = list(dict.fromkeys(list(existing_channels) + found_channel_ids))
+    details = fetch_channel_details(client, channel_ids, workers)
+
+    merged_channels = dict(existing_channels)
+    for ch in details:
+        if ch["video_count"] >= MIN_VIDEO_COUNT:
+            merged_channels[ch["channel_id"]] = ch
+        else:
+            merged_channels.pop(ch["channel_id"], None)
+    new_channels = len(set(merged_channels) - set(existing_channels))
+
+    merged_playlists = dict(existing_playlists)
+    merged_playlists.update(found_playlists)
+    new_playlists = len(set(merged_playlists) - set(existing_playlists))
 
     # Save channels
-    with open(CHANNELS_FILE, "w", encoding="utf-8") as f:
-        json.dump(result_channels, f, indent=2, ensure_ascii=False)
-    print(f"✅ Saved {len(result_channels)} channels to {CHANNELS_FILE}")
+    write_json(CHANNELS_FILE, list(merged_channels.values()))
+    print(f"✅ Saved {len(merged_channels)} channels ({new_channels} new) to {CHANNELS_FILE}")
 
     # Save playlists
-    with open(PLAYLISTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(result_playlists, f, indent=2, ensure_ascii=False)
-    print(f"✅ Saved {len(result_playlists)} playlists to {PLAYLISTS_FILE}")
+    write_json(PLAYLISTS_FILE, list(merged_playlists.values()))
+    print(f"✅ Saved {len(merged_playlists)} playlists ({new_playlists} new) to {PLAYLISTS_FILE}")
+
+    client.cache.save()
+    print(f"📊 Spent {client.quota.summary()}")
+    return {"channels": new_channels, "playlists": new_playlists, "quota_spent": client.quota.spent}
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
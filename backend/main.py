@@ -1,8 +1,21 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes import tracks, channels
+from services.apify_data_service import apify_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the catalog in the background so the port opens right away;
+    # /api/tracks/ready reports when it is done
+    apify_service.start()
+    yield
+    apify_service.shutdown()
+
 
-app = FastAPI(title="Quantum Radio API")
+app = FastAPI(title="Quantum Radio API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -11,6 +24,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "X-Catalog-Version"],
 )
 
 # Include routers
@@ -19,4 +33,11 @@ app.include_router(channels.router, prefix="/api")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    from services.shared_catalog import worker_count
+    workers = worker_count()
+    if workers > 1:
+        # Workers import the app and load the catalog themselves; they share one
+        # catalog (services/shared_catalog.py)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -1,17 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Dict
-from services.apify_data_service import apify_service
+from services.apify_data_service import apify_service, ServiceUnavailableError
+from routes.http_cache import prepared_json_response
 
 router = APIRouter(tags=["channels"])
 
 @router.get("/channels", response_model=List[Dict])
-async def get_channels():
-    """Get all unique channels from APIFY data with their statistics"""
+async def get_channels(request: Request):
+    """Get all unique channels from APIFY data with their statistics, most subscribed first"""
     try:
-        channels = apify_service.get_channels_summary()
-        # Sort by subscriber count (descending)
-        channels.sort(key=lambda x: x.get('subscribers', 0), reverse=True)
-        return channels
+        prepared = await apify_service.run_blocking(apify_service.get_prepared_response, "channels")
+        return prepared_json_response(request, prepared)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -19,12 +20,15 @@ async def get_channels():
 async def get_channel_tracks(channel_id: str):
     """Get all tracks from a specific channel"""
     try:
-        all_tracks = apify_service.get_all_tracks()
-        channel_tracks = [track for track in all_tracks if track.get('channel_id') == channel_id]
+        channel_tracks = await apify_service.run_blocking(apify_service.get_tracks_by_channel_id, channel_id)
         
         if not channel_tracks:
             raise HTTPException(status_code=404, detail="No tracks found for this channel")
         
         return channel_tracks
+    except HTTPException:
+        raise
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
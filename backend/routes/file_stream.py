@@ -0,0 +1,230 @@
+import mimetypes
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+import anyio
+from fastapi import Request, Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+# ASGI extension for sendfile(2)-style transmission. Only used when the server
+# lists it in scope["extensions"]; uvicorn, which main.py runs, does not, so
+# there every range goes through the pread() path below
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# Concurrent audio streams allowed per client address
+MAX_STREAMS_PER_CLIENT = int(os.getenv("QUANTUM_RADIO_MAX_STREAMS_PER_CLIENT", "4"))
+
+
+class StreamLimiter:
+    """Counts open streams per client and refuses new ones past a limit"""
+
+    def __init__(self, limit: int = MAX_STREAMS_PER_CLIENT):
+        self.limit = limit
+        self._open: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str) -> bool:
+        with self._lock:
+            count = self._open.get(client, 0)
+            if count >= self.limit:
+                return False
+            self._open[client] = count + 1
+            return True
+
+    def release(self, client: str):
+        with self._lock:
+            count = self._open.get(client, 0) - 1
+            if count > 0:
+                self._open[client] = count
+            else:
+                self._open.pop(client, None)
+
+
+class FileRangeResponse(Response):
+    """
+    Send bytes [start, end] of a file without loading it into memory.
+
+    The range is read with pread() in fixed-size chunks on a worker thread,
+    starting at the requested offset rather than the beginning of the file.
+    Only under an ASGI server that offers the zerocopysend extension (not
+    uvicorn) is the file handed to the server instead, for the kernel to copy
+    straight to the socket.
+
+    Sending stops as soon as the client disconnects (as it does on every
+    seek in an <audio> element), and on_close runs right then, not once the
+    rest of the range has been read for nobody.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: Dict[str, str],
+                 media_type: str, send_body: bool = True, on_close: Optional[Callable[[], None]] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+        self.on_close = on_close
+        self.headers["Content-Length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            # Whichever finishes first, sending or the client going away, cancels the other
+            async with anyio.create_task_group() as task_group:
+                async def run_and_cancel(func):
+                    await func()
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(run_and_cancel, partial(self._send, scope, send))
+                await run_and_cancel(partial(self._wait_for_disconnect, receive))
+        finally:
+            if self.on_close:
+                self.on_close()
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def _send(self, scope: Scope, send: Send) -> None:
+        if not self.send_body:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        try:
+            # An open descriptor keeps the bytes readable even if the cache evicts the file meanwhile
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            missing = Response("Audio file no longer available", status_code=404)
+            await missing(scope, None, send)
+            return
+
+        with f:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            count = self.end - self.start + 1
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({"type": ZEROCOPY_EXTENSION, "file": f, "offset": self.start, "count": count})
+                return
+
+            fd = f.fileno()
+            offset = self.start
+            remaining = count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank under us; end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b""})
+
+
+def file_validators(stat_result: os.stat_result) -> Dict[str, str]:
+    """ETag and Last-Modified derived from a file's mtime and size"""
+    return {
+        "ETag": f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into inclusive (start, end) offsets.
+
+    Returns None when the header is absent, malformed or asks for several
+    ranges, in which case the whole file is sent. Raises ValueError when the
+    range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, _, last = spec.partition("-")
+    first, last = first.strip(), last.strip()
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def _not_modified(request: Request, validators: Dict[str, str], mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or validators["ETag"] in tags or f'W/{validators["ETag"]}' in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(request: Request, validators: Dict[str, str]) -> bool:
+    """If-Range: only honour Range when the client's copy is still current"""
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    return if_range.strip() in (validators["ETag"], validators["Last-Modified"])
+
+
+def file_range_response(request: Request, path: str,
+                        on_close: Optional[Callable[[], None]] = None) -> Response:
+    """
+    Serve a file with Range/206 and conditional request support.
+
+    on_close runs once the response is finished or abandoned, whichever
+    response is returned.
+    """
+    try:
+        stat_result = os.stat(path)
+        validators = file_validators(stat_result)
+        media_type = mimetypes.guess_type(path)[0] or "audio/mpeg"
+        size = stat_result.st_size
+        headers = dict(validators, **{"Accept-Ranges": "bytes", "Cache-Control": "no-cache"})
+
+        if _not_modified(request, validators, stat_result.st_mtime):
+            response = Response(status_code=304, headers=headers)
+        else:
+            try:
+                requested = parse_range(request.headers.get("range"), size) if _range_applies(request, validators) else None
+            except ValueError:
+                headers["Content-Range"] = f"bytes */{size}"
+                response = Response(status_code=416, headers=headers)
+            else:
+                send_body = request.method != "HEAD"
+                if requested is None:
+                    start, end, status_code = 0, size - 1, 200
+                else:
+                    start, end = requested
+                    status_code = 206
+                    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+                return FileRangeResponse(path, start, end, status_code, headers, media_type,
+                                         send_body=send_body, on_close=on_close)
+    except BaseException:
+        if on_close:
+            on_close()
+        raise
+
+    if on_close:
+        on_close()
+    return response
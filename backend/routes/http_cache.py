@@ -0,0 +1,30 @@
+from fastapi import Request, Response
+from services.response_cache import PreparedResponse
+
+
+def prepared_json_response(request: Request, prepared: PreparedResponse) -> Response:
+    """
+    Serve a pre-serialized JSON body, honouring Accept-Encoding and
+    answering conditional requests with 304 Not Modified
+    """
+    body, encoding = prepared.negotiate(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": prepared.etag_for(encoding),
+        "Vary": "Accept-Encoding",
+        # Always revalidate; unchanged data costs a bodiless 304
+        "Cache-Control": "no-cache",
+    }
+    
+    if prepared.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if isinstance(body, bytes):
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    # Bodies in a mapped catalog are memoryviews; send them without copying
+    response = Response(media_type="application/json", headers=headers)
+    response.body = body
+    response.headers["Content-Length"] = str(len(body))
+    return response
@@ -1,48 +1,121 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Body, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Dict, Optional
-from services.apify_data_service import apify_service
+from services.apify_data_service import apify_service, ExpiredCursorError, ServiceUnavailableError
+from services.audio_downloader import audio_downloader
+from services.change_log import ChangeFeed
+from routes.http_cache import prepared_json_response
+from services.response_cache import iter_json_array, iter_json_lines
+from services.track_record import parse_fields
+from routes.file_stream import StreamLimiter, file_range_response
 
 router = APIRouter(tags=["tracks"])
 
+audio_streams = StreamLimiter()
+
+# Pushes catalog changes to every open /tracks/changes/stream
+change_feed = ChangeFeed(apify_service)
+
 @router.get("/tracks", response_model=List[Dict])
 async def get_tracks(
-    limit: Optional[int] = Query(None, description="Limit number of tracks returned"),
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, description="Limit number of tracks returned (page size)"),
     channel: Optional[str] = Query(None, description="Filter by channel name"),
-    search: Optional[str] = Query(None, description="Search in title, channel, or description")
+    search: Optional[str] = Query(None, description="Search in title, channel, hashtags, or description"),
+    sort: Optional[str] = Query(None, description="Sort by views, likes, comments, date, duration or title"),
+    order: str = Query("desc", description="Sort order: asc or desc"),
+    has_hashtags: bool = Query(False, description="Only return tracks that have hashtags"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor to fetch the next page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. video_id,title,thumbnail"),
+    output: str = Query("json", alias="format", description="json, or ndjson to stream one track per line")
 ):
-    """Get tracks from APIFY data with optional filtering"""
-    try:
-        if search:
-            tracks = apify_service.search_tracks(search)
-        elif channel:
-            tracks = apify_service.get_tracks_by_channel(channel)
-        else:
-            tracks = apify_service.get_all_tracks()
-        
-        # Apply limit if specified
-        if limit and limit > 0:
-            tracks = tracks[:limit]
-            
-        return tracks
+    """
+    Get tracks from APIFY data with optional filtering, sorting and pagination.
+    Paging metadata is returned in the X-Total-Count, X-Next-Cursor and
+    X-Catalog-Version headers.
+    
+    Listings without a limit, and every ndjson listing (also selected with
+    Accept: application/x-ndjson), are streamed as tracks are formatted.
+    """
+    try:
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if output not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be 'json' or 'ndjson'")
+    ndjson = output == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+    
+    if ("tracks" in apify_service.prepared_responses and not ndjson and projection is None
+            and not any((limit, channel, search, sort, has_hashtags, cursor))):
+        # The unfiltered listing is identical for every request against the
+        # same catalog version, so serve the pre-serialized body (backends
+        # that do not keep one stream it below)
+        try:
+            prepared = await apify_service.run_blocking(apify_service.get_prepared_response, "tracks")
+        except ServiceUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        return prepared_json_response(request, prepared)
+    
+    stream = ndjson or not limit
+    try:
+        result = await apify_service.run_blocking(
+            apify_service.query_tracks,
+            search=search,
+            channel=channel,
+            has_hashtags=has_hashtags,
+            sort=sort,
+            order=order,
+            cursor=cursor,
+            limit=limit if limit and limit > 0 else None,
+            fields=projection,
+            stream=stream
+        )
+    except ExpiredCursorError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    headers = {
+        "X-Total-Count": str(result["total"]),
+        "X-Catalog-Version": str(result["version"]),
+    }
+    if result["next_cursor"]:
+        headers["X-Next-Cursor"] = result["next_cursor"]
+    if stream:
+        # Formatted on a worker thread chunk by chunk, never as a whole
+        if ndjson:
+            return StreamingResponse(iter_json_lines(result["tracks"]), media_type="application/x-ndjson",
+                                     headers=headers)
+        return StreamingResponse(iter_json_array(result["tracks"]), media_type="application/json", headers=headers)
+    response.headers.update(headers)
+    return result["tracks"]
 
 @router.get("/tracks/random", response_model=Dict)
 async def get_random_track():
     """Get a random track from APIFY data"""
     try:
-        track = apify_service.get_random_track()
+        track = await apify_service.run_blocking(apify_service.get_random_track)
         if not track:
             raise HTTPException(status_code=404, detail="No tracks available")
         return track
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/tracks/stats", response_model=Dict)
-async def get_tracks_stats():
+async def get_tracks_stats(request: Request):
     """Get statistics about the track collection"""
     try:
-        return apify_service.get_stats()
+        prepared = await apify_service.run_blocking(apify_service.get_prepared_response, "stats")
+        return prepared_json_response(request, prepared)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -50,32 +123,190 @@ async def get_tracks_stats():
 async def get_file_watcher_status():
     """Get the status of the file watcher"""
     try:
-        return apify_service.get_watcher_status()
+        return await apify_service.run_blocking(apify_service.get_watcher_status)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tracks/ready", response_model=Dict)
+async def get_readiness():
+    """Whether the catalog has finished loading (503 until it has)"""
+    try:
+        readiness = await apify_service.run_blocking(apify_service.get_readiness)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not readiness["ready"]:
+        return JSONResponse(readiness, status_code=503, headers={"Retry-After": "1"})
+    return readiness
+
+@router.get("/tracks/queue", response_model=Dict)
+async def get_radio_queue(
+    session: Optional[str] = Query(None, description="Session ID from a previous response; omit to start a session"),
+    count: int = Query(10, ge=1, le=100, description="Number of tracks to return"),
+    weight: str = Query("uniform", description="uniform, views, likes or recency"),
+    channel: Optional[str] = Query(None, description="Only play this channel"),
+    hashtag: Optional[str] = Query(None, description="Only play tracks with this hashtag")
+):
+    """
+    The next tracks for continuous radio playback. Pass the returned session
+    ID back to continue the session without repeating recent tracks.
+    """
+    try:
+        result = await apify_service.run_blocking(apify_service.get_radio_queue, session=session, count=count,
+                                                  weighting=weight, channel=channel, hashtag=hashtag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not result["tracks"]:
+        raise HTTPException(status_code=404, detail="No tracks available")
+    return result
+
+@router.get("/tracks/facets", response_model=Dict)
+async def get_track_facets(
+    channel: Optional[str] = Query(None, description="Filter by channel name"),
+    search: Optional[str] = Query(None, description="Search in title, channel, hashtags, or description"),
+    has_hashtags: bool = Query(False, description="Only count tracks that have hashtags"),
+    hashtags: int = Query(20, ge=1, le=200, description="Number of top hashtags to return")
+):
+    """
+    Counts per channel, top hashtags, duration buckets, upload months and
+    view count bins for the tracks matching the same filters as /tracks.
+    Channel counts ignore the channel filter, so the other channels can
+    still be offered.
+    """
+    try:
+        return await apify_service.run_blocking(apify_service.get_facets, search=search, channel=channel,
+                                                has_hashtags=has_hashtags, hashtag_limit=hashtags)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/tracks/batch", response_model=Dict)
+async def get_tracks_batch(
+    video_ids: List[str] = Body(..., embed=True, description="Video IDs to look up (at most 500)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. video_id,title,thumbnail")
+):
+    """
+    Resolve many tracks in one request, e.g. a saved playlist. Found tracks
+    are returned in request order and unknown IDs are listed in 'missing'.
+    """
+    try:
+        projection = parse_fields(fields)
+        return await apify_service.run_blocking(apify_service.get_tracks_batch, video_ids, projection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tracks/changes", response_model=Dict)
+async def get_track_changes(
+    since: int = Query(..., ge=0, description="Catalog version the client has (X-Catalog-Version)")
+):
+    """
+    video_ids added, removed and updated since a catalog version. When
+    'reset' is true the change log no longer reaches back that far and the
+    client should refetch the tracks.
+    """
+    try:
+        return await apify_service.run_blocking(apify_service.get_changes, since)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/tracks/changes/stream")
+async def stream_track_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Catalog version the client has, to catch up from")
+):
+    """
+    Server-Sent Events stream with one 'changes' event (the /tracks/changes
+    body) per new catalog version. Event IDs are versions, so a reconnecting
+    EventSource resumes from Last-Event-ID.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(change_feed.events(since), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.get("/tracks/{video_id}", response_model=Dict)
 async def get_track_by_id(video_id: str):
     """Get a specific track by video ID"""
     try:
-        all_tracks = apify_service.get_all_tracks()
-        track = next((t for t in all_tracks if t['video_id'] == video_id), None)
+        track = await apify_service.run_blocking(apify_service.get_track, video_id)
         
         if not track:
             raise HTTPException(status_code=404, detail="Track not found")
         
         return track
+    except HTTPException:
+        raise
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/tracks/{video_id}/similar", response_model=Dict)
+async def get_similar_tracks(
+    video_id: str,
+    limit: int = Query(10, ge=1, le=50, description="Number of similar tracks to return")
+):
+    """Tracks similar to this one, best match first, each with a 'similarity' score"""
+    try:
+        result = await apify_service.run_blocking(apify_service.get_similar_tracks, video_id, limit)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Track not found")
+    return result
+
+@router.api_route("/tracks/{video_id}/audio", methods=["GET", "HEAD"])
+async def stream_track_audio(video_id: str, request: Request):
+    """
+    Stream a cached audio file. Supports Range requests (206) for seeking
+    and conditional requests via ETag/Last-Modified.
+    """
+    try:
+        track = await apify_service.run_blocking(apify_service.get_track, video_id)
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not track:
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    path = audio_downloader.get_track_path(video_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Audio not cached for this track")
+    
+    client = request.client.host if request.client else "unknown"
+    if not audio_streams.acquire(client):
+        raise HTTPException(status_code=429, detail="Too many concurrent audio streams",
+                            headers={"Retry-After": "5"})
+    
+    try:
+        return file_range_response(request, path, on_close=lambda: audio_streams.release(client))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio not cached for this track")
+
 @router.post("/tracks/reload")
 async def reload_tracks():
     """Manually force reload of APIFY data"""
     try:
-        result = apify_service.force_reload()
-        stats = apify_service.get_stats()
+        result = await apify_service.force_reload_async()
+        stats = await apify_service.run_blocking(apify_service.get_stats)
         result["stats"] = stats
         return result
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -84,11 +315,13 @@ async def reload_tracks():
 async def refresh_tracks():
     """Reload APIFY data (for backward compatibility)"""
     try:
-        result = apify_service.force_reload()
-        stats = apify_service.get_stats()
+        result = await apify_service.force_reload_async()
+        stats = await apify_service.run_blocking(apify_service.get_stats)
         return {
             "message": result["message"], 
             "stats": stats
         }
+    except ServiceUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
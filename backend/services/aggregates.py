@@ -0,0 +1,200 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def parse_duration(duration: str) -> int:
+    """Convert a "HH:MM:SS" / "MM:SS" duration string to seconds (0 if unparseable)"""
+    if not duration:
+        return 0
+    seconds = 0
+    try:
+        for part in duration.split(':'):
+            seconds = seconds * 60 + int(part)
+    except (ValueError, AttributeError):
+        return 0
+    return seconds
+
+
+class ChannelAggregate:
+    """Running totals for a single channel"""
+
+    __slots__ = ('channel_id', 'video_count', 'total_views', 'total_likes', 'total_comments',
+                 'total_duration', '_uploads')
+
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+        self.video_count = 0
+        self.total_views = 0
+        self.total_likes = 0
+        self.total_comments = 0
+        self.total_duration = 0
+        # (upload_date, video_id, title, url, subscribers) per track, kept
+        # sorted so the newest upload and removals are cheap to find
+        self._uploads: List[Tuple[str, str, str, str, int]] = []
+
+    def copy(self) -> 'ChannelAggregate':
+        clone = ChannelAggregate(self.channel_id)
+        for name in ChannelAggregate.__slots__[1:-1]:
+            setattr(clone, name, getattr(self, name))
+        clone._uploads = list(self._uploads)
+        return clone
+
+    @staticmethod
+    def _upload_entry(track: Dict) -> Tuple[str, str, str, str, int]:
+        return (track['upload_date'] or '', track['video_id'], track['channel_title'] or '',
+                track['channel_url'] or '', track['subscribers'] or 0)
+
+    def add(self, track: Dict):
+        self.video_count += 1
+        self.total_views += track['view_count'] or 0
+        self.total_likes += track['likes'] or 0
+        self.total_comments += track['comments_count'] or 0
+        self.total_duration += parse_duration(track['duration'])
+        insort(self._uploads, self._upload_entry(track))
+
+    def remove(self, track: Dict):
+        self.video_count -= 1
+        self.total_views -= track['view_count'] or 0
+        self.total_likes -= track['likes'] or 0
+        self.total_comments -= track['comments_count'] or 0
+        self.total_duration -= parse_duration(track['duration'])
+        entry = self._upload_entry(track)
+        index = bisect_left(self._uploads, entry)
+        if index < len(self._uploads) and self._uploads[index] == entry:
+            del self._uploads[index]
+
+    @property
+    def latest_upload(self) -> str:
+        return self._uploads[-1][0] if self._uploads else ''
+
+    def to_dict(self) -> Dict:
+        count = self.video_count or 1
+        # Channel metadata follows its most recently uploaded track, which
+        # carries the freshest subscriber count
+        _, _, title, url, subscribers = self._uploads[-1] if self._uploads else ('', '', '', '', 0)
+        return {
+            'channel_title': title,
+            'channel_id': self.channel_id,
+            'channel_url': url,
+            'subscribers': subscribers,
+            'video_count': self.video_count,
+            'total_views': self.total_views,
+            'avg_views': self.total_views // count,
+            'total_likes': self.total_likes,
+            'avg_likes': self.total_likes // count,
+            'total_comments': self.total_comments,
+            'avg_comments': self.total_comments // count,
+            'total_duration': self.total_duration,
+            'avg_duration': self.total_duration // count,
+            'latest_upload': self.latest_upload
+        }
+
+
+class CatalogAggregates:
+    """
+    Global and per-channel totals for the catalog, computed in a single pass
+    and updated in place as tracks are added or removed.
+
+    Aggregates attached to a published snapshot are treated as frozen; to
+    derive the next version, copy() them and apply the delta to the copy.
+    """
+
+    def __init__(self, tracks: Iterable[Dict] = ()):
+        self.track_count = 0
+        self.total_views = 0
+        self.total_likes = 0
+        self.total_comments = 0
+        self.total_duration = 0
+        self.channels: Dict[str, ChannelAggregate] = {}
+        self._sorted_channels: Optional[List[Dict]] = None
+        self._stats: Optional[Dict] = None
+        # Channels already copied away from the snapshot this was copied from
+        self._copied_channels: Optional[Set[str]] = None
+
+        for track in tracks:
+            self.add(track)
+
+    def copy(self) -> 'CatalogAggregates':
+        clone = CatalogAggregates()
+        clone.track_count = self.track_count
+        clone.total_views = self.total_views
+        clone.total_likes = self.total_likes
+        clone.total_comments = self.total_comments
+        clone.total_duration = self.total_duration
+        # Channel aggregates are copied lazily by _channel_for_update
+        clone.channels = dict(self.channels)
+        clone._copied_channels = set()
+        return clone
+
+    def _channel_for_update(self, channel_id: str) -> ChannelAggregate:
+        channel = self.channels.get(channel_id)
+        copied = self._copied_channels
+        if channel is None:
+            channel = self.channels[channel_id] = ChannelAggregate(channel_id)
+            if copied is not None:
+                copied.add(channel_id)
+        elif copied is not None and channel_id not in copied:
+            # Never mutate an aggregate shared with the previous snapshot
+            channel = self.channels[channel_id] = channel.copy()
+            copied.add(channel_id)
+        return channel
+
+    def add(self, track: Dict):
+        self.track_count += 1
+        self.total_views += track['view_count'] or 0
+        self.total_likes += track['likes'] or 0
+        self.total_comments += track['comments_count'] or 0
+        self.total_duration += parse_duration(track['duration'])
+        if track['channel_id']:
+            self._channel_for_update(track['channel_id']).add(track)
+        self._invalidate()
+
+    def remove(self, track: Dict):
+        self.track_count -= 1
+        self.total_views -= track['view_count'] or 0
+        self.total_likes -= track['likes'] or 0
+        self.total_comments -= track['comments_count'] or 0
+        self.total_duration -= parse_duration(track['duration'])
+        channel_id = track['channel_id']
+        if channel_id and channel_id in self.channels:
+            channel = self._channel_for_update(channel_id)
+            channel.remove(track)
+            if channel.video_count <= 0:
+                del self.channels[channel_id]
+        self._invalidate()
+
+    def _invalidate(self):
+        self._sorted_channels = None
+        self._stats = None
+
+    def channel_summaries(self) -> List[Dict]:
+        """Per-channel summaries, most subscribed first"""
+        if self._sorted_channels is None:
+            summaries = [channel.to_dict() for channel in self.channels.values()]
+            # Ties are broken by ID so incremental and full builds agree
+            summaries.sort(key=lambda channel: (-channel['subscribers'], channel['channel_id']))
+            self._sorted_channels = summaries
+        return self._sorted_channels
+
+    def stats(self) -> Dict:
+        """Catalog-wide statistics"""
+        if self._stats is None:
+            if not self.track_count:
+                self._stats = {}
+            else:
+                count = self.track_count
+                self._stats = {
+                    'total_tracks': count,
+                    'total_views': self.total_views,
+                    'total_likes': self.total_likes,
+                    'total_comments': self.total_comments,
+                    'unique_channels': len(self.channels),
+                    'avg_views_per_track': self.total_views // count,
+                    'avg_likes_per_track': self.total_likes // count,
+                    'avg_comments_per_track': self.total_comments // count,
+                    'total_duration': self.total_duration,
+                    'avg_duration': self.total_duration // count,
+                    'latest_upload': max((channel.latest_upload for channel in self.channels.values()),
+                                         default='')
+                }
+        return self._stats
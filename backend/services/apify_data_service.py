@@ -1,10 +1,54 @@
+import asyncio
+import base64
+import functools
+import gc
+import hashlib
 import json
 import os
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple
 from datetime import datetime
 import random
 import threading
 import time
+from array import array
+
+from services.catalog import CatalogDelta, CatalogSnapshot, SORT_KEYS, normalize_channel_name
+from services.change_log import ChangeLog, change_entry, merge_changes
+from services.query_cache import QueryCache, query_terms
+from services.facets import HASHTAG_FACET_SIZE, MAX_HASHTAG_FACET_SIZE
+from services.catalog_store import MappedCatalogSnapshot, copy_catalog, open_catalog, write_catalog
+from services.radio_queue import MAX_RADIO_BATCH_SIZE, RADIO_BATCH_SIZE, RadioQueue, normalize_hashtag
+from services.reload_scheduler import ReloadScheduler
+from services.response_cache import PreparedResponse
+from services.setlist_reader import SetlistReader
+from services.shared_catalog import SHARED_DIR, SharedCatalog, default_directory, sharing_enabled
+from services.similarity import MAX_SIMILAR, SimilarTracks
+from services.track_record import TrackRecord, project_track
+
+# How many past snapshots stay addressable by pagination cursors after a reload
+RETAINED_SNAPSHOTS = 4
+
+# Responses that are identical for every request against the same snapshot
+PREPARED_RESPONSES = ('tracks', 'channels', 'stats')
+
+# Binary catalog cache kept next to AI_Setlist.json so restarts skip the JSON
+# parse; "0" disables it
+CATALOG_CACHE = os.getenv("QUANTUM_RADIO_CATALOG_CACHE")
+
+# Seconds without another reload before the catalog cache is rewritten, so a
+# burst of reloads writes it once
+CACHE_WRITE_DELAY = float(os.getenv("QUANTUM_RADIO_CACHE_WRITE_DELAY", "2"))
+
+# Where the catalog lives: "memory" (snapshots, the default) or "sqlite"
+STORAGE_BACKEND = os.getenv("QUANTUM_RADIO_STORAGE", "memory")
+
+# Most video_ids one /tracks/batch request may look up
+MAX_TRACK_BATCH_SIZE = 500
+
+# Threads available to async routes for O(N) catalog work (search, filtering)
+BLOCKING_WORKERS = int(os.getenv("QUANTUM_RADIO_BLOCKING_WORKERS", "4"))
 
 # Try to import watchdog, but handle gracefully if not available
 try:
@@ -18,21 +62,23 @@ try:
         def __init__(self, data_service):
             super().__init__()
             self.data_service = data_service
-            self.last_modified = 0
+            self.file_name = os.path.basename(data_service.data_file)
             
+        def _is_target(self, event, path: str) -> bool:
+            return not event.is_directory and os.path.basename(path) == self.file_name
+        
         def on_modified(self, event):
-            if event.is_directory:
-                return
-                
-            # Check if it's our target file
-            if os.path.basename(event.src_path) == "AI_Setlist.json":
-                # Debounce rapid file changes (some editors save multiple times)
-                current_time = time.time()
-                if current_time - self.last_modified > 1:  # 1 second debounce
-                    self.last_modified = current_time
-                    print(f"Detected change in {event.src_path}, reloading data...")
-                    # Use a small delay to ensure file write is complete
-                    threading.Timer(0.5, self.data_service._reload_data).start()
+            if self._is_target(event, event.src_path):
+                self.data_service.schedule_reload()
+        
+        def on_created(self, event):
+            if self._is_target(event, event.src_path):
+                self.data_service.schedule_reload()
+        
+        def on_moved(self, event):
+            # Atomic saves write a temp file and rename it over the target
+            if self._is_target(event, event.dest_path):
+                self.data_service.schedule_reload()
     
 except ImportError:
     print("Warning: watchdog library not available. File watching will be disabled.")
@@ -45,23 +91,249 @@ except ImportError:
         def __init__(self, data_service):
             pass
 
+class CatalogLoadError(Exception):
+    """Raised when the setlist cannot be parsed or fails validation; the current catalog stays in place"""
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor is malformed or used with different filters"""
+
+
+class ExpiredCursorError(InvalidCursorError):
+    """Raised when a cursor refers to a catalog version that is no longer retained"""
+
+
+class ServiceUnavailableError(Exception):
+    """Raised when a query cannot get a database connection in time; routes answer 503"""
+
+
 class ApifyDataService:
+    # Responses get_prepared_response() serves, built before each version is published
+    prepared_responses = PREPARED_RESPONSES
+    
     def __init__(self):
         self.data_file = os.path.join(os.path.dirname(__file__), "..", "..", "AI_Setlist.json")
-        self._data = None
-        self._data_lock = threading.RLock()  # Thread-safe access to data
+        self._current = CatalogSnapshot.build(0, [])
+        self._recent_snapshots: Dict[int, CatalogSnapshot] = OrderedDict()
+        self._data_lock = threading.RLock()  # Serializes loads; readers use the snapshot
         self._observer = None
         self._file_handler = None
         self._watcher_enabled = WATCHDOG_AVAILABLE
+        # Bounded pools so heavy work never runs on the event loop; reloads get
+        # their own thread so they cannot starve queries (or vice versa)
+        self._executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="catalog-query")
+        self._reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-reload")
+        # (size, mtime_ns, sha256) of the file behind the current snapshot
+        self._loaded_fingerprint = None
+        # File events only ever request a reload; one worker coalesces and runs them
+        self._reload_scheduler = ReloadScheduler(self._reload_data)
+        # Which video_ids recent versions changed, for clients that sync incrementally
+        self._change_log = ChangeLog()
+        # Sampling pools and per-session play history for /tracks/queue
+        self._radio = RadioQueue()
+        # Feature index behind /tracks/{video_id}/similar, built on first use
+        self._similar = SimilarTracks()
+        # Search and filter results for the current version, for type-ahead
+        self._query_cache = QueryCache()
         
-        # Load initial data
-        self._load_data()
-        
-        # Start file watching if available
+        self._shared = None
+        self._unusable_version = None
+        # Where the current snapshot came from: "cache", "shared" or "json"
+        self._loaded_from = None
+        self._cache_file = (None if CATALOG_CACHE == "0" else
+                            CATALOG_CACHE or os.path.splitext(self.data_file)[0] + ".catalog")
+        # The cache is written off the data lock: reloads leave the latest
+        # (snapshot, metadata) here and one worker saves it once they settle
+        self._pending_cache = None
+        # (version, source fingerprint) of the catalog in the cache file
+        self._cache_fingerprint = None
+        self._cache_writer = ReloadScheduler(self._save_cache, CACHE_WRITE_DELAY, name="catalog-cache-writer")
+        self._loader = None
+        self._ready = threading.Event()
+        self._startup_duration = None
+    
+    def start(self):
+        """
+        Load the catalog and start watching the file on a background thread,
+        so the server can accept connections meanwhile (see is_ready()).
+        Calling it again does nothing.
+        """
+        with self._data_lock:
+            if self._loader is not None:
+                return
+            self._loader = threading.Thread(target=self._startup, name="catalog-loader", daemon=True)
+            self._loader.start()
+    
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        self.start()
+        return self._ready.wait(timeout)
+    
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+    
+    def _startup(self):
+        started = time.perf_counter()
+        try:
+            # With several worker processes only the coordinator loads and watches
+            # the file; the others map the catalog it publishes
+            if sharing_enabled():
+                self._shared = SharedCatalog(SHARED_DIR or default_directory(self.data_file),
+                                             on_promoted=self._on_promoted,
+                                             on_reload_request=lambda: self.force_reload()['success'])
+                if not self._shared.start():
+                    self._follow()
+                    print(f"Following the shared catalog in {self._shared.directory} "
+                          f"(version {self._current.version}, {len(self._current)} tracks)")
+                    return
+                # A catalog published by an earlier coordinator is reused when the file has not changed since
+                self._follow()
+                print(f"Coordinating the shared catalog in {self._shared.directory}")
+            
+            if not self._current.tracks:
+                self._attach_cache()
+            if self._shared is not None and self._current.version < self._shared.published_version():
+                self._current = CatalogSnapshot.build(self._shared.published_version(), [])
+            
+            # Load initial data; a no-op when the mapped catalog matches the file
+            try:
+                self._load_data()
+            except CatalogLoadError as e:
+                print(f"Starting with {len(self._current)} tracks: {e}")
+            
+            # Start file watching if available
+            if WATCHDOG_AVAILABLE:
+                self._start_file_watcher()
+            else:
+                print("File watching disabled - watchdog library not available")
+        finally:
+            self._startup_duration = time.perf_counter() - started
+            self._ready.set()
+            print(f"Catalog ready in {self._startup_duration * 1000:.0f}ms "
+                  f"({len(self._current)} tracks from {self._loaded_from or 'nowhere'})")
+    
+    def _attach_cache(self):
+        """
+        Map the binary catalog cache written by an earlier run. _load_data()
+        then keeps it if the source still has the size, mtime (or failing
+        that, the hash) it was built from, and reparses the JSON otherwise.
+        """
+        if not self._cache_file:
+            return
+        try:
+            snapshot = open_catalog(self._cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring catalog cache {self._cache_file}: {e}")
+            return
+        source = snapshot.catalog.metadata.get('source')
+        if not source:
+            return
+        if self._shared is not None and snapshot.version <= self._shared.published_version():
+            # Versions must keep increasing for the followers
+            return
+        with self._data_lock:
+            self._loaded_fingerprint = tuple(source)
+            self._cache_fingerprint = (snapshot.version, tuple(source))
+            self._loaded_from = "cache"
+            self._change_log.adopt(snapshot.catalog.metadata.get('history', ()))
+            self._retain(snapshot)
+            self._current = snapshot
+        if self._shared is not None:
+            self._publish(snapshot, CatalogDelta().counts())
+    
+    def _schedule_cache_write(self, snapshot: CatalogSnapshot, changes: Dict[str, int]):
+        """Have the cache writer save this snapshot once reloads settle"""
+        self._pending_cache = (snapshot, self._catalog_metadata(changes))
+        self._cache_writer.request()
+    
+    def _save_cache(self) -> str:
+        """
+        Write the binary catalog cache for the next start (run by the cache
+        writer, without the data lock); returns the outcome. Only the latest
+        pending snapshot is written, and not again if the cache holds it.
+        """
+        snapshot, metadata = self._pending_cache
+        fingerprint = (snapshot.version, tuple(metadata['source']))
+        if fingerprint == self._cache_fingerprint:
+            return "unchanged"
+        started = time.perf_counter()
+        try:
+            if self._shared is not None and self._shared.published_version() == snapshot.version:
+                # Already serialized for the followers
+                copy_catalog(self._shared.catalog_path(snapshot.version), self._cache_file)
+            else:
+                write_catalog(snapshot, self._cache_file, metadata)
+        except OSError as e:
+            print(f"Error writing catalog cache {self._cache_file}: {e}")
+            return "failed"
+        self._cache_fingerprint = fingerprint
+        print(f"Wrote catalog cache in {time.perf_counter() - started:.2f}s")
+        return "written"
+    
+    def _catalog_metadata(self, changes: Dict[str, int]) -> Dict:
+        return {'source': list(self._loaded_fingerprint), 'changes': changes, 'history': self._change_log.entries()}
+    
+    @property
+    def _snapshot(self) -> CatalogSnapshot:
+        """The current snapshot; followers first check for a newer published version"""
+        shared = self._shared
+        if shared is not None and not shared.is_coordinator:
+            self._follow()
+        return self._current
+    
+    def _follow(self):
+        """Map the version the coordinator published last, unless it is the current one"""
+        version = self._shared.published_version()
+        if version == self._current.version or version == self._unusable_version:
+            return
+        with self._data_lock:
+            if version == self._current.version:
+                return
+            snapshot = self._shared.open_version(version)
+            if snapshot is None:
+                self._unusable_version = version
+                return
+            source = snapshot.catalog.metadata.get('source')
+            self._loaded_fingerprint = tuple(source) if source else None
+            self._loaded_from = "shared"
+            self._change_log.adopt(snapshot.catalog.metadata.get('history', ()))
+            self._retain(snapshot)
+            self._current = snapshot
+    
+    def _on_promoted(self):
+        """This worker became the coordinator: catch up with the file and start watching it"""
+        try:
+            self._follow()
+            self._load_data()
+        except CatalogLoadError as e:
+            print(f"Keeping the shared catalog: {e}")
         if WATCHDOG_AVAILABLE:
             self._start_file_watcher()
-        else:
-            print("File watching disabled - watchdog library not available")
+    
+    def _publish(self, snapshot: CatalogSnapshot, changes: Dict[str, int]):
+        """Hand a new snapshot to the follower workers"""
+        started = time.perf_counter()
+        try:
+            size = self._shared.publish(snapshot, self._catalog_metadata(changes))
+        except OSError as e:
+            print(f"Error publishing catalog version {snapshot.version}: {e}")
+            return
+        print(f"Published catalog version {snapshot.version} ({size / 1024 / 1024:.1f} MB) "
+              f"in {time.perf_counter() - started:.2f}s")
+    
+    def _retain(self, snapshot: CatalogSnapshot):
+        """Keep a snapshot addressable by pagination cursors"""
+        self._recent_snapshots[snapshot.version] = snapshot
+        while len(self._recent_snapshots) > RETAINED_SNAPSHOTS:
+            self._recent_snapshots.popitem(last=False)
+    
+    def _retained_snapshot(self, version: int) -> Optional[CatalogSnapshot]:
+        snapshot = self._recent_snapshots.get(version)
+        if snapshot is None and self._shared is not None:
+            # Another worker issued the cursor for a version this one skipped
+            snapshot = self._shared.open_version(version)
+        return snapshot
     
     def _start_file_watcher(self):
         """Start monitoring the JSON file for changes"""
@@ -70,9 +342,8 @@ class ApifyDataService:
             
         try:
             if not os.path.exists(self.data_file):
-                print(f"Warning: Data file {self.data_file} does not exist yet. File watcher will start when file is created.")
-                return
-                
+                print(f"Warning: Data file {self.data_file} does not exist yet. It will be loaded once it is created.")
+            
             # Set up file watcher
             self._file_handler = ApifyFileHandler(self)
             self._observer = Observer()
@@ -95,125 +366,460 @@ class ApifyDataService:
             try:
                 self._observer.stop()
                 self._observer.join()
+                self._observer = None
                 print("Stopped file watcher")
             except Exception as e:
                 print(f"Error stopping file watcher: {e}")
     
-    def _reload_data(self):
-        """Reload data from file (called by file watcher)"""
+    def schedule_reload(self):
+        """Request a reload from the file (coalesced with any already pending)"""
+        self._reload_scheduler.request()
+    
+    def _reload_data(self) -> str:
+        """Reload data from file (run by the reload scheduler); returns the outcome"""
         with self._data_lock:
-            print("Reloading AI_Setlist.json data...")
-            old_count = len(self._data) if self._data else 0
-            self._load_data()
-            new_count = len(self._data) if self._data else 0
-            print(f"Data reloaded: {old_count} -> {new_count} tracks")
+            _, old_count = self._catalog_state()
+            changes = self._load_data()
+            if changes is None:
+                print("AI_Setlist.json is unchanged, skipping reload")
+                return "unchanged"
+            _, new_count = self._catalog_state()
+            print(f"Data reloaded: {old_count} -> {new_count} tracks "
+                  f"({changes['added']} added, {changes['removed']} removed, {changes['updated']} updated)")
+            return "reloaded"
     
-    def _load_data(self):
-        """Load the APIFY scraped data"""
+    def _file_fingerprint(self):
+        """(size, mtime_ns) of the data file, or None if it does not exist"""
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self._data = json.load(f)
-            print(f"Loaded {len(self._data)} tracks from APIFY data")
+            stat_result = os.stat(self.data_file)
         except FileNotFoundError:
-            print(f"Data file {self.data_file} not found. Starting with empty dataset.")
-            self._data = []
-        except json.JSONDecodeError as e:
-            print(f"Invalid JSON in data file: {e}")
-            self._data = []
-        except Exception as e:
-            print(f"Error loading APIFY data: {e}")
-            self._data = []
+            return None
+        return stat_result.st_size, stat_result.st_mtime_ns
     
-    def get_all_tracks(self) -> List[Dict]:
-        """Get all tracks in the format expected by the frontend"""
+    def _file_digest(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.data_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _load_data(self, force: bool = False) -> Optional[Dict[str, int]]:
+        """
+        Load the APIFY scraped data and swap in a new catalog snapshot.
+        
+        Unless forced, the file is not reparsed when its size and mtime, or
+        failing that its content hash, match the loaded version; None is
+        returned then. A file that cannot be parsed or validated raises
+        CatalogLoadError and leaves the current snapshot in place.
+        
+        The new content is diffed against the current snapshot by video_id and
+        only the added, removed and updated tracks are applied to the indexes
+        and aggregates. Returns the change counts.
+        """
         with self._data_lock:
-            if not self._data:
-                self._load_data()
+            previous = self._snapshot
+            stat_key = self._file_fingerprint()
+            if stat_key is None:
+                if previous.tracks:
+                    raise CatalogLoadError(f"Data file {self.data_file} not found; keeping the current catalog")
+                print(f"Data file {self.data_file} not found. Starting with empty dataset.")
+                return None
+            
+            loaded = self._loaded_fingerprint
+            if not force and loaded is not None:
+                if stat_key == loaded[:2]:
+                    return None
+                digest = self._file_digest()
+                if digest == loaded[2]:
+                    # Rewritten with identical content (touch, atomic re-save)
+                    self._loaded_fingerprint = stat_key + (digest,)
+                    return None
+            
+            try:
+                reader = SetlistReader(self.data_file)
+                tracks = list(self._read_tracks(reader, previous))
+            except json.JSONDecodeError as e:
+                raise CatalogLoadError(f"Invalid JSON in data file: {e}") from e
+            except (OSError, UnicodeDecodeError) as e:
+                raise CatalogLoadError(f"Error reading APIFY data: {e}") from e
+            if reader.item_count and not tracks:
+                raise CatalogLoadError(f"None of the {reader.item_count} items in the data file is a valid track")
+            print(f"Loaded {len(tracks)} tracks from {reader.item_count} APIFY items")
+            self._loaded_fingerprint = stat_key + (reader.sha256,)
+            self._loaded_from = "json"
+            
+            delta = CatalogDelta.between(previous, tracks)
+            if not delta and all(new['video_id'] == old['video_id'] for new, old in zip(tracks, previous.tracks)):
+                # Nothing changed (not even the order): keep the current
+                # version and its caches
+                return delta.counts()
             
-            tracks = []
-            for item in self._data:
-                track = self._format_track(item)
-                if track:
-                    tracks.append(track)
+            if not previous.tracks or not previous.incremental:
+                snapshot = CatalogSnapshot.build(previous.version + 1, tracks)
+            else:
+                snapshot = CatalogSnapshot.derive(previous, previous.version + 1, tracks, delta)
             
-            return tracks
+            # Serialize and compress the common responses before publishing, so
+            # no request (and no event loop) ever has to build them inline
+            for name in self.prepared_responses:
+                self.get_prepared_response(name, snapshot)
+            
+            # Rebinding the attribute is atomic; readers holding the previous
+            # snapshot keep a consistent view until they are done with it.
+            self._change_log.record(change_entry(previous.version, snapshot.version, *delta.video_ids()))
+            self._retain(snapshot)
+            self._current = snapshot
+            
+            # The catalog's objects live until a later reload replaces them,
+            # and reference counting frees them then. Take them out of the
+            # collector's view: a full collection over every track holds the
+            # GIL long enough to stall the event loop during the next reload.
+            gc.freeze()
+            if self._shared is not None and self._shared.is_coordinator:
+                self._publish(snapshot, delta.counts())
+            if self._cache_file:
+                self._schedule_cache_write(snapshot, delta.counts())
+        
+        return delta.counts()
+    
+    def _read_tracks(self, reader: SetlistReader, previous: CatalogSnapshot) -> Iterator[TrackRecord]:
+        """
+        Stream track records out of the setlist, skipping duplicate IDs.
+        Records identical to the previous snapshot's are swapped for the
+        existing objects right away, so unchanged tracks are never held twice.
+        """
+        seen_ids = set()
+        old_by_id = previous.by_id if previous.incremental else {}
+        for item in reader:
+            track = self._format_track(item)
+            if not track or track['video_id'] in seen_ids:
+                continue
+            seen_ids.add(track['video_id'])
+            record = TrackRecord.from_dict(track)
+            old = old_by_id.get(record.video_id)
+            yield old if old == record else record
+    
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        Run a synchronous service call on the bounded query pool, so async
+        routes can await O(N) work without stalling the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    async def force_reload_async(self) -> Dict:
+        """force_reload() on the dedicated reload thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reload_executor, self.force_reload)
+    
+    def _catalog_state(self) -> Tuple[int, int]:
+        """Version and track count of the current catalog"""
+        snapshot = self._snapshot
+        return snapshot.version, len(snapshot)
+    
+    def get_changes(self, since: Optional[int] = None, until: Optional[int] = None) -> Dict:
+        """
+        The video_ids added, removed and updated between version since and
+        version until (both default to the current version). 'reset' is set
+        when the change log no longer covers that range.
+        """
+        version = self._catalog_state()[0]
+        until = version if until is None else min(until, version)
+        return merge_changes(self._change_entries(), until if since is None else since, until)
+    
+    def _change_entries(self) -> List[Dict]:
+        return self._change_log.entries()
+    
+    def get_all_tracks(self) -> List[Dict]:
+        """Get all tracks in the format expected by the frontend"""
+        return [track.to_dict() for track in self._snapshot.tracks]
     
     def get_random_track(self) -> Optional[Dict]:
         """Get a random track"""
-        with self._data_lock:
-            if not self._data:
-                return None
-            
-            random_item = random.choice(self._data)
-            return self._format_track(random_item)
+        tracks = self._snapshot.tracks
+        if not tracks:
+            return None
+        
+        return random.choice(tracks).to_dict()
+    
+    def get_radio_queue(self, session: Optional[str] = None, count: int = RADIO_BATCH_SIZE,
+                        weighting: str = 'uniform', channel: Optional[str] = None,
+                        hashtag: Optional[str] = None) -> Dict:
+        """
+        The next tracks of a radio session: drawn from the current catalog
+        (optionally one channel or hashtag), weighted by views, likes or
+        recency, and not repeating what the session heard recently. A new
+        session ID is issued when none is given.
+        """
+        self._radio.validate(weighting, session)
+        count = max(1, min(count, MAX_RADIO_BATCH_SIZE))
+        snapshot = self._snapshot
+        pool = self._radio.pool(self._radio_key(snapshot.version, weighting, channel, hashtag),
+                                lambda: self._radio_candidates(snapshot, channel, hashtag), weighting)
+        session, video_ids = self._radio.deal(session, pool, count)
+        return {
+            'session': session,
+            'tracks': [snapshot.by_id[video_id].to_dict() for video_id in video_ids],
+            'pool_size': len(pool),
+            'version': snapshot.version
+        }
+    
+    @staticmethod
+    def _radio_key(version: int, weighting: str, channel: Optional[str], hashtag: Optional[str]) -> Tuple:
+        return (version, weighting, normalize_channel_name(channel) if channel else None,
+                normalize_hashtag(hashtag) if hashtag else None)
+    
+    def _radio_candidates(self, snapshot: CatalogSnapshot, channel: Optional[str],
+                          hashtag: Optional[str]) -> Sequence[TrackRecord]:
+        tracks = self._filter_tracks(snapshot, None, channel, bool(hashtag), None, 'desc')
+        if hashtag:
+            tag = normalize_hashtag(hashtag)
+            tracks = [track for track in tracks if any(normalize_hashtag(str(h)) == tag for h in track['hashtags'])]
+        return tracks
+    
+    def get_track(self, video_id: str) -> Optional[Dict]:
+        """Get a single track by its video ID"""
+        track = self._snapshot.by_id.get(video_id)
+        return track.to_dict() if track else None
+    
+    def get_tracks_batch(self, video_ids: Sequence[str], fields: Optional[Sequence[str]] = None) -> Dict:
+        """
+        Look up many tracks in one read of the current snapshot. Found tracks
+        come back in request order (duplicates once), unknown IDs in 'missing'.
+        """
+        video_ids = self._batch_ids(video_ids)
+        snapshot = self._snapshot
+        by_id = snapshot.by_id
+        found = [by_id[video_id] for video_id in video_ids if video_id in by_id]
+        return {
+            'tracks': [project_track(track, fields) for track in found],
+            'missing': [video_id for video_id in video_ids if video_id not in by_id],
+            'version': snapshot.version
+        }
+    
+    @staticmethod
+    def _batch_ids(video_ids: Sequence[str]) -> List[str]:
+        """Request order without duplicates, rejecting batches over MAX_TRACK_BATCH_SIZE"""
+        if len(video_ids) > MAX_TRACK_BATCH_SIZE:
+            raise ValueError(f"At most {MAX_TRACK_BATCH_SIZE} video_ids can be looked up at once")
+        return list(dict.fromkeys(video_ids))
+    
+    def get_similar_tracks(self, video_id: str, limit: int = 10) -> Optional[Dict]:
+        """
+        The tracks most similar to a track (by title, hashtags, search query,
+        channel, views and duration), each with its 'similarity' score.
+        None if the track does not exist.
+        """
+        snapshot = self._snapshot
+        track = snapshot.by_id.get(video_id)
+        if track is None:
+            return None
+        index = self._similar.index(snapshot.version, lambda: (snapshot.version, snapshot.tracks), self.get_changes)
+        tracks = []
+        # While a reload's index is being built the previous one answers;
+        # tracks that have left the catalog since are skipped
+        for similar_id, score in index.similar(track, MAX_SIMILAR):
+            similar = snapshot.by_id.get(similar_id)
+            if similar is not None:
+                tracks.append(dict(similar.to_dict(), similarity=score))
+                if len(tracks) >= limit:
+                    break
+        return {'video_id': video_id, 'tracks': tracks, 'version': snapshot.version}
     
     def get_tracks_by_channel(self, channel_name: str) -> List[Dict]:
-        """Get tracks filtered by channel name"""
-        with self._data_lock:
-            if not self._data:
-                return []
-            
-            tracks = []
-            for item in self._data:
-                if item.get('channelName', '').lower() == channel_name.lower():
-                    track = self._format_track(item)
-                    if track:
-                        tracks.append(track)
-            
-            return tracks
+        """Get tracks filtered by channel name (case-insensitive)"""
+        tracks = self._snapshot.by_channel_name.get(normalize_channel_name(channel_name), ())
+        return [track.to_dict() for track in tracks]
+    
+    def get_tracks_by_channel_id(self, channel_id: str) -> List[Dict]:
+        """Get tracks filtered by channel ID"""
+        return [track.to_dict() for track in self._snapshot.by_channel_id.get(channel_id, ())]
     
     def search_tracks(self, query: str) -> List[Dict]:
-        """Search tracks by title, channel name, or description"""
-        with self._data_lock:
-            if not self._data:
-                return []
-            
-            query = query.lower()
-            tracks = []
-            
-            for item in self._data:
-                # Search in title, channel name, and description
-                searchable_text = " ".join([
-                    item.get('title', ''),
-                    item.get('channelName', ''),
-                    item.get('text', '')
-                ]).lower()
-                
-                if query in searchable_text:
-                    track = self._format_track(item)
-                    if track:
-                        tracks.append(track)
-            
-            return tracks
+        """
+        Search tracks by title, channel name, hashtags, or description.
+        Every query word must match (as a whole word or word prefix); results
+        are ranked by the field they matched in and by view count.
+        """
+        snapshot = self._snapshot
+        by_id = snapshot.by_id
+        return [by_id[video_id].to_dict()
+                for video_id in snapshot.search_index.video_ids(self._search_ordinals(snapshot, query))]
+    
+    def _search_ordinals(self, snapshot: CatalogSnapshot, query: str) -> Sequence[int]:
+        """
+        Search index ordinals matching a query, best first, through the query
+        cache. A query that extends a cached one (more letters or more words)
+        only scores the cached matches.
+        """
+        if snapshot is not self._current:
+            # Only the current version is cached (this is a cursor into a retained one)
+            return snapshot.search_index.rank(query)
+        key = ('search', query_terms(query))
+        ranked = self._query_cache.get(snapshot.version, key)
+        if ranked is None:
+            within = self._query_cache.narrowest(snapshot.version, key)
+            ranked = array('I', snapshot.search_index.rank(query, within))
+            self._query_cache.put(snapshot.version, key, ranked)
+        return ranked
+    
+    def query_tracks(self, search: Optional[str] = None, channel: Optional[str] = None,
+                     has_hashtags: bool = False, sort: Optional[str] = None, order: str = 'desc',
+                     cursor: Optional[str] = None, limit: Optional[int] = None,
+                     fields: Optional[Sequence[str]] = None, stream: bool = False) -> Dict:
+        """
+        Filter, sort and paginate tracks in one pass over the current snapshot.
+        
+        Returns a page of tracks together with the total number of matches and
+        an opaque cursor for the next page. Cursors pin the snapshot version they
+        were issued for, so paging stays consistent across reloads as long as
+        that version is still retained.
+        
+        fields limits every track to those fields. With stream=True, 'tracks'
+        is an iterator that formats each track as it is consumed, so a full
+        listing is never held in memory at once.
+        """
+        if sort is not None and sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{sort}', expected one of: {', '.join(SORT_KEYS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("Sort order must be 'asc' or 'desc'")
+        
+        fingerprint = self._query_fingerprint(search, channel, has_hashtags, sort, order)
+        snapshot = self._snapshot
+        offset = 0
+        if cursor:
+            version, offset = self._decode_cursor(cursor, fingerprint)
+            snapshot = self._retained_snapshot(version)
+            if snapshot is None:
+                raise ExpiredCursorError("Cursor refers to a catalog version that is no longer available")
+        
+        matches = self._filter_tracks(snapshot, search, channel, has_hashtags, sort, order)
+        end = len(matches) if limit is None else min(offset + limit, len(matches))
+        
+        tracks = (project_track(track, fields) for track in matches[offset:end])
+        return {
+            'tracks': tracks if stream else list(tracks),
+            'total': len(matches),
+            'next_cursor': (self._encode_cursor(snapshot.version, end, fingerprint)
+                            if end < len(matches) else None),
+            'version': snapshot.version
+        }
+    
+    def _filter_tracks(self, snapshot: CatalogSnapshot, search: Optional[str], channel: Optional[str],
+                       has_hashtags: bool, sort: Optional[str], order: str) -> Sequence[TrackRecord]:
+        """
+        Resolve filters against the snapshot indexes and apply the requested
+        order. Filtered results are cached for the current version.
+        """
+        key = None
+        if (search or channel or has_hashtags) and snapshot is self._current:
+            key = ('query', query_terms(search) if search else None,
+                   normalize_channel_name(channel) if channel else None, has_hashtags, sort, order)
+            cached = self._query_cache.get(snapshot.version, key)
+            if cached is not None:
+                return cached
+            if search and sort is not None:
+                # A query this one extends was already filtered and sorted;
+                # keeping its tracks that still match skips the sort
+                wider = self._query_cache.narrowest(snapshot.version, key)
+                if wider is not None:
+                    index = snapshot.search_index
+                    matches = set(index.video_ids(self._search_ordinals(snapshot, search)))
+                    candidates = [track for track in wider if track['video_id'] in matches]
+                    self._query_cache.put(snapshot.version, key, candidates)
+                    return candidates
+        
+        candidates = None
+        if search:
+            by_id = snapshot.by_id
+            index = snapshot.search_index
+            candidates = [by_id[video_id] for video_id in index.video_ids(self._search_ordinals(snapshot, search))]
+        if channel:
+            channel_tracks = snapshot.by_channel_name.get(normalize_channel_name(channel), ())
+            if candidates is None:
+                candidates = channel_tracks
+            else:
+                channel_ids = {track['video_id'] for track in channel_tracks}
+                candidates = [track for track in candidates if track['video_id'] in channel_ids]
+        
+        if sort is not None:
+            ordered, ranks = snapshot.ordering(sort)
+            if candidates is None:
+                candidates = ordered
+            else:
+                # Small result sets are ordered by their precomputed rank
+                candidates = sorted(candidates, key=lambda track: ranks[track['video_id']])
+            if order == 'desc':
+                candidates = candidates[::-1]
+        elif candidates is None:
+            candidates = snapshot.tracks
+        
+        if has_hashtags:
+            candidates = [track for track in candidates if track['hashtags']]
+        
+        if key is not None:
+            self._query_cache.put(snapshot.version, key, candidates)
+        return candidates
+    
+    def get_facets(self, search: Optional[str] = None, channel: Optional[str] = None,
+                   has_hashtags: bool = False, hashtag_limit: int = HASHTAG_FACET_SIZE) -> Dict:
+        """
+        Counts per channel, top hashtags, duration buckets, upload months and
+        view count bins for the tracks matching the same filters as
+        query_tracks(). Channel counts ignore the channel filter.
+        """
+        hashtag_limit = max(1, min(hashtag_limit, MAX_HASHTAG_FACET_SIZE))
+        snapshot = self._snapshot
+        matches = snapshot.search_index.video_ids(self._search_ordinals(snapshot, search)) if search else None
+        facets = snapshot.facets().facets(matches, normalize_channel_name(channel) if channel else None,
+                                          has_hashtags, hashtag_limit)
+        facets['version'] = snapshot.version
+        return facets
+    
+    @staticmethod
+    def _query_fingerprint(*params) -> str:
+        """Short digest of the query parameters a cursor was issued for"""
+        return hashlib.sha1(repr(params).encode('utf-8')).hexdigest()[:12]
+    
+    @staticmethod
+    def _encode_cursor(version: int, offset: int, fingerprint: str) -> str:
+        payload = json.dumps({'v': version, 'o': offset, 'q': fingerprint}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str, fingerprint: str):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            version, offset, query = int(payload['v']), int(payload['o']), payload['q']
+        except (ValueError, KeyError, TypeError, UnicodeEncodeError):
+            raise InvalidCursorError("Malformed pagination cursor")
+        if query != fingerprint or offset < 0:
+            raise InvalidCursorError("Cursor does not match the requested filters")
+        return version, offset
+    
+    def get_prepared_response(self, name: str, snapshot: Optional[CatalogSnapshot] = None) -> PreparedResponse:
+        """
+        Get the serialized (and pre-compressed) body of a common response for
+        the current snapshot. Bodies are built once per catalog version.
+        """
+        snapshot = snapshot or self._snapshot
+        prepared = snapshot.responses.get(name)
+        if prepared is None:
+            if name == 'tracks':
+                payload = [track.to_dict() for track in snapshot.tracks]
+            elif name == 'channels':
+                payload = snapshot.aggregates.channel_summaries()
+            elif name == 'stats':
+                payload = snapshot.aggregates.stats()
+            else:
+                raise KeyError(f"No prepared response named '{name}'")
+            prepared = snapshot.responses[name] = PreparedResponse(snapshot.version, payload)
+        return prepared
     
     def get_channels_summary(self) -> List[Dict]:
-        """Get a summary of all unique channels with their stats"""
-        with self._data_lock:
-            if not self._data:
-                return []
-            
-            channels = {}
-            
-            for item in self._data:
-                channel_name = item.get('channelName')
-                channel_id = item.get('channelId')
-                
-                if channel_name and channel_id:
-                    if channel_id not in channels:
-                        channels[channel_id] = {
-                            'channel_title': channel_name,
-                            'channel_id': channel_id,
-                            'channel_url': item.get('channelUrl', ''),
-                            'subscribers': item.get('numberOfSubscribers', 0),
-                            'video_count': 0,
-                            'total_views': 0,
-                            'avg_duration': 0
-                        }
-                    
-                    channels[channel_id]['video_count'] += 1
-                    channels[channel_id]['total_views'] += item.get('viewCount', 0)
-            
-            return list(channels.values())
+        """Get a summary of all unique channels with their stats, most subscribed first"""
+        return list(self._snapshot.aggregates.channel_summaries())
     
     def _format_track(self, item: Dict) -> Optional[Dict]:
         """Format APIFY data item to match the frontend's expected track format"""
@@ -256,37 +862,60 @@ class ApifyDataService:
     
     def get_stats(self) -> Dict:
         """Get overall statistics about the dataset"""
-        with self._data_lock:
-            if not self._data:
-                return {}
-            
-            total_views = sum(item.get('viewCount', 0) for item in self._data)
-            total_likes = sum(item.get('likes', 0) for item in self._data)
-            unique_channels = len(set(item.get('channelId') for item in self._data if item.get('channelId')))
-            
-            return {
-                'total_tracks': len(self._data),
-                'total_views': total_views,
-                'total_likes': total_likes,
-                'unique_channels': unique_channels,
-                'avg_views_per_track': total_views // len(self._data) if self._data else 0,
-                'avg_likes_per_track': total_likes // len(self._data) if self._data else 0
-            }
+        return dict(self._snapshot.aggregates.stats())
     
     def force_reload(self) -> Dict:
         """Manually force a reload of the data (useful for API endpoint)"""
+        if self._shared is not None and not self._shared.is_coordinator:
+            return self._request_shared_reload()
         with self._data_lock:
-            old_count = len(self._data) if self._data else 0
-            self._load_data()
-            new_count = len(self._data) if self._data else 0
+            old_version, old_count = self._catalog_state()
+            try:
+                changes = self._load_data(force=True) or CatalogDelta().counts()
+            except CatalogLoadError as e:
+                return {
+                    'success': False,
+                    'message': f'Reload rejected, keeping {old_count} tracks: {e}',
+                    'old_count': old_count,
+                    'new_count': old_count,
+                    'version': old_version,
+                    'changes': CatalogDelta().counts()
+                }
+            version, new_count = self._catalog_state()
             
             return {
                 'success': True,
                 'message': f'Data reloaded: {old_count} -> {new_count} tracks',
                 'old_count': old_count,
-                'new_count': new_count
+                'new_count': new_count,
+                'version': version,
+                'changes': changes
             }
     
+    def _request_shared_reload(self) -> Dict:
+        """force_reload() in a follower: the coordinator reloads, this worker maps the result"""
+        old_snapshot = self._snapshot
+        old_count = len(old_snapshot)
+        succeeded = self._shared.request_reload()
+        snapshot = self._snapshot
+        changes = CatalogDelta().counts()
+        if snapshot.version != old_snapshot.version and isinstance(snapshot, MappedCatalogSnapshot):
+            changes = snapshot.catalog.metadata.get('changes', changes)
+        if succeeded:
+            message = f'Data reloaded: {old_count} -> {len(snapshot)} tracks'
+        elif succeeded is None:
+            message = f'Timed out waiting for the catalog coordinator, keeping {old_count} tracks'
+        else:
+            message = f'Reload rejected, keeping {old_count} tracks'
+        return {
+            'success': bool(succeeded),
+            'message': message,
+            'old_count': old_count,
+            'new_count': len(snapshot),
+            'version': snapshot.version,
+            'changes': changes
+        }
+    
     def get_watcher_status(self) -> Dict:
         """Get the status of the file watcher"""
         is_watching = (WATCHDOG_AVAILABLE and 
@@ -297,14 +926,45 @@ class ApifyDataService:
             "file_watcher_available": WATCHDOG_AVAILABLE,
             "file_watcher_active": is_watching,
             "watched_file": self.data_file,
+            "catalog_version": self._catalog_state()[0],
+            "loaded_sha256": self._loaded_fingerprint[2] if self._loaded_fingerprint else None,
+            "reloads": self._reload_scheduler.stats(),
+            "cache_writes": self._cache_writer.stats(),
+            "query_cache": self._query_cache.stats(),
+            "shared_catalog": self._shared.status() if self._shared is not None else None,
             "message": ("File watcher is monitoring for changes" if is_watching 
                        else "File watcher is not active" if WATCHDOG_AVAILABLE 
                        else "File watching disabled - watchdog library not available")
         }
     
+    def get_readiness(self) -> Dict:
+        """Whether the initial load has finished, and what it loaded"""
+        version, count = self._catalog_state()
+        return {
+            "ready": self.is_ready(),
+            "version": version,
+            "tracks": count,
+            "loaded_from": self._loaded_from,
+            "startup_ms": round(self._startup_duration * 1000, 1) if self._startup_duration is not None else None,
+        }
+    
+    def shutdown(self):
+        """Stop the watcher and background threads"""
+        self._stop_file_watcher()
+        self._reload_scheduler.stop()
+        self._cache_writer.stop()
+        if self._shared is not None:
+            self._shared.stop()
+        self._executor.shutdown(wait=False)
+        self._reload_executor.shutdown(wait=False)
+    
     def __del__(self):
         """Cleanup when service is destroyed"""
-        self._stop_file_watcher()
+        self.shutdown()
 
-# Global instance
-apify_service = ApifyDataService() 
\ No newline at end of file
+# Global instance; the SQLite backend is a drop-in replacement for catalogs that outgrow RAM
+if STORAGE_BACKEND == "sqlite":
+    from services.sqlite_data_service import SQLiteDataService
+    apify_service = SQLiteDataService()
+else:
+    apify_service = ApifyDataService() 
\ No newline at end of file
@@ -1,41 +1,458 @@
+import asyncio
+import hashlib
+import json
 import os
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
 import aiohttp
-import asyncio
-from typing import Optional
+
+from services.shared_catalog import FileLock
 
 AUDIO_DIR = os.path.join(os.path.dirname(__file__), "..", "audio")
 
+# Upper bound for the content-addressed cache; least recently used files are evicted past it
+MAX_CACHE_BYTES = int(os.getenv("QUANTUM_RADIO_AUDIO_CACHE_BYTES", str(2 * 1024 ** 3)))
+
+# How many downloads download_many runs at once
+DOWNLOAD_CONCURRENCY = int(os.getenv("QUANTUM_RADIO_DOWNLOAD_CONCURRENCY", "4"))
+
+CHUNK_SIZE = 64 * 1024
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5        # Seconds before the first retry, doubled after each failure
+INDEX_SAVE_INTERVAL = 1.0  # Seconds between index writes while downloads keep completing
+
+INDEX_VERSION = 1
+_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class DownloadError(Exception):
+    """A download failed in a way that retrying will not fix"""
+
+
 class AudioDownloader:
-    def __init__(self):
-        # Ensure audio directory exists
-        os.makedirs(AUDIO_DIR, exist_ok=True)
-    
+    """
+    Downloads audio files into a bounded, content-addressed cache.
+
+    Finished files are stored once under objects/<digest[:2]>/<sha256><ext> no
+    matter how many names refer to them, and index.json maps each name to its
+    object in least-recently-used order. Once the cache grows past
+    max_cache_bytes the oldest names are dropped and objects nobody refers to
+    any more are deleted.
+
+    Several worker processes can share one audio directory. index.json is
+    only read, changed and rewritten under index.lock (flock), and objects
+    are renamed into place and deleted under the same lock, so no process
+    overwrites another's entries or sweeps up an object it just added.
+
+    Downloads stream into partial/<sha1(url)>.part and resume with an HTTP
+    Range request after a dropped connection or a restart; a file only appears
+    in the cache after an atomic rename. All downloads share one pooled
+    aiohttp session, created lazily on the running loop.
+    """
+
+    def __init__(self, audio_dir: str = AUDIO_DIR, max_cache_bytes: int = MAX_CACHE_BYTES,
+                 concurrency: int = DOWNLOAD_CONCURRENCY,
+                 session_factory: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        self.audio_dir = audio_dir
+        self.objects_dir = os.path.join(audio_dir, "objects")
+        self.partial_dir = os.path.join(audio_dir, "partial")
+        self.index_path = os.path.join(audio_dir, "index.json")
+        self.max_cache_bytes = max_cache_bytes
+        self.concurrency = max(1, concurrency)
+        self._session_factory = session_factory or self._default_session
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # name -> (object name, size), least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._refcounts: Counter = Counter()
+        self._object_sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._index_dirty = False
+        self._index_saved_at = 0.0
+        # mtime of index.json when it was last read or written here
+        self._index_mtime: Optional[int] = None
+        # Names looked up since the last save; their recency outlives a reread
+        self._touched: "OrderedDict[str, None]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Ensure audio directories exist
+        for directory in (self.audio_dir, self.objects_dir, self.partial_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._index_lock = FileLock(open(os.path.join(audio_dir, "index.lock"), "a+b"))
+        self._load_index()
+
+    # Session ---------------------------------------------------------------
+
+    def _default_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.concurrency * 2, limit_per_host=self.concurrency,
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self._session_factory()
+        return self._session
+
+    async def close(self):
+        """Close the shared session and flush the cache index"""
+        self._save_index(force=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # Public API ------------------------------------------------------------
+
     async def download_track(self, track_url: str, filename: str) -> Optional[str]:
         """
         Downloads an audio track from the given URL
         Returns the path to the downloaded file or None if download fails
         """
-        output_path = os.path.join(AUDIO_DIR, filename)
-        
+        cached = self._lookup(filename)
+        if cached:
+            return cached
+
+        # Concurrent requests for the same name share one download
+        pending = self._inflight.get(filename)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[filename] = future
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(track_url) as response:
-                    if response.status == 200:
-                        with open(output_path, 'wb') as f:
-                            while True:
-                                chunk = await response.content.read(8192)
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                        return output_path
-                    return None
+            path = await self._download(track_url, filename)
+        except asyncio.CancelledError:
+            future.set_result(None)
+            raise
         except Exception as e:
-            print(f"Error downloading track: {str(e)}")
-            return None
-    
+            print(f"Error downloading track {filename}: {str(e)}")
+            path = None
+        finally:
+            self._inflight.pop(filename, None)
+        future.set_result(path)
+        self._save_index()
+        return path
+
+    async def download_many(self, items: Iterable[Tuple[str, str]], concurrency: Optional[int] = None,
+                            deadline: Optional[float] = None) -> Dict[str, Optional[str]]:
+        """
+        Download many (track_url, filename) pairs with at most `concurrency`
+        transfers in flight. If `deadline` seconds pass first, unfinished
+        downloads are cancelled (their partial files are kept for resuming)
+        and reported as None.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.concurrency))
+        results: Dict[str, Optional[str]] = {}
+
+        async def run(track_url: str, filename: str):
+            async with semaphore:
+                results[filename] = await self.download_track(track_url, filename)
+
+        items = list(items)
+        tasks = [asyncio.ensure_future(run(track_url, filename)) for track_url, filename in items]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                print(f"Download batch hit its {deadline}s deadline with {len(pending)} tracks unfinished")
+        self._save_index(force=True)
+        return {filename: results.get(filename) for _, filename in items}
+
     def get_track_path(self, track_id: str) -> Optional[str]:
         """
         Returns the path to a downloaded track if it exists
         """
-        path = os.path.join(AUDIO_DIR, f"{track_id}.mp3")
-        return path if os.path.exists(path) else None 
\ No newline at end of file
+        filename = f"{track_id}.mp3"
+        path = self._lookup(filename)
+        if path:
+            return path
+        # Files downloaded before the cache existed live directly in AUDIO_DIR
+        legacy = os.path.join(self.audio_dir, filename)
+        return legacy if os.path.exists(legacy) else None
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    # Downloading -----------------------------------------------------------
+
+    async def _download(self, track_url: str, filename: str) -> Optional[str]:
+        partial_path = os.path.join(self.partial_dir, hashlib.sha1(f"{filename}\0{track_url}".encode("utf-8")).hexdigest() + ".part")
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                digest, size = await self._fetch(track_url, partial_path)
+                break
+            except DownloadError as e:
+                print(f"Download of {filename} failed: {str(e)}")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 == MAX_ATTEMPTS:
+                    raise
+                delay = RETRY_BACKOFF * (2 ** attempt)
+                print(f"Download of {filename} interrupted ({str(e) or type(e).__name__}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+        if size > self.max_cache_bytes:
+            os.remove(partial_path)
+            print(f"Not caching {filename}: {size} bytes exceeds the {self.max_cache_bytes} byte cache")
+            return None
+
+        try:
+            os.remove(partial_path + '.validator')
+        except FileNotFoundError:
+            pass
+
+        object_name = digest + os.path.splitext(filename)[1].lower()
+        object_path = self._object_path(object_name)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with self._index_lock:
+            # Other processes may have cached (or evicted) files since the last read
+            self._refresh_index()
+            if object_name in self._object_sizes and os.path.exists(object_path):
+                os.remove(partial_path)  # Same content already cached under another name
+            else:
+                os.replace(partial_path, object_path)
+            self._store(filename, object_name, size)
+            self._write_index()
+        return self._lookup(filename)
+
+    async def _fetch(self, track_url: str, partial_path: str) -> Tuple[str, int]:
+        """Stream track_url into partial_path, resuming if it exists; return (sha256, size)"""
+        # Hashing what is already on disk can take a while for a large file
+        digest, offset = await asyncio.to_thread(_hash_file, partial_path)
+
+        headers = {}
+        validator_path = partial_path + '.validator'
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            # Only resume if the file on the server is still the one we started downloading
+            if os.path.exists(validator_path):
+                with open(validator_path, 'r', encoding='utf-8') as f:
+                    headers['If-Range'] = f.read().strip()
+        async with self._get_session().get(track_url, headers=headers) as response:
+            if response.status == 416 and offset:
+                # The partial file is complete (or stale); the server has no bytes past it
+                total = _content_range_total(response.headers.get('Content-Range'))
+                if total == offset:
+                    return digest.hexdigest(), offset
+                os.remove(partial_path)
+                raise aiohttp.ClientPayloadError("Stale partial download discarded")
+            if response.status in _RETRYABLE_STATUS:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=response.reason or '')
+            if response.status == 206 and offset:
+                start = _content_range_start(response.headers.get('Content-Range'))
+                if start != offset:
+                    # Appending these bytes would corrupt the file; start over
+                    _discard(partial_path, validator_path)
+                    raise aiohttp.ClientPayloadError(f"Range response starts at byte {start}, expected {offset}")
+                mode = 'ab'
+            elif response.status == 200:
+                # The server ignored the Range header; start over
+                mode = 'wb'
+                if offset:
+                    digest = hashlib.sha256()
+                    offset = 0
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                if validator:
+                    with open(validator_path, 'w', encoding='utf-8') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            else:
+                raise DownloadError(f"HTTP {response.status}")
+
+            expected = response.content_length
+            received = 0
+            with open(partial_path, mode) as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+            if expected is not None and received != expected:
+                raise aiohttp.ClientPayloadError(f"Expected {expected} bytes, received {received}")
+            return digest.hexdigest(), offset + received
+
+    # Cache index -----------------------------------------------------------
+
+    def _object_path(self, object_name: str) -> str:
+        return os.path.join(self.objects_dir, object_name[:2], object_name)
+
+    def _lookup(self, filename: str) -> Optional[str]:
+        entry = self._entries.get(filename)
+        if entry is None and self._index_changed():
+            with self._index_lock:
+                self._refresh_index()
+            entry = self._entries.get(filename)
+        if entry is None:
+            return None
+        path = self._object_path(entry[0])
+        if not os.path.exists(path):
+            # Evicted by another process
+            self._forget(filename)
+            return None
+        self._entries.move_to_end(filename)
+        self._touched[filename] = None
+        self._touched.move_to_end(filename)
+        self._index_dirty = True
+        return path
+
+    def _store(self, filename: str, object_name: str, size: int):
+        """Add a name to the index; call with the index lock held"""
+        if filename in self._entries:
+            self._forget(filename)
+        self._entries[filename] = (object_name, size)
+        self._add_reference(object_name, size)
+        self._index_dirty = True
+        self._evict(keep=filename)
+
+    def _add_reference(self, object_name: str, size: int):
+        self._refcounts[object_name] += 1
+        if object_name not in self._object_sizes:
+            self._object_sizes[object_name] = size
+            self._total_bytes += size
+
+    def _forget(self, filename: str):
+        object_name, _ = self._entries.pop(filename)
+        self._refcounts[object_name] -= 1
+        if self._refcounts[object_name] <= 0:
+            del self._refcounts[object_name]
+            self._total_bytes -= self._object_sizes.pop(object_name, 0)
+            try:
+                os.remove(self._object_path(object_name))
+            except FileNotFoundError:
+                pass
+        self._index_dirty = True
+
+    def _evict(self, keep: Optional[str] = None):
+        """Drop least recently used names until the cache fits in max_cache_bytes"""
+        while self._total_bytes > self.max_cache_bytes:
+            victim = next((name for name in self._entries if name != keep), None)
+            if victim is None:
+                break
+            self._forget(victim)
+
+    def _load_index(self):
+        with self._index_lock:
+            self._read_index()
+
+            # Objects renamed into place before a crash never made it into the
+            # index; under the lock no other process is between rename and store
+            for root, _, files in os.walk(self.objects_dir):
+                for name in files:
+                    if name not in self._object_sizes:
+                        os.remove(os.path.join(root, name))
+            self._evict()
+            if self._index_dirty:
+                self._write_index()
+
+    def _read_index(self):
+        """Replace the in-memory index with index.json; call with the index lock held"""
+        self._entries.clear()
+        self._refcounts.clear()
+        self._object_sizes.clear()
+        self._total_bytes = 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._index_mtime = os.fstat(f.fileno()).st_mtime_ns
+                index = json.load(f)
+            if index.get('version') != INDEX_VERSION:
+                raise ValueError(f"unsupported index version {index.get('version')}")
+            for filename, object_name, size in index.get('entries', []):
+                if os.path.exists(self._object_path(object_name)):
+                    self._entries[filename] = (object_name, size)
+                    self._add_reference(object_name, size)
+        except FileNotFoundError:
+            self._index_mtime = None
+        except (ValueError, TypeError, OSError) as e:
+            print(f"Ignoring unreadable audio cache index: {str(e)}")
+
+    def _refresh_index(self):
+        """
+        Reread index.json, then reapply this process's lookups since its
+        last save so their recency is not lost; call with the index lock held
+        """
+        self._read_index()
+        for filename in self._touched:
+            if filename in self._entries:
+                self._entries.move_to_end(filename)
+                self._index_dirty = True
+
+    def _index_changed(self) -> bool:
+        """Whether another process rewrote index.json since this one last read or wrote it"""
+        try:
+            return os.stat(self.index_path).st_mtime_ns != self._index_mtime
+        except FileNotFoundError:
+            return self._index_mtime is not None
+
+    def _write_index(self):
+        """Write the in-memory index to index.json; call with the index lock held"""
+        index = {
+            'version': INDEX_VERSION,
+            'entries': [[filename, object_name, size] for filename, (object_name, size) in self._entries.items()],
+        }
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        self._touched.clear()
+
+    def _save_index(self, force: bool = False):
+        """Merge this process's lookups into index.json (at most every INDEX_SAVE_INTERVAL unless forced)"""
+        if not self._index_dirty:
+            return
+        if not force and time.monotonic() - self._index_saved_at < INDEX_SAVE_INTERVAL:
+            return
+        with self._index_lock:
+            self._refresh_index()
+            self._evict()
+            self._write_index()
+
+
+def _hash_file(path: str) -> Tuple["hashlib._Hash", int]:
+    """(sha256 state, size) of a partial download; empty if it does not exist"""
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+    except FileNotFoundError:
+        pass
+    return digest, size
+
+
+def _discard(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _content_range_start(header: Optional[str]) -> Optional[int]:
+    """The first byte position from a Content-Range header like 'bytes 100-1233/1234'"""
+    if not header or not header.startswith('bytes ') or '-' not in header:
+        return None
+    start = header[len('bytes '):].split('-', 1)[0].strip()
+    return int(start) if start.isdigit() else None
+
+
+def _content_range_total(header: Optional[str]) -> Optional[int]:
+    """The complete length from a Content-Range header like 'bytes */1234'"""
+    if not header or '/' not in header:
+        return None
+    total = header.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+# Global instance
+audio_downloader = AudioDownloader()
@@ -0,0 +1,270 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.aggregates import CatalogAggregates, parse_duration
+from services.facets import FacetIndex
+from services.search_index import SearchIndex
+from services.track_record import TrackRecord
+
+
+# Sort keys accepted by the API, mapped to the value each track is ordered by
+SORT_KEYS: Dict[str, Callable[[TrackRecord], object]] = {
+    'views': lambda track: track['view_count'] or 0,
+    'likes': lambda track: track['likes'] or 0,
+    'comments': lambda track: track['comments_count'] or 0,
+    'date': lambda track: track['upload_date'] or '',
+    'duration': lambda track: parse_duration(track['duration']),
+    'title': lambda track: (track['title'] or '').casefold(),
+}
+
+
+class CatalogDelta:
+    """Tracks added, removed and updated between two catalog versions"""
+
+    __slots__ = ('added', 'removed', 'updated')
+
+    def __init__(self, added: List[TrackRecord] = None, removed: List[TrackRecord] = None,
+                 updated: List[Tuple[TrackRecord, TrackRecord]] = None):
+        self.added = added or []
+        self.removed = removed or []
+        self.updated = updated or []  # (old track, new track) pairs
+
+    @classmethod
+    def between(cls, previous: 'CatalogSnapshot', tracks: List[TrackRecord]) -> 'CatalogDelta':
+        """
+        Diff freshly formatted tracks against a snapshot by video_id.
+
+        Entries of tracks that did not change are replaced in place by the
+        previous snapshot's objects, so both versions share them (unless the
+        previous snapshot is not incremental, e.g. backed by a mapped file).
+        """
+        delta = cls()
+        old_by_id = previous.by_id
+        share = previous.incremental
+        for index, track in enumerate(tracks):
+            old = old_by_id.get(track['video_id'])
+            if old is None:
+                delta.added.append(track)
+            elif old is track or old == track:
+                if share:
+                    tracks[index] = old
+            else:
+                delta.updated.append((old, track))
+        if len(tracks) - len(delta.added) != len(old_by_id):
+            seen = {track['video_id'] for track in tracks}
+            delta.removed = [track for video_id, track in old_by_id.items() if video_id not in seen]
+        return delta
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.updated)
+
+    def outgoing(self) -> List[TrackRecord]:
+        """Old versions of every track that leaves the catalog or changes"""
+        return self.removed + [old for old, _ in self.updated]
+
+    def incoming(self) -> List[TrackRecord]:
+        """New versions of every track that enters the catalog or changes"""
+        return self.added + [new for _, new in self.updated]
+
+    def counts(self) -> Dict[str, int]:
+        return {'added': len(self.added), 'removed': len(self.removed), 'updated': len(self.updated)}
+
+    def video_ids(self) -> Tuple[List[str], List[str], List[str]]:
+        """IDs of the added, removed and updated tracks"""
+        return ([track['video_id'] for track in self.added], [track['video_id'] for track in self.removed],
+                [new['video_id'] for _, new in self.updated])
+
+
+class CatalogSnapshot:
+    """
+    Immutable, versioned view of the formatted track catalog.
+
+    A snapshot is built once per load of AI_Setlist.json and is never mutated
+    afterwards, so readers can grab the current one without taking a lock and
+    keep using it even if a reload swaps in a newer version meanwhile.
+    """
+
+    __slots__ = ('version', 'tracks', 'loaded_at', 'by_id', 'by_channel_id', 'by_channel_name',
+                 'search_index', 'aggregates', 'responses', '_orderings', '_facets')
+
+    # Whether derive() may patch this snapshot's indexes for the next version
+    incremental = True
+
+    def __init__(self, version: int, tracks: Tuple[TrackRecord, ...], by_id: Dict[str, TrackRecord],
+                 by_channel_id: Dict[str, Tuple[TrackRecord, ...]],
+                 by_channel_name: Dict[str, Tuple[TrackRecord, ...]], search_index: SearchIndex, aggregates: CatalogAggregates,
+                 orderings: Optional[Dict[str, Tuple[Tuple[TrackRecord, ...], Dict[str, int]]]] = None):
+        self.version = version
+        self.tracks = tracks
+        self.loaded_at = time.time()
+        self.by_id = by_id
+        self.by_channel_id = by_channel_id
+        self.by_channel_name = by_channel_name
+        self.search_index = search_index
+        self.aggregates = aggregates
+        # Serialized API responses for this version, filled by the data service
+        self.responses: Dict[str, object] = {}
+        self._orderings = orderings or {}
+        self._facets: Optional[FacetIndex] = None
+
+    @classmethod
+    def build(cls, version: int, formatted_tracks: List[TrackRecord]) -> 'CatalogSnapshot':
+        """Create a snapshot from already formatted tracks, building every index from scratch"""
+        tracks = tuple(formatted_tracks)
+        return cls(
+            version,
+            tracks,
+            {track['video_id']: track for track in tracks},
+            _group_tracks(tracks, _channel_id_key),
+            _group_tracks(tracks, _channel_name_key),
+            SearchIndex(tracks),
+            CatalogAggregates(tracks),
+        )
+
+    @classmethod
+    def derive(cls, previous: 'CatalogSnapshot', version: int, formatted_tracks: List[TrackRecord],
+               delta: CatalogDelta) -> 'CatalogSnapshot':
+        """
+        Create the next snapshot by applying a delta to the previous one.
+
+        Only the parts of the indexes and aggregates touched by the delta are
+        recomputed; everything else is shared with the previous snapshot,
+        which stays valid for readers that still hold it.
+
+        Lookups, groups, orderings and aggregates come out exactly as build()
+        makes them, ties in catalog order included. Search results with
+        exactly equal scores are the one exception: added and updated tracks
+        get new document ordinals, so they can come out in another order
+        among such ties than in a fresh build.
+        """
+        tracks = tuple(formatted_tracks)
+        outgoing, incoming = delta.outgoing(), delta.incoming()
+        position = {track['video_id']: index for index, track in enumerate(tracks)}
+
+        by_id = dict(previous.by_id)
+        for track in delta.removed:
+            del by_id[track['video_id']]
+        for track in incoming:
+            by_id[track['video_id']] = track
+
+        aggregates = previous.aggregates.copy()
+        for track in outgoing:
+            aggregates.remove(track)
+        for track in incoming:
+            aggregates.add(track)
+
+        changed_ids = {track['video_id'] for track in outgoing}
+        changed_ids.update(track['video_id'] for track in incoming)
+        orderings = {}
+        # Whether kept tracks changed places; then groups and ties may be out of order
+        moved = ([track['video_id'] for track in previous.tracks if track['video_id'] in position]
+                 != [track['video_id'] for track in tracks if track['video_id'] in previous.by_id])
+        for sort_key, (ordered, _) in list(previous._orderings.items()):
+            # Ties go by catalog position, as in build()
+            sort_value = SORT_KEYS[sort_key]
+            key = lambda track: (sort_value(track), position[track['video_id']])
+            kept = [track for track in ordered if track['video_id'] not in changed_ids]
+            merged = tuple(sorted(kept + incoming, key=key)) if moved else _merge_sorted(kept, incoming, key)
+            orderings[sort_key] = (merged, {track['video_id']: rank for rank, track in enumerate(merged)})
+
+        if moved:
+            by_channel_id = _group_tracks(tracks, _channel_id_key)
+            by_channel_name = _group_tracks(tracks, _channel_name_key)
+        else:
+            changed = outgoing + incoming
+            by_channel_id = _regroup_tracks(previous.by_channel_id, tracks, changed, _channel_id_key)
+            by_channel_name = _regroup_tracks(previous.by_channel_name, tracks, changed, _channel_name_key)
+        return cls(
+            version,
+            tracks,
+            by_id,
+            by_channel_id,
+            by_channel_name,
+            previous.search_index.updated(outgoing, incoming, tracks),
+            aggregates,
+            orderings,
+        )
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+    def ordering(self, sort_key: str) -> Tuple[Tuple[TrackRecord, ...], Dict[str, int]]:
+        """
+        Tracks presorted ascending by sort_key, plus each video_id's rank in
+        that order. Computed on first use and cached for the snapshot's life;
+        a concurrent first use may compute it twice, which is harmless.
+        """
+        cached = self._orderings.get(sort_key)
+        if cached is None:
+            ordered = tuple(sorted(self.tracks, key=SORT_KEYS[sort_key]))
+            ranks = {track['video_id']: rank for rank, track in enumerate(ordered)}
+            cached = self._orderings[sort_key] = (ordered, ranks)
+        return cached
+
+    def facets(self) -> FacetIndex:
+        """The facet index of this version, built on first use (see ordering())"""
+        if self._facets is None:
+            self._facets = FacetIndex(self.tracks, _channel_name_key)
+        return self._facets
+
+
+def normalize_channel_name(name: str) -> str:
+    """Key used for case-insensitive channel name lookups"""
+    return name.strip().casefold()
+
+
+def _channel_id_key(track: TrackRecord) -> Optional[str]:
+    return track['channel_id'] or None
+
+
+def _channel_name_key(track: TrackRecord) -> Optional[str]:
+    return normalize_channel_name(track['channel_title']) if track['channel_title'] else None
+
+
+def _merge_sorted(kept: List[TrackRecord], incoming: List[TrackRecord],
+                  key: Callable[[TrackRecord], object]) -> Tuple[TrackRecord, ...]:
+    """
+    Insert tracks into kept, which is already sorted by key (and has no two
+    equal keys), computing key only for the tracks probed by bisection
+    """
+    merged: List[TrackRecord] = []
+    start = 0
+    for track in sorted(incoming, key=key):
+        value = key(track)
+        low, high = start, len(kept)
+        while low < high:
+            middle = (low + high) // 2
+            if key(kept[middle]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        merged.extend(kept[start:low])
+        merged.append(track)
+        start = low
+    merged.extend(kept[start:])
+    return tuple(merged)
+
+
+def _group_tracks(tracks: Iterable[TrackRecord], key_func: Callable[[TrackRecord], Optional[str]],
+                  only_keys: Optional[Set[str]] = None) -> Dict[str, Tuple[TrackRecord, ...]]:
+    """Group tracks into tuples by key, preserving catalog order"""
+    groups: Dict[str, List[TrackRecord]] = {}
+    for track in tracks:
+        key = key_func(track)
+        if key is not None and (only_keys is None or key in only_keys):
+            groups.setdefault(key, []).append(track)
+    return {key: tuple(value) for key, value in groups.items()}
+
+
+def _regroup_tracks(previous: Dict[str, Tuple[TrackRecord, ...]], tracks: Tuple[TrackRecord, ...],
+                    changed: List[TrackRecord],
+                    key_func: Callable[[TrackRecord], Optional[str]]) -> Dict[str, Tuple[TrackRecord, ...]]:
+    """Rebuild only the groups that contain changed tracks; untouched groups are shared as-is"""
+    affected = {key_func(track) for track in changed}
+    affected.discard(None)
+    groups = dict(previous)
+    for key in affected:
+        groups.pop(key, None)
+    if affected:
+        groups.update(_group_tracks(tracks, key_func, affected))
+    return groups
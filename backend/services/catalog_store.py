@@ -0,0 +1,581 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from services.catalog import SORT_KEYS, CatalogSnapshot
+from services.response_cache import PreparedResponse
+from services.search_index import SearchIndex
+from services.track_record import TRACK_FIELDS, TrackRecord
+
+# On-disk layout: 8 byte magic and format version, then 8-byte aligned
+# sections, then a JSON directory of section offsets and metadata, then a
+# trailer (directory offset, directory length, magic) so a reader can find
+# the directory by looking at the end of the file. Arrays are stored in the
+# host's native byte order so they can be used in place; the files are local
+# caches, not an interchange format.
+MAGIC = b"QRCATLG\0"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sI4x")
+_TRAILER = struct.Struct("<QI4x8s")
+_ALIGNMENT = 8
+
+# Record layout: u32 length of a JSON array of every field except the
+# description, the array itself, then the description as raw UTF-8
+_META_FIELDS = tuple(field for field in TRACK_FIELDS if field != 'description')
+_DESCRIPTION_INDEX = TRACK_FIELDS.index('description')
+_HASHTAGS_INDEX = _META_FIELDS.index('hashtags')
+_RECORD_HEADER = struct.Struct("<I")
+
+_HASHTAG_SEPARATOR = '\x1f'
+
+# ID lookups a mapped catalog answers by bisection before it builds an ID -> index dict
+POSITION_MAP_THRESHOLD = 1000
+
+_META_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+class CatalogFormatError(ValueError):
+    """The file is not a catalog written by this version of write_catalog"""
+
+
+# Writing --------------------------------------------------------------------
+
+class _SectionWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sections: Dict[str, List[int]] = {}
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+
+    def _align(self):
+        padding = -self.f.tell() % _ALIGNMENT
+        if padding:
+            self.f.write(b"\0" * padding)
+
+    def write(self, name: str, data) -> None:
+        self._align()
+        offset = self.f.tell()
+        self.f.write(data)
+        self.sections[name] = [offset, self.f.tell() - offset]
+
+    def write_strings(self, name: str, strings) -> None:
+        """A string table: u32 end offsets followed by the concatenated UTF-8"""
+        offsets = array('I', [0])
+        blob = bytearray()
+        for value in strings:
+            blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        self.write(f"{name}.offsets", offsets)
+        self.write(f"{name}.blob", blob)
+
+    def finish(self, directory: Dict) -> None:
+        self._align()
+        directory = dict(directory, sections=self.sections)
+        encoded = json.dumps(directory, separators=(",", ":")).encode('utf-8')
+        offset = self.f.tell()
+        self.f.write(encoded)
+        self.f.write(_TRAILER.pack(offset, len(encoded), MAGIC))
+
+
+def encode_record(track: TrackRecord) -> bytes:
+    meta = [getattr(track, field) for field in _META_FIELDS]
+    meta[_HASHTAGS_INDEX] = list(meta[_HASHTAGS_INDEX] or ())
+    encoded = _META_ENCODER.encode(meta).encode('utf-8')
+    description = track._description
+    if isinstance(description, str):
+        description = description.encode('utf-8')
+    return _RECORD_HEADER.pack(len(encoded)) + encoded + description
+
+
+def write_catalog(snapshot: CatalogSnapshot, path: str, metadata: Optional[Dict] = None) -> int:
+    """
+    Serialize a snapshot (records, lookups, orderings, search index,
+    aggregates and prepared responses) to path, atomically. Returns the
+    number of bytes written.
+    """
+    tracks = snapshot.tracks
+    index_of = {track['video_id']: index for index, track in enumerate(tracks)}
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    directory = {
+        'format': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'version': snapshot.version,
+        'count': len(tracks),
+        'metadata': metadata or {},
+        'responses': {},
+    }
+
+    try:
+        with open(temp_path, 'wb') as f:
+            writer = _SectionWriter(f)
+
+            # Records, written one at a time
+            writer._align()
+            records_start = f.tell()
+            offsets = array('Q', [0])
+            for track in tracks:
+                f.write(encode_record(track))
+                offsets.append(f.tell() - records_start)
+            writer.sections['records'] = [records_start, f.tell() - records_start]
+            writer.write('records.offsets', offsets)
+
+            # Lookups by video ID: IDs in record order plus their sorted permutation
+            video_ids = [track['video_id'] for track in tracks]
+            writer.write_strings('ids', video_ids)
+            writer.write('ids.sorted', array('I', sorted(range(len(tracks)), key=video_ids.__getitem__)))
+            # Hashtags get their own table so the has_hashtags filter never decodes records
+            writer.write_strings('hashtags', (_HASHTAG_SEPARATOR.join(track['hashtags'] or ()) for track in tracks))
+
+            for name, groups in (('by_channel_id', snapshot.by_channel_id),
+                                 ('by_channel_name', snapshot.by_channel_name)):
+                keys = sorted(groups)
+                ends = array('I', [0])
+                members = array('I')
+                for key in keys:
+                    members.extend(index_of[track['video_id']] for track in groups[key])
+                    ends.append(len(members))
+                writer.write_strings(f"{name}.keys", keys)
+                writer.write(f"{name}.ends", ends)
+                writer.write(f"{name}.members", members)
+
+            for sort_key in SORT_KEYS:
+                ordered, _ = snapshot.ordering(sort_key)
+                order = array('I', (index_of[track['video_id']] for track in ordered))
+                ranks = array('I', bytes(4 * len(order)))
+                for rank, index in enumerate(order):
+                    ranks[index] = rank
+                writer.write(f"order.{sort_key}", order)
+                writer.write(f"rank.{sort_key}", ranks)
+
+            _write_search_index(writer, snapshot.search_index, index_of, len(tracks))
+
+            aggregates = {
+                'channels': snapshot.aggregates.channel_summaries(),
+                'stats': snapshot.aggregates.stats(),
+            }
+            writer.write('aggregates', json.dumps(aggregates, ensure_ascii=False).encode('utf-8'))
+
+            for name, prepared in snapshot.responses.items():
+                directory['responses'][name] = {'version': prepared.version, 'etag': prepared.etag}
+                for variant in ('body', 'gzip_body', 'brotli_body'):
+                    data = getattr(prepared, variant)
+                    if data is not None:
+                        writer.write(f"response.{name}.{variant}", data)
+
+            writer.finish(directory)
+            size = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size
+
+
+def copy_catalog(source: str, path: str) -> int:
+    """Copy a catalog file to path atomically; returns the number of bytes written"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            size = dst.tell()
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size
+
+
+def _write_search_index(writer: _SectionWriter, index: SearchIndex, index_of: Dict[str, int], count: int):
+    """Write postings renumbered to record indexes, leaving out tombstoned documents"""
+    doc_ids = index._doc_ids
+    deleted = index._deleted
+    remap = array('i', [-1]) * len(doc_ids)
+    boost = array('d', bytes(8 * count))
+    for ordinal, video_id in enumerate(doc_ids):
+        if ordinal not in deleted and video_id in index_of:
+            remap[ordinal] = index_of[video_id]
+            boost[remap[ordinal]] = index._doc_boost[ordinal]
+
+    vocabulary = []
+    ends = array('I', [0])
+    ordinals = array('I')
+    masks = bytearray()
+    for token in index._vocabulary:
+        token_ordinals, token_masks = index._postings[token]
+        before = len(ordinals)
+        for ordinal, mask in zip(token_ordinals, token_masks):
+            target = remap[ordinal]
+            if target >= 0:
+                ordinals.append(target)
+                masks.append(mask)
+        if len(ordinals) > before:
+            vocabulary.append(token)
+            ends.append(len(ordinals))
+
+    writer.write_strings('search.vocabulary', vocabulary)
+    writer.write('search.ends', ends)
+    writer.write('search.ordinals', ordinals)
+    writer.write('search.masks', bytes(masks))
+    writer.write('search.boost', boost)
+
+
+# Reading --------------------------------------------------------------------
+
+class _StringTable(Sequence):
+    """Read-only sequence of the strings in a string table"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+
+class MappedCatalog:
+    """
+    A catalog file mapped read-only into memory.
+
+    Pages are shared with every other process mapping the same file, and
+    records are decoded only when they are accessed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        self.size = len(buffer)
+        if self.size < _HEADER.size + _TRAILER.size:
+            raise CatalogFormatError(f"{path} is too small to be a catalog")
+        magic, format_version = _HEADER.unpack_from(buffer, 0)
+        directory_offset, directory_length, trailer_magic = _TRAILER.unpack_from(buffer, self.size - _TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC:
+            raise CatalogFormatError(f"{path} is not a catalog file")
+        if format_version != FORMAT_VERSION:
+            raise CatalogFormatError(f"{path} has format {format_version}, expected {FORMAT_VERSION}")
+        self.directory = json.loads(bytes(buffer[directory_offset:directory_offset + directory_length]))
+        if self.directory.get('byteorder') != sys.byteorder:
+            raise CatalogFormatError(f"{path} was written on a {self.directory.get('byteorder')}-endian host")
+        self._buffer = buffer
+        self.version: int = self.directory['version']
+        self.count: int = self.directory['count']
+        self.metadata: Dict = self.directory['metadata']
+
+        self._records = self.section('records')
+        self._record_offsets = self.section('records.offsets', 'Q')
+        self.ids = self.strings('ids')
+        self.hashtags = self.strings('hashtags')
+        self._sorted_ids = self.section('ids.sorted', 'I')
+        self._positions: Optional[Dict[str, int]] = None
+        self._lookups = 0
+
+    def section(self, name: str, typecode: Optional[str] = None) -> memoryview:
+        offset, length = self.directory['sections'][name]
+        view = self._buffer[offset:offset + length]
+        return view.cast(typecode) if typecode else view
+
+    def has_section(self, name: str) -> bool:
+        return name in self.directory['sections']
+
+    def strings(self, name: str) -> _StringTable:
+        return _StringTable(self.section(f"{name}.offsets", 'I'), self.section(f"{name}.blob"))
+
+    def track(self, index: int) -> 'MappedTrack':
+        return MappedTrack(self, index)
+
+    def record(self, index: int) -> TrackRecord:
+        """Fully decode the record at index"""
+        start = self._record_offsets[index]
+        end = self._record_offsets[index + 1]
+        (meta_length,) = _RECORD_HEADER.unpack_from(self._records, start)
+        meta_start = start + _RECORD_HEADER.size
+        fields = json.loads(bytes(self._records[meta_start:meta_start + meta_length]))
+        fields[_HASHTAGS_INDEX] = tuple(fields[_HASHTAGS_INDEX])
+        fields.insert(_DESCRIPTION_INDEX, bytes(self._records[meta_start + meta_length:end]))
+        return TrackRecord(*fields)
+
+    def index_of(self, video_id: str) -> int:
+        """Record index of a video ID, or -1"""
+        positions = self._positions
+        if positions is not None:
+            return positions.get(video_id, -1)
+        self._lookups += 1
+        if self._lookups > POSITION_MAP_THRESHOLD:
+            # Lookups are frequent: trade a small per-process dict (IDs only,
+            # no records) for not bisecting through the mapping every time
+            self._positions = {video_id: index for index, video_id in enumerate(self.ids)}
+            return self._positions.get(video_id, -1)
+
+        ids = self.ids
+        sorted_ids = self._sorted_ids
+        low, high = 0, len(sorted_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if ids[sorted_ids[middle]] < video_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(sorted_ids) and ids[sorted_ids[low]] == video_id:
+            return sorted_ids[low]
+        return -1
+
+    def snapshot(self) -> 'MappedCatalogSnapshot':
+        return MappedCatalogSnapshot(self)
+
+
+class MappedTrack:
+    """
+    A track in a mapped catalog that is decoded on first use. video_id and
+    hashtags come from their own small tables, so looking tracks up, ranking
+    and filtering them never decodes whole records.
+    """
+
+    __slots__ = ('_catalog', '_index', '_record')
+
+    def __init__(self, catalog: MappedCatalog, index: int):
+        self._catalog = catalog
+        self._index = index
+        self._record = None
+
+    def _decoded(self) -> TrackRecord:
+        if self._record is None:
+            self._record = self._catalog.record(self._index)
+        return self._record
+
+    @property
+    def video_id(self) -> str:
+        return self._catalog.ids[self._index]
+
+    @property
+    def hashtags(self) -> Tuple[str, ...]:
+        value = self._catalog.hashtags[self._index]
+        return tuple(value.split(_HASHTAG_SEPARATOR)) if value else ()
+
+    def __getitem__(self, field: str):
+        if field == 'video_id':
+            return self.video_id
+        if field == 'hashtags':
+            return self.hashtags
+        return self._decoded()[field]
+
+    def __getattr__(self, name: str):
+        return getattr(self._decoded(), name)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MappedTrack):
+            other = other._decoded()
+        return self._decoded() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"MappedTrack(video_id={self.video_id!r})"
+
+    def to_dict(self) -> Dict:
+        return self._decoded().to_dict()
+
+
+class TrackView(Sequence):
+    """Records of a mapped catalog selected (and ordered) by a sequence of record indexes"""
+
+    __slots__ = ('_catalog', '_indexes')
+
+    def __init__(self, catalog: MappedCatalog, indexes):
+        self._catalog = catalog
+        self._indexes = indexes
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return TrackView(self._catalog, self._indexes[position])
+        return MappedTrack(self._catalog, self._indexes[position])
+
+    def __iter__(self) -> Iterator['MappedTrack']:
+        catalog = self._catalog
+        for index in self._indexes:
+            yield MappedTrack(catalog, index)
+
+
+class _MappedById(Mapping):
+    def __init__(self, catalog: MappedCatalog):
+        self._catalog = catalog
+
+    def __getitem__(self, video_id: str) -> 'MappedTrack':
+        index = self._catalog.index_of(video_id)
+        if index < 0:
+            raise KeyError(video_id)
+        return MappedTrack(self._catalog, index)
+
+    def __contains__(self, video_id) -> bool:
+        return isinstance(video_id, str) and self._catalog.index_of(video_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._catalog.ids)
+
+    def __len__(self) -> int:
+        return self._catalog.count
+
+
+class _MappedGroups(Mapping):
+    """Group key -> TrackView, for the by_channel_* lookups"""
+
+    def __init__(self, catalog: MappedCatalog, name: str):
+        self._catalog = catalog
+        self._keys = catalog.strings(f"{name}.keys")
+        self._ends = catalog.section(f"{name}.ends", 'I')
+        self._members = catalog.section(f"{name}.members", 'I')
+
+    def __getitem__(self, key: str) -> TrackView:
+        position = bisect_left(self._keys, key)
+        if position >= len(self._keys) or self._keys[position] != key:
+            raise KeyError(key)
+        return TrackView(self._catalog, self._members[self._ends[position]:self._ends[position + 1]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class _MappedRanks(Mapping):
+    """video_id -> rank in one of the presorted orderings"""
+
+    def __init__(self, catalog: MappedCatalog, ranks: memoryview):
+        self._catalog = catalog
+        self._ranks = ranks
+
+    def __getitem__(self, video_id: str) -> int:
+        index = self._catalog.index_of(video_id)
+        if index < 0:
+            raise KeyError(video_id)
+        return self._ranks[index]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._catalog.ids)
+
+    def __len__(self) -> int:
+        return self._catalog.count
+
+
+class _MappedPostings(Mapping):
+    def __init__(self, vocabulary: _StringTable, ends: memoryview, ordinals: memoryview, masks: memoryview):
+        self._vocabulary = vocabulary
+        self._ends = ends
+        self._ordinals = ordinals
+        self._masks = masks
+
+    def __getitem__(self, token: str) -> Tuple[memoryview, memoryview]:
+        position = bisect_left(self._vocabulary, token)
+        if position >= len(self._vocabulary) or self._vocabulary[position] != token:
+            raise KeyError(token)
+        start, end = self._ends[position], self._ends[position + 1]
+        return self._ordinals[start:end], self._masks[start:end]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._vocabulary)
+
+    def __len__(self) -> int:
+        return len(self._vocabulary)
+
+
+class MappedSearchIndex(SearchIndex):
+    """
+    SearchIndex whose vocabulary and postings are read straight from a
+    mapped catalog; document ordinals are record indexes
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        super().__init__()
+        vocabulary = catalog.strings('search.vocabulary')
+        self._vocabulary = vocabulary
+        self._postings = _MappedPostings(vocabulary, catalog.section('search.ends', 'I'),
+                                         catalog.section('search.ordinals', 'I'), catalog.section('search.masks'))
+        self._doc_boost = catalog.section('search.boost', 'd')
+        self._doc_ids = catalog.ids
+        self._deleted = frozenset()
+
+    def updated(self, removed, added, all_tracks) -> SearchIndex:
+        # A mapped index cannot be patched; the catalog it came from is rebuilt instead
+        return SearchIndex(all_tracks)
+
+
+class FrozenAggregates:
+    """The aggregate results stored in a mapped catalog, decoded on first use"""
+
+    def __init__(self, encoded: memoryview):
+        self._encoded = encoded
+        self._data: Optional[Dict] = None
+
+    def _decoded(self) -> Dict:
+        if self._data is None:
+            self._data = json.loads(bytes(self._encoded))
+        return self._data
+
+    def channel_summaries(self) -> List[Dict]:
+        return self._decoded()['channels']
+
+    def stats(self) -> Dict:
+        return self._decoded()['stats']
+
+
+class MappedCatalogSnapshot(CatalogSnapshot):
+    """
+    A CatalogSnapshot served from a mapped catalog file.
+
+    Every lookup reads the shared mapping, so any number of processes can
+    serve the same snapshot for the memory cost of one. Mapped snapshots
+    cannot be derived from incrementally: the next version is built from
+    scratch.
+    """
+
+    __slots__ = ('catalog',)
+
+    incremental = False
+
+    def __init__(self, catalog: MappedCatalog):
+        super().__init__(
+            catalog.version,
+            TrackView(catalog, range(catalog.count)),
+            _MappedById(catalog),
+            _MappedGroups(catalog, 'by_channel_id'),
+            _MappedGroups(catalog, 'by_channel_name'),
+            MappedSearchIndex(catalog),
+            FrozenAggregates(catalog.section('aggregates')),
+            {sort_key: (TrackView(catalog, catalog.section(f"order.{sort_key}", 'I')),
+                        _MappedRanks(catalog, catalog.section(f"rank.{sort_key}", 'I')))
+             for sort_key in SORT_KEYS},
+        )
+        self.catalog = catalog
+        for name, info in catalog.directory['responses'].items():
+            variants = {variant: (catalog.section(f"response.{name}.{variant}")
+                                  if catalog.has_section(f"response.{name}.{variant}") else None)
+                        for variant in ('body', 'gzip_body', 'brotli_body')}
+            self.responses[name] = PreparedResponse.from_parts(info['version'], info['etag'], **variants)
+
+
+def open_catalog(path: str) -> MappedCatalogSnapshot:
+    """Map a catalog file and return its snapshot"""
+    return MappedCatalog(path).snapshot()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# Catalog versions whose changes stay available to /tracks/changes
+CHANGE_LOG_SIZE = int(os.getenv("QUANTUM_RADIO_CHANGE_LOG_SIZE", "64"))
+
+# Versions that change more tracks than this record only their counts;
+# clients that span one refetch the catalog instead
+MAX_CHANGED_IDS = 1000
+
+# How often the change feed checks the catalog version (once per process,
+# however many clients are subscribed)
+FEED_POLL_INTERVAL = 1.0
+
+# Comment lines sent to idle subscribers so proxies keep the connection open
+FEED_KEEPALIVE_INTERVAL = 15.0
+
+# Events a subscriber may fall behind by before it is disconnected; it
+# reconnects with Last-Event-ID and catches up in one merged event
+FEED_QUEUE_SIZE = 16
+
+
+def change_entry(previous: int, version: int, added: Sequence[str], removed: Sequence[str],
+                 updated: Sequence[str], counts: Optional[Dict[str, int]] = None) -> Dict:
+    """
+    One version's changes as a JSON-serializable log entry. Callers that
+    only fetch MAX_CHANGED_IDS + 1 IDs of each kind pass the real counts.
+    """
+    entry = {
+        'version': version,
+        'previous': previous,
+        'at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'counts': counts or {'added': len(added), 'removed': len(removed), 'updated': len(updated)},
+    }
+    if sum(entry['counts'].values()) > MAX_CHANGED_IDS:
+        entry['truncated'] = True
+    else:
+        entry.update(added=list(added), removed=list(removed), updated=list(updated))
+    return entry
+
+
+def merge_changes(entries: Iterable[Dict], since: int, version: int) -> Dict:
+    """
+    The net changes between two versions, from log entries ordered by
+    version. 'reset' is set when the log does not cover the whole range
+    (too old, truncated, or a version from before a restart); the client
+    should then refetch the catalog.
+    """
+    result = {'since': since, 'version': version, 'reset': False, 'added': [], 'removed': [], 'updated': []}
+    if since == version:
+        return result
+
+    # video_id -> (present before the range, present after it)
+    states: Dict[str, List[bool]] = {}
+    expected = since
+    for entry in entries:
+        if entry['version'] <= since or entry['version'] > version:
+            continue
+        if entry['previous'] != expected or entry.get('truncated'):
+            break
+        expected = entry['version']
+        for video_id in entry['added']:
+            states.setdefault(video_id, [False, True])[1] = True
+        for video_id in entry['removed']:
+            states.setdefault(video_id, [True, False])[1] = False
+        for video_id in entry['updated']:
+            states.setdefault(video_id, [True, True])
+    if expected != version:
+        result['reset'] = True
+        return result
+
+    for video_id, (before, after) in states.items():
+        if before and after:
+            result['updated'].append(video_id)
+        elif after:
+            result['added'].append(video_id)
+        elif before:
+            result['removed'].append(video_id)
+    return result
+
+
+class ChangeLog:
+    """Bounded, thread-safe history of the video_ids each catalog version changed"""
+
+    def __init__(self, size: int = CHANGE_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict):
+        with self._lock:
+            if self._entries and self._entries[-1]['version'] >= entry['version']:
+                # Versions restarted (e.g. a new database); older entries no longer apply
+                self._entries.clear()
+            self._entries.append(entry)
+
+    def adopt(self, entries: Iterable[Dict]):
+        """Replace the history, e.g. with the one published by another worker"""
+        with self._lock:
+            self._entries.clear()
+            self._entries.extend(entries)
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return list(self._entries)
+
+
+class ChangeFeed:
+    """
+    Pushes catalog changes to Server-Sent Events subscribers.
+
+    One task per process polls the catalog version and, when it changes,
+    serializes the delta once and hands the same bytes to every subscriber,
+    so the cost of a reload does not grow with the number of open streams.
+    """
+
+    def __init__(self, data_service, poll_interval: float = FEED_POLL_INTERVAL):
+        self._service = data_service
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._task = None
+
+    async def events(self, since: Optional[int] = None):
+        """Event stream bytes for one subscriber, starting with a catch-up from since"""
+        queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        self._ensure_watching()
+        try:
+            current = await self._service.run_blocking(self._service.get_changes, None)
+            version = current['version']
+            yield f"retry: 3000\nid: {version}\nevent: ready\ndata: {json.dumps({'version': version})}\n\n".encode()
+            if since is not None and since != version:
+                changes = await self._service.run_blocking(self._service.get_changes, since, version)
+                yield _format_event(changes)
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), FEED_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if item is None:
+                    # Fell too far behind; the client reconnects and catches up
+                    return
+                changes, event = item
+                if changes['version'] <= version:
+                    continue
+                if changes['since'] != version:
+                    # Subscribed between two polls: send the delta from this subscriber's version
+                    changes = await self._service.run_blocking(self._service.get_changes, version,
+                                                               changes['version'])
+                    event = _format_event(changes)
+                version = changes['version']
+                yield event
+        finally:
+            self._subscribers.discard(queue)
+
+    def _ensure_watching(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _watch(self):
+        version = None
+        while self._subscribers:
+            try:
+                changes = await self._service.run_blocking(self._service.get_changes, version)
+            except Exception as e:
+                print(f"Change feed error: {e}")
+            else:
+                if version is not None and changes['version'] != version:
+                    self._broadcast(changes, _format_event(changes))
+                version = changes['version']
+            await asyncio.sleep(self.poll_interval)
+
+    def _broadcast(self, changes: Dict, event: bytes):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait((changes, event))
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+def _format_event(changes: Dict) -> bytes:
+    data = json.dumps(changes, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {changes['version']}\nevent: changes\ndata: {data}\n\n".encode('utf-8')
@@ -0,0 +1,224 @@
+from array import array
+from bisect import bisect_right
+from itertools import repeat
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+
+# NumPy is optional; without it facets are tallied in pure Python, which
+# gives the same counts but is much slower on large catalogs
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from services.aggregates import parse_duration
+from services.radio_queue import normalize_hashtag
+
+# Hashtags returned by default, and at most
+HASHTAG_FACET_SIZE = 20
+MAX_HASHTAG_FACET_SIZE = 200
+
+# Lower bounds of the duration buckets, in seconds (durations that cannot be
+# parsed count as 0 and land in the first one)
+DURATION_BUCKETS = (0, 3 * 60, 10 * 60, 30 * 60, 60 * 60, 2 * 60 * 60)
+
+# Lower bounds of the view count bins: one per power of ten
+VIEW_BINS = (0,) + tuple(10 ** exponent for exponent in range(1, 10))
+
+# Fields the index reads from each track
+FACET_FIELDS = ('video_id', 'channel_title', 'hashtags', 'duration', 'upload_date', 'view_count')
+
+
+class FacetIndex:
+    """
+    Facet counts for one catalog version.
+
+    Every facet is an array holding one small integer code per track (its
+    channel, duration bucket, upload month or view bin) and hashtags are a
+    flat array of (track, hashtag) postings. A filtered facet query is then
+    a selection over track ordinals followed by one bincount per facet,
+    with no per-track dicts touched. The unfiltered counts are computed
+    once and reused.
+    """
+
+    def __init__(self, tracks: Sequence[Mapping], channel_key: Callable[[Mapping], Optional[str]]):
+        self.video_ids: List[str] = [track['video_id'] for track in tracks]
+        self.ordinals = {video_id: ordinal for ordinal, video_id in enumerate(self.video_ids)}
+        self._everything: Optional[Dict] = None
+
+        # Channels are coded by lookup key and labeled with the first title
+        # seen; tracks without a channel get the code one past the last
+        self.channels: Dict[str, int] = {}
+        self.channel_titles: List[str] = []
+        channel_codes = []
+        for track in tracks:
+            key = channel_key(track)
+            code = self.channels.get(key) if key is not None else -1
+            if code is None:
+                code = self.channels[key] = len(self.channel_titles)
+                self.channel_titles.append(track['channel_title'])
+            channel_codes.append(code)
+        channel_codes = [len(self.channel_titles) if code < 0 else code for code in channel_codes]
+
+        months = [(track['upload_date'] or '')[:7] for track in tracks]
+        self.months: List[str] = sorted({month for month in months if len(month) == 7})
+        month_codes = {month: code for code, month in enumerate(self.months)}
+        month_codes = [month_codes.get(month, len(self.months)) for month in months]
+
+        self.hashtags: Dict[str, int] = {}
+        self.hashtag_labels: List[str] = []
+        tag_docs, tag_codes = array('I'), array('I')
+        tag_start = array('I', [0])
+        for ordinal, track in enumerate(tracks):
+            seen = set()
+            for hashtag in track['hashtags'] or ():
+                key = normalize_hashtag(str(hashtag))
+                code = self.hashtags.get(key)
+                if code is None:
+                    code = self.hashtags[key] = len(self.hashtag_labels)
+                    self.hashtag_labels.append(str(hashtag))
+                if code not in seen:
+                    seen.add(code)
+                    tag_docs.append(ordinal)
+                    tag_codes.append(code)
+            tag_start.append(len(tag_codes))
+
+        self._columns = {
+            'channels': array('I', channel_codes),
+            'durations': array('B', [bisect_right(DURATION_BUCKETS, parse_duration(track['duration'])) - 1
+                                     for track in tracks]),
+            'upload_months': array('I', month_codes),
+            'views': array('B', [bisect_right(VIEW_BINS, max(track['view_count'] or 0, 0)) - 1
+                                 for track in tracks]),
+        }
+        self._sizes = {
+            'channels': len(self.channel_titles),
+            'durations': len(DURATION_BUCKETS),
+            'upload_months': len(self.months),
+            'views': len(VIEW_BINS),
+        }
+        self._tag_docs, self._tag_codes, self._tag_start = tag_docs, tag_codes, tag_start
+        if NUMPY_AVAILABLE:
+            self._columns = {name: np.frombuffer(column, dtype=np.uint32 if column.typecode == 'I' else np.uint8)
+                             for name, column in self._columns.items()}
+            self._tag_docs = np.frombuffer(tag_docs, dtype=np.uint32)
+            self._tag_codes = np.frombuffer(tag_codes, dtype=np.uint32)
+            self._has_hashtags = np.diff(np.frombuffer(tag_start, dtype=np.uint32)) > 0
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    def facets(self, matches: Optional[Iterable[str]] = None, channel: Optional[str] = None,
+               has_hashtags: bool = False, hashtag_limit: int = HASHTAG_FACET_SIZE) -> Dict:
+        """
+        Facet counts for the tracks passing the filters: matches (the
+        video_ids a search returned; None for no search), a channel lookup
+        key and has_hashtags. Channel counts leave out the channel filter,
+        so a sidebar can still offer the other channels.
+        """
+        if matches is None and not has_hashtags:
+            if self._everything is None:
+                self._everything = self._tally(self._select(None, False))
+            counts = self._everything
+            if channel is not None:
+                counts = dict(self._tally(self._select(None, False, self._channel_code(channel))),
+                              channels=counts['channels'])
+        else:
+            base = self._select(matches, has_hashtags)
+            counts = self._tally(base)
+            if channel is not None:
+                counts = dict(self._tally(self._select(matches, has_hashtags, self._channel_code(channel), base)),
+                              channels=counts['channels'])
+        return self._format(counts, hashtag_limit)
+
+    def _channel_code(self, channel: str) -> int:
+        # Unknown channels get a code no track has
+        return self.channels.get(channel, len(self.channel_titles) + 1)
+
+    def _select(self, matches: Optional[Iterable[str]], has_hashtags: bool, channel: Optional[int] = None,
+                base=None):
+        """
+        The ordinals passing the filters: a boolean mask with NumPy, a list
+        of ordinals without it. base, if given, is the selection for the
+        same matches and has_hashtags.
+        """
+        n = len(self.video_ids)
+        ordinals = self.ordinals
+        if NUMPY_AVAILABLE:
+            if base is not None:
+                selected = base.copy()
+            elif matches is None:
+                selected = np.ones(n, dtype=bool)
+            else:
+                # IDs this index does not know (e.g. from a newer version) hit the spare last slot
+                selected = np.zeros(n + 1, dtype=bool)
+                selected[np.fromiter(map(ordinals.get, matches, repeat(n)), dtype=np.int64)] = True
+                selected = selected[:n]
+            if has_hashtags and base is None:
+                selected &= self._has_hashtags
+            if channel is not None:
+                selected &= self._columns['channels'] == channel
+            return selected
+
+        if base is not None:
+            selected = base
+        elif matches is None:
+            selected = range(n)
+        else:
+            selected = [ordinals[video_id] for video_id in matches if video_id in ordinals]
+        if has_hashtags and base is None:
+            starts = self._tag_start
+            selected = [ordinal for ordinal in selected if starts[ordinal + 1] > starts[ordinal]]
+        if channel is not None:
+            codes = self._columns['channels']
+            selected = [ordinal for ordinal in selected if codes[ordinal] == channel]
+        return selected
+
+    def _tally(self, selected) -> Dict:
+        """Per-code counts of every facet over a selection from _select()"""
+        counts = {}
+        if NUMPY_AVAILABLE:
+            for name, column in self._columns.items():
+                counts[name] = np.bincount(column[selected], minlength=self._sizes[name] + 1).tolist()
+            counts['hashtags'] = np.bincount(self._tag_codes[selected[self._tag_docs]],
+                                             minlength=len(self.hashtag_labels)).tolist()
+            counts['total'] = int(np.count_nonzero(selected))
+            return counts
+
+        for name, column in self._columns.items():
+            tally = [0] * (self._sizes[name] + 1)
+            for ordinal in selected:
+                tally[column[ordinal]] += 1
+            counts[name] = tally
+        tally = [0] * len(self.hashtag_labels)
+        starts, codes = self._tag_start, self._tag_codes
+        for ordinal in selected:
+            for position in range(starts[ordinal], starts[ordinal + 1]):
+                tally[codes[position]] += 1
+        counts['hashtags'] = tally
+        counts['total'] = len(selected)
+        return counts
+
+    def _format(self, counts: Dict, hashtag_limit: int) -> Dict:
+        channels = sorted((code for code, count in enumerate(counts['channels'][:-1]) if count),
+                          key=lambda code: (-counts['channels'][code], self.channel_titles[code].casefold()))
+        tag_counts = counts['hashtags']
+        hashtags = sorted((code for code, count in enumerate(tag_counts) if count),
+                          key=lambda code: (-tag_counts[code], code))[:hashtag_limit]
+        return {
+            'total': counts['total'],
+            'channels': [{'channel_title': self.channel_titles[code], 'count': counts['channels'][code]}
+                         for code in channels],
+            'hashtags': [{'hashtag': self.hashtag_labels[code], 'count': tag_counts[code]} for code in hashtags],
+            'durations': _ranges(DURATION_BUCKETS, counts['durations'], 'min_seconds', 'max_seconds'),
+            'upload_months': [{'month': month, 'count': count}
+                              for month, count in zip(self.months, counts['upload_months']) if count],
+            'views': _ranges(VIEW_BINS, counts['views'], 'min_views', 'max_views'),
+        }
+
+
+def _ranges(bounds: Sequence[int], counts: Sequence[int], low: str, high: str) -> List[Dict]:
+    """Buckets as [low, high) ranges with their counts; the last one has no upper bound"""
+    return [{low: start, high: bounds[i + 1] if i + 1 < len(bounds) else None, 'count': counts[i]}
+            for i, start in enumerate(bounds)]
@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from services.search_index import tokenize
+
+# Results kept for the current catalog version, least recently used first out
+QUERY_CACHE_SIZE = int(os.getenv("QUANTUM_RADIO_QUERY_CACHE_SIZE", "1024"))
+
+# Tracks (or ordinals) all cached results may hold together; a single result
+# larger than a quarter of this is not cached
+QUERY_CACHE_ITEMS = int(os.getenv("QUANTUM_RADIO_QUERY_CACHE_ITEMS", "2000000"))
+
+
+def query_terms(query: str) -> Tuple[str, ...]:
+    """
+    Normalized form of a search: its distinct terms, sorted. Queries with
+    the same terms match the same tracks in the same order, whatever their
+    case, punctuation or word order.
+    """
+    return tuple(sorted(set(tokenize(query))))
+
+
+def extends(terms: Tuple[str, ...], shorter: Tuple[str, ...]) -> bool:
+    """
+    Whether every match of terms is also a match of shorter: each term of
+    shorter is a prefix of one of terms (as when "lof" is typed on to "lofi")
+    """
+    return bool(shorter) and all(any(term.startswith(prefix) for term in terms) for prefix in shorter)
+
+
+class QueryCache:
+    """
+    LRU cache of query results for one catalog version.
+
+    Keys start with a kind and the query's normalized terms. Entries are
+    only valid for the version they were computed from, so the first lookup
+    or store for another version drops them all; callers only use the cache
+    for the current snapshot. Bounded both by entry count and by the total
+    length of the cached results.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, max_items: int = QUERY_CACHE_ITEMS):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self._entries: Dict[Tuple, Sequence] = OrderedDict()
+        self._items = 0
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._narrowed = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def _scope(self, version: int):
+        """Drop every entry if they were computed for another version"""
+        if version != self._version:
+            if self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._items = 0
+            self._version = version
+
+    def get(self, version: int, key: Tuple) -> Optional[Sequence]:
+        with self._lock:
+            self._scope(version)
+            result = self._entries.get(key)
+            if result is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return result
+
+    def narrowest(self, version: int, key: Tuple) -> Optional[Sequence]:
+        """
+        The smallest cached result of the same kind and filters (key[0] and
+        key[2:]) for terms that key[1] extends; a superset of key's result
+        """
+        terms, rest = key[1], (key[0],) + key[2:]
+        best = None
+        with self._lock:
+            self._scope(version)
+            for cached_key, result in self._entries.items():
+                if ((best is None or len(result) < len(best)) and (cached_key[0],) + cached_key[2:] == rest
+                        and extends(terms, cached_key[1])):
+                    best = result
+            if best is not None:
+                self._narrowed += 1
+            return best
+
+    def put(self, version: int, key: Tuple, result: Sequence):
+        if len(result) > self.max_items // 4:
+            return
+        with self._lock:
+            self._scope(version)
+            if key in self._entries:
+                return
+            self._entries[key] = result
+            self._items += len(result)
+            while len(self._entries) > self.max_entries or self._items > self.max_items:
+                _, evicted = self._entries.popitem(last=False)
+                self._items -= len(evicted)
+                self._evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "version": self._version,
+                "entries": len(self._entries),
+                "items": self._items,
+                "hits": self._hits,
+                "misses": self._misses,
+                "narrowed": self._narrowed,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
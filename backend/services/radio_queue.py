@@ -0,0 +1,203 @@
+import math
+import os
+import random
+import secrets
+import threading
+from collections import OrderedDict, deque
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+# Tracks returned per queue request by default, and at most
+RADIO_BATCH_SIZE = 10
+MAX_RADIO_BATCH_SIZE = 100
+
+# Tracks a session will not hear again until this many others have played
+# (capped at half the pool, so small pools still have something to play)
+REPEAT_WINDOW = int(os.getenv("QUANTUM_RADIO_REPEAT_WINDOW", "100"))
+
+# Listening sessions remembered at once; the least recently used is dropped
+MAX_SESSIONS = int(os.getenv("QUANTUM_RADIO_MAX_SESSIONS", "10000"))
+
+# Sampling pools kept (one per catalog version, weighting and filter)
+POOL_CACHE_SIZE = 32
+
+# Age at which the recency weighting halves a track's chance of playing
+RECENCY_HALF_LIFE_DAYS = 90
+
+# Lowest recency weight, so old uploads still come up now and then
+MIN_RECENCY_WEIGHT = 0.05
+
+MAX_SESSION_ID_LENGTH = 64
+
+
+def _popularity(field: str) -> Callable[[Sequence[Mapping]], List[float]]:
+    # Logarithmic, so a hit plays more often without drowning out the long tail
+    return lambda tracks: [1.0 + math.log1p(max(track[field] or 0, 0)) for track in tracks]
+
+
+def _recency(tracks: Sequence[Mapping]) -> List[float]:
+    days = [_upload_day(track['upload_date']) for track in tracks]
+    newest = max((day for day in days if day is not None), default=None)
+    if newest is None:
+        return [1.0] * len(tracks)
+    return [MIN_RECENCY_WEIGHT if day is None else
+            max(MIN_RECENCY_WEIGHT, 0.5 ** ((newest - day) / RECENCY_HALF_LIFE_DAYS)) for day in days]
+
+
+def _upload_day(upload_date: Optional[str]) -> Optional[int]:
+    try:
+        return date.fromisoformat(upload_date[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+# Weightings accepted by the API, mapped to a function computing every
+# pool track's weight (None samples uniformly)
+RADIO_WEIGHTINGS: Dict[str, Optional[Callable[[Sequence[Mapping]], List[float]]]] = {
+    'uniform': None,
+    'views': _popularity('view_count'),
+    'likes': _popularity('likes'),
+    'recency': _recency,
+}
+
+
+def normalize_hashtag(hashtag: str) -> str:
+    """Key used for case-insensitive hashtag matching, with or without the '#'"""
+    return '#' + hashtag.strip().lstrip('#').casefold()
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(n) to build, O(1) per weighted draw"""
+
+    __slots__ = ('_probability', '_alias')
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+        self._probability = [1.0] * n
+        self._alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left is 1.0 up to rounding errors
+
+    def draw(self, rng: random.Random) -> int:
+        column = rng.randrange(len(self._alias))
+        return column if rng.random() < self._probability[column] else self._alias[column]
+
+
+class RadioPool:
+    """The tracks a queue draws from, with their sampling table, for one catalog version"""
+
+    __slots__ = ('video_ids', '_alias')
+
+    def __init__(self, candidates: Sequence[Mapping], weighting: str):
+        self.video_ids = tuple(track['video_id'] for track in candidates)
+        weigh = RADIO_WEIGHTINGS[weighting]
+        self._alias = AliasTable(weigh(candidates)) if weigh and candidates else None
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    def sample(self, count: int, excluded: Iterable[str], rng: random.Random) -> List[str]:
+        """Up to count distinct video_ids, none of them in excluded"""
+        skip = set(excluded)
+        chosen = []
+        if self._alias is not None:
+            # Weighted draws, rejecting repeats; bounded so a few heavy tracks
+            # that are all excluded cannot stall the loop
+            for _ in range(count * 10 + 100):
+                if len(chosen) >= count:
+                    return chosen
+                video_id = self.video_ids[self._alias.draw(rng)]
+                if video_id not in skip:
+                    skip.add(video_id)
+                    chosen.append(video_id)
+        return chosen + self._shuffled(count - len(chosen), skip, rng)
+
+    def _shuffled(self, count: int, skip: set, rng: random.Random) -> List[str]:
+        """
+        The first tracks of a uniform Fisher-Yates shuffle, skipping excluded
+        ones. Swaps are kept in a dict, so the cost grows with the tracks
+        dealt rather than the pool size.
+        """
+        n = len(self.video_ids)
+        swaps: Dict[int, int] = {}
+        chosen = []
+        for i in range(n):
+            if len(chosen) >= count:
+                break
+            j = rng.randrange(i, n)
+            picked = swaps.get(j, j)
+            swaps[j] = swaps.get(i, i)
+            video_id = self.video_ids[picked]
+            if video_id not in skip:
+                chosen.append(video_id)
+        return chosen
+
+
+class RadioQueue:
+    """
+    Deals batches of tracks to listening sessions.
+
+    Pools are built once per catalog version, weighting and filter, and each
+    session remembers the last REPEAT_WINDOW tracks it was dealt (sessions
+    live in a bounded LRU), so a long session does not repeat itself.
+    """
+
+    def __init__(self, repeat_window: int = REPEAT_WINDOW, max_sessions: int = MAX_SESSIONS):
+        self.repeat_window = repeat_window
+        self.max_sessions = max_sessions
+        self._pools: Dict[Tuple, RadioPool] = OrderedDict()
+        self._sessions: Dict[str, deque] = OrderedDict()
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    @staticmethod
+    def validate(weighting: str, session: Optional[str]):
+        if weighting not in RADIO_WEIGHTINGS:
+            raise ValueError(f"Unknown weighting '{weighting}', expected one of: {', '.join(RADIO_WEIGHTINGS)}")
+        if session is not None and not 0 < len(session) <= MAX_SESSION_ID_LENGTH:
+            raise ValueError(f"Session IDs must be 1 to {MAX_SESSION_ID_LENGTH} characters long")
+
+    def pool(self, key: Tuple, candidates: Callable[[], Sequence[Mapping]], weighting: str) -> RadioPool:
+        """The pool for key (which must include the catalog version), built on first use"""
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+                return pool
+        # Built outside the lock; a concurrent first use may build it twice, which is harmless
+        pool = RadioPool(candidates(), weighting)
+        with self._lock:
+            self._pools[key] = pool
+            while len(self._pools) > POOL_CACHE_SIZE:
+                self._pools.popitem(last=False)
+        return pool
+
+    def deal(self, session: Optional[str], pool: RadioPool, count: int) -> Tuple[str, List[str]]:
+        """The next count video_ids for a session (a new one when session is None)"""
+        with self._lock:
+            if session is None:
+                session = secrets.token_urlsafe(12)
+            history = self._sessions.pop(session, None)
+            if history is None:
+                history = deque(maxlen=self.repeat_window)
+            self._sessions[session] = history
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            count = min(count, len(pool))
+            window = min(self.repeat_window, len(pool) // 2)
+            recent = list(history)[-window:] if window else ()
+            video_ids = pool.sample(count, recent, self._rng)
+            if len(video_ids) < count:
+                # A batch larger than the tracks not heard recently
+                video_ids += pool.sample(count - len(video_ids), video_ids, self._rng)
+            history.extend(video_ids)
+        return session, video_ids
@@ -0,0 +1,113 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Quiet period after the last file event before a reload starts
+DEFAULT_SETTLE_DELAY = 0.5
+
+
+class ReloadScheduler:
+    """
+    A single worker thread that runs a reload function on request.
+
+    Requests coalesce: however many arrive while a reload is waiting or
+    running, at most one more reload is scheduled. The wait is a trailing
+    debounce, so the reload always starts settle_delay seconds after the
+    *last* event of a burst and never misses the final write.
+
+    The reload function returns an outcome name ("reloaded", "unchanged",
+    ...) which is counted; exceptions are counted as "failed".
+    """
+
+    def __init__(self, reload_func: Callable[[], str], settle_delay: float = DEFAULT_SETTLE_DELAY,
+                 name: str = "reload-scheduler"):
+        self._reload_func = reload_func
+        self.settle_delay = settle_delay
+        self._condition = threading.Condition()
+        self._pending = False
+        self._last_request = 0.0
+        self._stopped = False
+        self._running = False
+
+        self._requests = 0
+        self._outcomes: Dict[str, int] = {}
+        self._total_duration = 0.0
+        self._last_duration: Optional[float] = None
+        self._last_outcome: Optional[str] = None
+        self._last_error: Optional[str] = None
+        self._last_finished_at: Optional[float] = None
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def request(self):
+        """Ask for a reload; cheap and safe to call from any thread"""
+        with self._condition:
+            self._requests += 1
+            self._pending = True
+            self._last_request = time.monotonic()
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                # Wait until events stop arriving for settle_delay seconds
+                while True:
+                    remaining = self._last_request + self.settle_delay - time.monotonic()
+                    if remaining <= 0 or self._stopped:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopped:
+                    return
+                self._pending = False
+                self._running = True
+
+            started = time.perf_counter()
+            error = None
+            try:
+                outcome = self._reload_func() or "reloaded"
+            except Exception as e:
+                outcome, error = "failed", f"{type(e).__name__}: {e}"
+                print(f"Reload failed: {error}")
+            duration = time.perf_counter() - started
+
+            with self._condition:
+                self._running = False
+                self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+                self._total_duration += duration
+                self._last_duration = duration
+                self._last_outcome = outcome
+                if error or outcome == "failed":
+                    self._last_error = error
+                self._last_finished_at = time.time()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            runs = sum(self._outcomes.values())
+            return {
+                "events": self._requests,
+                "runs": runs,
+                "coalesced": max(0, self._requests - runs - (1 if self._pending or self._running else 0)),
+                "outcomes": dict(self._outcomes),
+                "pending": self._pending,
+                "running": self._running,
+                "last_outcome": self._last_outcome,
+                "last_duration_ms": round(self._last_duration * 1000, 1) if self._last_duration is not None else None,
+                "avg_duration_ms": round(self._total_duration / runs * 1000, 1) if runs else None,
+                "last_finished_at": (_iso_time(self._last_finished_at)
+                                     if self._last_finished_at is not None else None),
+                "last_error": self._last_error,
+            }
+
+
+def _iso_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
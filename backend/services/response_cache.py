@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+# Brotli is optional; without it clients simply get gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+# Bytes gathered before each write of a streamed body
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+
+def serialize_json(payload: Any) -> bytes:
+    """
+    Serialize a payload exactly the way FastAPI's JSONResponse does.
+
+    Top-level lists are encoded one element at a time: the C encoder holds
+    the GIL for the whole call, and a single call over the full catalog
+    would stall every other thread (including the event loop) meanwhile.
+    """
+    if isinstance(payload, list):
+        return b"[" + b",".join(_encoder.encode(item).encode("utf-8") for item in payload) + b"]"
+    return _encoder.encode(payload).encode("utf-8")
+
+
+def iter_json_lines(items: Iterable[Any], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Encode items as newline-delimited JSON, about chunk_size bytes at a time"""
+    buffer = []
+    size = 0
+    for item in items:
+        line = _encoder.encode(item).encode("utf-8") + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_json_array(items: Iterable[Any], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Encode items as one JSON array (the same bytes as serialize_json), about chunk_size bytes at a time"""
+    buffer = [b"["]
+    size = 1
+    separator = b""
+    for item in items:
+        encoded = separator + _encoder.encode(item).encode("utf-8")
+        separator = b","
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+
+class PreparedResponse:
+    """
+    A JSON response body serialized once per catalog version, together with
+    its pre-compressed variants and a strong ETag.
+
+    The ETag combines the snapshot version with a digest of the body, so it
+    stays correct across process restarts where version numbers start over.
+    """
+
+    __slots__ = ('version', 'etag', 'body', 'gzip_body', 'brotli_body')
+
+    def __init__(self, version: int, payload: Any):
+        self.version = version
+        self.body = serialize_json(payload)
+        digest = hashlib.sha1(self.body).hexdigest()[:16]
+        self.etag = f'"{version}-{digest}"'
+
+        self.gzip_body: Optional[bytes] = None
+        self.brotli_body: Optional[bytes] = None
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            self.gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+            if BROTLI_AVAILABLE:
+                self.brotli_body = brotli.compress(self.body, quality=5)
+
+    @classmethod
+    def from_parts(cls, version: int, etag: str, body, gzip_body=None, brotli_body=None) -> 'PreparedResponse':
+        """
+        Rebuild a prepared response from stored parts; the bodies may be any
+        bytes-like objects, such as memoryviews into a mapped catalog
+        """
+        prepared = cls.__new__(cls)
+        prepared.version = version
+        prepared.etag = etag
+        prepared.body = body
+        prepared.gzip_body = gzip_body
+        prepared.brotli_body = brotli_body
+        return prepared
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Strong ETags must differ between encodings of the same resource"""
+        if not encoding:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Whether an If-None-Match header matches any variant of this body"""
+        if not if_none_match:
+            return False
+        candidates = {tag.strip() for tag in if_none_match.split(',')}
+        if '*' in candidates:
+            return True
+        variants = {self.etag, self.etag_for('gzip'), self.etag_for('br')}
+        return bool(candidates & variants)
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Pick the best pre-compressed body for an Accept-Encoding header"""
+        accepted = _parse_accept_encoding(accept_encoding)
+        if self.brotli_body is not None and accepted.get('br', 0) > 0:
+            return self.brotli_body, 'br'
+        if self.gzip_body is not None and accepted.get('gzip', 0) > 0:
+            return self.gzip_body, 'gzip'
+        return self.body, None
+
+
+def _parse_accept_encoding(header: Optional[str]) -> dict:
+    """Parse an Accept-Encoding header into {coding: q-value}"""
+    accepted = {}
+    if not header:
+        return accepted
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    if '*' in accepted:
+        accepted.setdefault('gzip', accepted['*'])
+        accepted.setdefault('br', accepted['*'])
+    return accepted
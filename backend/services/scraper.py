@@ -1,50 +1,393 @@
 import json
 import os
-from typing import List, Dict
+import re
+import time
+from typing import List, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
 import aiohttp
 import asyncio
-from datetime import datetime
+
+from services.audio_downloader import audio_downloader
+from services.setlist_reader import SetlistReader
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
-DATA_FILE = os.path.join(DATA_DIR, "playlist_tracks.json")
+PLAYLISTS_FILE = os.path.join(DATA_DIR, "ai_music_playlists.json")
+SETLIST_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "AI_Setlist.json")
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "scrape_checkpoint.json")
+SPOOL_FILE = os.path.join(DATA_DIR, "scrape_items.jsonl")
+
+API_BASE = os.getenv("YOUTUBE_API_BASE", "https://www.googleapis.com/youtube/v3")
+API_KEY = os.getenv("YOUTUBE_API_KEY")
+
+# Playlists paged through at once, and requests per second allowed to each host
+PLAYLIST_CONCURRENCY = int(os.getenv("QUANTUM_RADIO_SCRAPE_CONCURRENCY", "4"))
+REQUESTS_PER_SECOND = float(os.getenv("QUANTUM_RADIO_SCRAPE_RPS", "10"))
+
+PAGE_SIZE = 50  # The API maximum for playlistItems, videos and channels
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled after each failure
+HASHTAGS_SHOWN = 3   # YouTube shows the first three description hashtags above the title
+
+# Optional URL template for fetching audio, e.g. "https://media.example/{video_id}.mp3"
+AUDIO_SOURCE_URL = os.getenv("QUANTUM_RADIO_AUDIO_SOURCE_URL")
+
+_DURATION_RE = re.compile(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?")
+_HASHTAG_RE = re.compile(r"#[^\W_][\w]*", re.UNICODE)
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class HostRateLimiter:
+    """Token bucket per host, so one slow API never starves requests to another"""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # host -> (tokens, updated at)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def acquire(self, host: str):
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            tokens, updated = self._buckets.get(host, (float(self.burst), time.monotonic()))
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                await asyncio.sleep((1 - tokens) / self.rate)
+                now = time.monotonic()
+                tokens = 1.0
+            self._buckets[host] = (tokens - 1, now)
+
+
+class PlaylistScraper:
+    """
+    Fetch every video of a set of YouTube playlists and normalize them into
+    the APIFY item schema that AI_Setlist.json uses.
+
+    Playlists are paged through concurrently over one pooled session. Each
+    page of up to 50 items costs one playlistItems call, one videos call for
+    statistics and duration, and at most one channels call for subscriber
+    counts of channels not seen yet.
+
+    Progress is checkpointed after every page: normalized items are appended
+    to a JSONL spool and the next page token of each playlist is recorded, so
+    an interrupted run picks up where it stopped. Only a finished run
+    rewrites AI_Setlist.json, via a temp file and an atomic rename.
+    """
+
+    def __init__(self, api_base: str = API_BASE, api_key: Optional[str] = API_KEY,
+                 setlist_file: str = SETLIST_FILE, checkpoint_file: str = CHECKPOINT_FILE,
+                 spool_file: str = SPOOL_FILE, concurrency: int = PLAYLIST_CONCURRENCY,
+                 rate_limiter: Optional[HostRateLimiter] = None,
+                 session: Optional[aiohttp.ClientSession] = None):
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.setlist_file = setlist_file
+        self.checkpoint_file = checkpoint_file
+        self.spool_file = spool_file
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self._session = session
+        self._owns_session = session is None
+        self._channels: Dict[str, Dict] = {}
+        self._checkpoint: Dict[str, Dict] = {}
+        self.stats = {'requests': 0, 'retries': 0, 'pages': 0, 'items': 0}
+        self.scraped: List[Dict] = []  # Every item of the last finished run, including resumed pages
+
+    async def run(self, playlists: List[Dict]) -> Dict:
+        """Scrape the playlists, then merge the results into the setlist"""
+        started = time.monotonic()
+        self._checkpoint = self._load_checkpoint()
+        resumed = bool(self._checkpoint)
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency * 2, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60))
+        try:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def scrape(playlist: Dict):
+                async with semaphore:
+                    await self._scrape_playlist(playlist)
+
+            results = await asyncio.gather(*(scrape(playlist) for playlist in playlists
+                                             if not self._checkpoint.get(playlist['playlist_id'], {}).get('done')),
+                                           return_exceptions=True)
+        finally:
+            if self._owns_session:
+                await self._session.close()
+                self._session = None
+
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if failures:
+            # Leave the checkpoint and spool in place; the next run resumes from them
+            raise failures[0]
+
+        items = self._read_spool()
+        self.scraped = list(items.values())
+        written = write_setlist(self.setlist_file, self.scraped)
+        for path in (self.checkpoint_file, self.spool_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+        elapsed = time.monotonic() - started
+        return dict(self.stats, scraped=len(items), setlist_items=written, resumed=resumed,
+                    seconds=round(elapsed, 3),
+                    items_per_second=round(self.stats['items'] / elapsed, 1) if elapsed else 0.0)
+
+    async def _scrape_playlist(self, playlist: Dict):
+        playlist_id = playlist['playlist_id']
+        source = playlist.get('title') or f"playlist:{playlist_id}"
+        page_token = self._checkpoint.get(playlist_id, {}).get('page_token')
+        while True:
+            params = {'part': 'contentDetails', 'playlistId': playlist_id, 'maxResults': PAGE_SIZE}
+            if page_token:
+                params['pageToken'] = page_token
+            page = await self._get('playlistItems', params)
+            if page is None:
+                print(f"Skipping playlist {playlist_id}: not found or not accessible")
+                break
+
+            video_ids = [item['contentDetails']['videoId'] for item in page.get('items', [])
+                         if item.get('contentDetails', {}).get('videoId')]
+            items = await self._fetch_videos(video_ids, playlist_id, source)
+            page_token = page.get('nextPageToken')
+            self._append_page(playlist_id, items, page_token)
+            if not page_token:
+                break
+        self._checkpoint[playlist_id] = {'done': True}
+        self._save_checkpoint()
+
+    async def _fetch_videos(self, video_ids: List[str], playlist_id: str, source: str) -> List[Dict]:
+        if not video_ids:
+            return []
+        response = await self._get('videos', {'part': 'snippet,statistics,contentDetails',
+                                              'id': ','.join(video_ids), 'maxResults': PAGE_SIZE})
+        videos = (response or {}).get('items', [])  # Private and deleted videos are simply missing
+
+        unknown = sorted({video['snippet']['channelId'] for video in videos} - self._channels.keys())
+        if unknown:
+            response = await self._get('channels', {'part': 'snippet,statistics', 'id': ','.join(unknown),
+                                                    'maxResults': PAGE_SIZE})
+            for channel in (response or {}).get('items', []):
+                self._channels[channel['id']] = channel
+        return [normalize_video(video, self._channels.get(video['snippet']['channelId']), playlist_id, source)
+                for video in videos]
+
+    async def _get(self, endpoint: str, params: Dict) -> Optional[Dict]:
+        """GET an API endpoint with per-host rate limiting and retries; None on 404"""
+        url = f"{self.api_base}/{endpoint}"
+        if self.api_key:
+            params = dict(params, key=self.api_key)
+        host = urlsplit(url).netloc
+        for attempt in range(MAX_ATTEMPTS):
+            await self.rate_limiter.acquire(host)
+            self.stats['requests'] += 1
+            delay = RETRY_BACKOFF * (2 ** attempt)
+            try:
+                async with self._session.get(url, params=params) as response:
+                    if response.status == 404:
+                        return None
+                    if response.status not in _RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        return await response.json()
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    error = f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            if attempt + 1 == MAX_ATTEMPTS:
+                raise RuntimeError(f"{endpoint} failed after {MAX_ATTEMPTS} attempts: {error}")
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
 
-async def refresh_playlist() -> List[Dict]:
+    # Checkpointing ---------------------------------------------------------
+
+    def _load_checkpoint(self) -> Dict[str, Dict]:
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Ignoring unreadable scrape checkpoint: {str(e)}")
+            return {}
+
+    def _save_checkpoint(self):
+        _write_atomic(self.checkpoint_file, lambda f: json.dump(self._checkpoint, f))
+
+    def _append_page(self, playlist_id: str, items: List[Dict], next_page_token: Optional[str]):
+        """Persist a page's items, then record that the page is done"""
+        with open(self.spool_file, 'a', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False))
+                f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._checkpoint[playlist_id] = {'page_token': next_page_token, 'done': False}
+        self._save_checkpoint()
+        self.stats['pages'] += 1
+        self.stats['items'] += len(items)
+
+    def _read_spool(self) -> Dict[str, Dict]:
+        """Spooled items by video ID; a page re-fetched after a crash simply overwrites its items"""
+        items: Dict[str, Dict] = {}
+        if not os.path.exists(self.spool_file):
+            return items
+        with open(self.spool_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                items[item['id']] = item
+        return items
+
+
+def normalize_video(video: Dict, channel: Optional[Dict], playlist_id: str, source: str) -> Dict:
+    """Convert a YouTube Data API video resource into an APIFY setlist item"""
+    snippet = video.get('snippet', {})
+    statistics = video.get('statistics', {})
+    channel_id = snippet.get('channelId', '')
+    thumbnails = snippet.get('thumbnails', {})
+    thumbnail = next((thumbnails[size]['url'] for size in ('maxres', 'standard', 'high', 'medium', 'default')
+                      if size in thumbnails), '')
+    description = snippet.get('description', '')
+
+    channel_url = f"https://www.youtube.com/channel/{channel_id}"
+    subscribers = 0
+    if channel:
+        custom_url = channel.get('snippet', {}).get('customUrl')
+        if custom_url:
+            channel_url = f"https://www.youtube.com/{custom_url}"
+        subscribers = int(channel.get('statistics', {}).get('subscriberCount', 0))
+
+    return {
+        'id': video['id'],
+        'url': f"https://www.youtube.com/watch?v={video['id']}&list={playlist_id}",
+        'title': snippet.get('title', ''),
+        'type': 'video',
+        'thumbnailUrl': thumbnail,
+        'text': description,
+        'viewCount': int(statistics.get('viewCount', 0)),
+        'likes': int(statistics.get('likeCount', 0)),
+        'commentsCount': int(statistics.get('commentCount', 0)),
+        'duration': format_duration(video.get('contentDetails', {}).get('duration', '')),
+        'date': format_date(snippet.get('publishedAt', '')),
+        'channelName': snippet.get('channelTitle', ''),
+        'channelUrl': channel_url,
+        'channelId': channel_id,
+        'numberOfSubscribers': subscribers,
+        'hashtags': list(dict.fromkeys(_HASHTAG_RE.findall(description)))[:HASHTAGS_SHOWN],
+        'input': source,
+    }
+
+
+def format_duration(iso_duration: str) -> str:
+    """ISO 8601 duration (PT2H26M29S) to the HH:MM:SS form APIFY uses"""
+    match = _DURATION_RE.fullmatch(iso_duration or '')
+    if not match or not iso_duration:
+        return ''
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return f"{days * 24 + hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def format_date(published_at: str) -> str:
+    """2025-02-03T13:45:03Z to the millisecond form APIFY uses (2025-02-03T13:45:03.000Z)"""
+    if published_at.endswith('Z') and '.' not in published_at:
+        return published_at[:-1] + '.000Z'
+    return published_at
+
+
+def write_setlist(path: str, scraped: Iterable[Dict]) -> int:
     """
-    Scrapes the playlist and updates the local JSON file
-    Returns the list of tracks
+    Merge scraped items into the setlist at path and atomically replace it.
+
+    Existing items are streamed through unchanged (all APIFY fields kept)
+    unless a scraped item with the same id replaces them; new items are
+    appended. Returns the number of items written.
+
+    An existing setlist that cannot be parsed raises ValueError and is left
+    as it is: merging only the items read before the error would silently
+    drop the rest of the catalog.
+    """
+    pending = {item['id']: item for item in scraped}
+    written = 0
+
+    def write(f):
+        nonlocal written
+        f.write('[')
+        existing = SetlistReader(path, project=None) if os.path.exists(path) else ()
+        try:
+            for item in existing:
+                replacement = pending.pop(item.get('id'), None)
+                f.write(',\n' if written else '\n')
+                json.dump(replacement or item, f, ensure_ascii=False)
+                written += 1
+        except ValueError as e:
+            raise ValueError(f"Existing setlist {path} is unreadable, not overwriting it: {str(e)}") from e
+        for item in pending.values():
+            f.write(',\n' if written else '\n')
+            json.dump(item, f, ensure_ascii=False)
+            written += 1
+        f.write('\n]\n')
+
+    _write_atomic(path, write)
+    return written
+
+
+def _write_atomic(path: str, write):
+    """Write through a temp file in the same directory and rename it over path (left as is if write fails)"""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    os.replace(temp_path, path)
+
+
+def load_playlists(path: str = PLAYLISTS_FILE) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+async def refresh_playlist(playlists: Optional[List[Dict]] = None, **scraper_options) -> List[Dict]:
+    """
+    Scrapes the playlists in data/ai_music_playlists.json and merges their
+    videos into AI_Setlist.json (the file watcher then reloads the catalog)
+    Returns the list of scraped tracks in APIFY format
     """
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
-    
-    # TODO: Implement actual playlist scraping logic
-    # This is a placeholder that returns sample data
-    tracks = [
-        {
-            "id": "1",
-            "title": "Sample Track 1",
-            "artist": "Artist 1",
-            "duration": "3:45",
-            "added_at": datetime.now().isoformat()
-        },
-        {
-            "id": "2",
-            "title": "Sample Track 2",
-            "artist": "Artist 2",
-            "duration": "4:20",
-            "added_at": datetime.now().isoformat()
-        }
-    ]
-    
-    # Save to JSON file
-    with open(DATA_FILE, 'w') as f:
-        json.dump(tracks, f, indent=2)
-    
-    return tracks
+
+    if playlists is None:
+        playlists = load_playlists()
+    scraper = PlaylistScraper(**scraper_options)
+
+    stats = await scraper.run(playlists)
+    print(f"Scraped {stats['scraped']} tracks from {len(playlists)} playlists in {stats['seconds']}s "
+          f"({stats['items_per_second']} items/s, {stats['requests']} requests, {stats['retries']} retries)")
+    return scraper.scraped
 
 async def download_track(track_id: str) -> str:
     """
     Downloads a track and saves it to the audio directory
     Returns the path to the downloaded file
     """
-    # TODO: Implement actual download logic
-    raise NotImplementedError("Track download not implemented yet") 
\ No newline at end of file
+    path = audio_downloader.get_track_path(track_id)
+    if path:
+        return path
+    if not AUDIO_SOURCE_URL:
+        raise RuntimeError("No audio source configured; set QUANTUM_RADIO_AUDIO_SOURCE_URL")
+
+    path = await audio_downloader.download_track(AUDIO_SOURCE_URL.format(video_id=track_id), f"{track_id}.mp3")
+    if not path:
+        raise RuntimeError(f"Download of track {track_id} failed")
+    return path
@@ -0,0 +1,206 @@
+import math
+import re
+from array import array
+from bisect import bisect_left, insort
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+# Field bits stored per posting; a token found in several fields of the same
+# track keeps all of its bits so ranking can favour the strongest field.
+FIELD_TITLE = 1
+FIELD_CHANNEL = 2
+FIELD_HASHTAGS = 4
+FIELD_DESCRIPTION = 8
+
+FIELD_WEIGHTS = {
+    FIELD_TITLE: 4.0,
+    FIELD_CHANNEL: 2.5,
+    FIELD_HASHTAGS: 2.0,
+    FIELD_DESCRIPTION: 0.5,
+}
+
+# Weight of every possible field combination, indexed by the bit mask
+_MASK_WEIGHTS = tuple(
+    sum(weight for bit, weight in FIELD_WEIGHTS.items() if mask & bit)
+    for mask in range(16)
+)
+
+PREFIX_MATCH_FACTOR = 0.6  # Prefix-only matches rank below whole-word matches
+VIEW_BOOST = 0.25          # Multiplier for log10(view_count) added to the score
+MAX_TOKEN_LENGTH = 40      # Longer "words" are URLs or hashes, not search terms
+MAX_DELETED_FRACTION = 0.25  # Rebuild instead of patching once this many documents are tombstoned
+NARROWING_RATIO = 16       # Only check postings against a candidate set this much smaller
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens"""
+    if not text:
+        return []
+    return [
+        token for token in _TOKEN_RE.findall(text.casefold())
+        if len(token) <= MAX_TOKEN_LENGTH
+    ]
+
+
+class SearchIndex:
+    """
+    Inverted index over title, channel, hashtags and description.
+
+    Postings are stored compactly as an array of document ordinals plus one
+    byte of field bits per entry. Queries are AND-ed across terms and every
+    term also matches tokens it is a prefix of, so type-ahead input such as
+    "lof" already finds "lofi" tracks.
+
+    An index is never modified once built; updated() returns a new index
+    that shares every posting list the change did not touch. Documents that
+    leave the index are tombstoned until enough accumulate to rebuild.
+    """
+
+    def __init__(self, tracks: Iterable[Dict] = ()):
+        self._doc_ids: List[str] = []
+        self._doc_boost = array('d')
+        self._ordinals: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+        self._postings: Dict[str, Tuple[array, bytes]] = {}
+        self._vocabulary: List[str] = []
+
+        builder: Dict[str, Tuple[array, bytearray]] = {}
+        for track in tracks:
+            self._add_document(track, builder)
+
+        self._postings = {token: (ordinals, bytes(masks)) for token, (ordinals, masks) in builder.items()}
+        self._vocabulary = sorted(self._postings)
+
+    def _add_document(self, track: Dict, builder: Dict[str, Tuple[array, bytearray]]):
+        """Assign the next ordinal to a track and append its postings to builder"""
+        ordinal = len(self._doc_ids)
+        self._doc_ids.append(track['video_id'])
+        self._doc_boost.append(VIEW_BOOST * math.log10(1 + max(track['view_count'] or 0, 0)))
+        self._ordinals[track['video_id']] = ordinal
+
+        for token, mask in self._document_tokens(track).items():
+            entry = builder.get(token)
+            if entry is None:
+                entry = builder[token] = (array('I'), bytearray())
+            entry[0].append(ordinal)
+            entry[1].append(mask)
+
+    def updated(self, removed: Iterable[Dict], added: Iterable[Dict], all_tracks: Iterable[Dict]) -> 'SearchIndex':
+        """
+        Return a new index with the removed tracks dropped and the added tracks
+        indexed. all_tracks is only used if the index has to be rebuilt.
+        """
+        clone = SearchIndex()
+        clone._ordinals = dict(self._ordinals)
+        clone._deleted = set(self._deleted)
+        for track in removed:
+            ordinal = clone._ordinals.pop(track['video_id'], None)
+            if ordinal is not None:
+                clone._deleted.add(ordinal)
+
+        if len(clone._deleted) > MAX_DELETED_FRACTION * len(self._doc_ids):
+            return SearchIndex(all_tracks)
+
+        clone._doc_ids = list(self._doc_ids)
+        clone._doc_boost = array('d', self._doc_boost)
+        builder: Dict[str, Tuple[array, bytearray]] = {}
+        for track in added:
+            clone._add_document(track, builder)
+
+        clone._postings = dict(self._postings)
+        clone._vocabulary = list(self._vocabulary)
+        for token, (ordinals, masks) in builder.items():
+            existing = self._postings.get(token)
+            if existing is None:
+                clone._postings[token] = (ordinals, bytes(masks))
+                insort(clone._vocabulary, token)
+            else:
+                # Copy-on-write: the previous index keeps its own posting list
+                clone._postings[token] = (existing[0] + ordinals, existing[1] + bytes(masks))
+        return clone
+
+    @staticmethod
+    def _document_tokens(track: Dict) -> Dict[str, int]:
+        """Map every token of a track to the bit mask of fields it occurs in"""
+        tokens: Dict[str, int] = {}
+        fields = (
+            (FIELD_TITLE, track['title']),
+            (FIELD_CHANNEL, track['channel_title']),
+            (FIELD_HASHTAGS, " ".join(track['hashtags'] or [])),
+            (FIELD_DESCRIPTION, track['description']),
+        )
+        for bit, text in fields:
+            for token in tokenize(text):
+                tokens[token] = tokens.get(token, 0) | bit
+        return tokens
+
+    def __len__(self) -> int:
+        return len(self._doc_ids) - len(self._deleted)
+
+    def _expand(self, term: str) -> List[str]:
+        """All indexed tokens that start with the given term"""
+        vocabulary = self._vocabulary
+        start = bisect_left(vocabulary, term)
+        end = bisect_left(vocabulary, term + '\U0010ffff', start)
+        return vocabulary[start:end]
+
+    def _term_scores(self, term: str, candidates: Collection[int] = None) -> Dict[int, float]:
+        """
+        Score every document matching a term, optionally restricted to the
+        documents already in candidates (used to AND terms together)
+        """
+        scores: Dict[int, float] = {}
+        deleted = self._deleted
+        for token in self._expand(term):
+            ordinals, masks = self._postings[token]
+            factor = 1.0 if token == term else PREFIX_MATCH_FACTOR
+            for ordinal, mask in zip(ordinals, masks):
+                if candidates is not None and ordinal not in candidates:
+                    continue
+                if deleted and ordinal in deleted:
+                    continue
+                weight = _MASK_WEIGHTS[mask] * factor
+                if weight > scores.get(ordinal, 0.0):
+                    scores[ordinal] = weight
+        return scores
+
+    def _estimate(self, term: str) -> int:
+        """Cheap upper bound on the number of postings a term touches"""
+        return sum(len(self._postings[token][0]) for token in self._expand(term))
+
+    def search(self, query: str) -> List[str]:
+        """Return video IDs matching every query term, best match first"""
+        return self.video_ids(self.rank(query))
+
+    def rank(self, query: str, within: Optional[Collection[int]] = None) -> List[int]:
+        """
+        Ordinals of the documents matching every query term, best match
+        first. within, if given, must hold every document that can match
+        (e.g. the matches of a query this one extends); only those are
+        scored, and the ranking is the same as without it.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        # Start from the most selective term so later terms only probe
+        # documents that can still match.
+        terms.sort(key=self._estimate)
+        if within is not None:
+            # Checking every posting against a large within costs more than it saves
+            within = set(within) if len(within) * NARROWING_RATIO <= self._estimate(terms[0]) else None
+        scores = self._term_scores(terms[0], within)
+        for term in terms[1:]:
+            if not scores:
+                break
+            term_scores = self._term_scores(term, scores)
+            scores = {ordinal: score + term_scores[ordinal] for ordinal, score in scores.items()
+                      if ordinal in term_scores}
+
+        boost = self._doc_boost
+        return sorted(scores, key=lambda ordinal: scores[ordinal] + boost[ordinal], reverse=True)
+
+    def video_ids(self, ordinals: Iterable[int]) -> List[str]:
+        doc_ids = self._doc_ids
+        return [doc_ids[ordinal] for ordinal in ordinals]
@@ -0,0 +1,128 @@
+import codecs
+import hashlib
+import json
+import sys
+from typing import Callable, Dict, Iterator, Optional
+
+# The only APIFY fields the API ever serves; everything else (descriptionLinks,
+# location, formats, subtitles, ...) is dropped as soon as an item is parsed
+TRACK_FIELDS = (
+    'id', 'url', 'title', 'type', 'thumbnailUrl', 'text', 'viewCount', 'likes', 'commentsCount',
+    'duration', 'date', 'channelName', 'channelUrl', 'channelId', 'numberOfSubscribers',
+    'hashtags', 'input',
+)
+
+# Fields whose values repeat across many items and are worth sharing
+INTERNED_FIELDS = ('type', 'channelName', 'channelUrl', 'channelId', 'input')
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+def project_item(item: Dict) -> Dict:
+    """Keep only the fields the API uses, interning repeated strings"""
+    projected = {}
+    for field in TRACK_FIELDS:
+        if field in item:
+            value = item[field]
+            if field in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            elif field == 'hashtags' and isinstance(value, list):
+                value = [sys.intern(tag) if isinstance(tag, str) else tag for tag in value]
+            projected[field] = value
+    return projected
+
+
+class SetlistReader:
+    """
+    Incrementally parse a JSON array of APIFY items.
+
+    The file is read in fixed-size chunks and decoded one array element at a
+    time, so neither the whole file text nor the whole raw object graph is
+    ever held in memory. Each element is passed through `project` (by default
+    project_item; None yields items whole) before it is yielded. After
+    iteration, sha256 holds the digest of the file bytes.
+    """
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE,
+                 project: Optional[Callable[[Dict], Dict]] = project_item):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.project = project
+        self.sha256: Optional[str] = None
+        self.item_count = 0
+        self.size = 0
+
+    def __iter__(self) -> Iterator[Dict]:
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        digest = hashlib.sha256()
+        buffer = ''
+        position = 0
+        eof = False
+        started = False
+        expect_separator = False  # True right after an element was decoded
+
+        with open(self.path, 'rb') as f:
+            def fill() -> bool:
+                nonlocal buffer, position, eof
+                if eof:
+                    return False
+                chunk = f.read(self.chunk_size)
+                digest.update(chunk)
+                self.size += len(chunk)
+                if not chunk:
+                    eof = True
+                    buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+                else:
+                    buffer = buffer[position:] + text_decoder.decode(chunk)
+                position = 0
+                return True
+
+            while True:
+                # Skip whitespace, reading more of the file as needed
+                while True:
+                    while position < len(buffer) and buffer[position] in _WHITESPACE:
+                        position += 1
+                    if position < len(buffer) or not fill():
+                        break
+                if position >= len(buffer):
+                    raise json.JSONDecodeError("Unexpected end of setlist", buffer, position)
+
+                char = buffer[position]
+                if not started:
+                    if char != '[':
+                        raise json.JSONDecodeError("Setlist must be a JSON array", buffer, position)
+                    started = True
+                    position += 1
+                    continue
+                if expect_separator:
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise json.JSONDecodeError("Expected ',' or ']' between setlist items", buffer, position)
+                    expect_separator = False
+                    position += 1
+                    continue
+                if char == ']' and not self.item_count:
+                    break
+
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Most likely the element continues in the next chunk
+                    if not fill():
+                        raise
+                    continue
+                position = end
+                expect_separator = True
+                self.item_count += 1
+                if isinstance(item, dict):
+                    yield self.project(item) if self.project else item
+
+            # Consume the rest so the digest covers the whole file
+            while fill():
+                pass
+
+        self.sha256 = digest.hexdigest()
@@ -0,0 +1,266 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: every process runs standalone
+    fcntl = None
+
+from services.catalog import CatalogSnapshot
+from services.catalog_store import CatalogFormatError, MappedCatalogSnapshot, copy_catalog, open_catalog, write_catalog
+
+# "1" always shares the catalog between processes, "0" never does, and "auto"
+# shares it when the server is started with several workers
+SHARED_CATALOG = os.getenv("QUANTUM_RADIO_SHARED_CATALOG", "auto")
+
+# Where catalog files and the control block live; tmpfs keeps them in RAM
+SHARED_DIR = os.getenv("QUANTUM_RADIO_SHARED_DIR")
+
+# How often the coordinator checks for reloads requested by other workers
+REQUEST_POLL_INTERVAL = 0.1
+
+# How long a worker waits for the coordinator to run a reload it asked for
+RELOAD_TIMEOUT = 60.0
+
+# Catalog files kept on disk besides the published one, for workers that
+# still need to resolve cursors into older versions
+RETAINED_FILES = 4
+
+# generation (published catalog version), reload_requested, reload_handled,
+# reload_failed (last rejected request), coordinator pid
+_CONTROL = struct.Struct("<QQQQQ")
+_GENERATION, _REQUESTED, _HANDLED, _FAILED, _PID = range(5)
+
+
+def worker_count() -> int:
+    """Worker processes the server was started with (uvicorn reads WEB_CONCURRENCY too)"""
+    value = os.getenv("QUANTUM_RADIO_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"
+    try:
+        return max(1, int(value))
+    except ValueError:
+        return 1
+
+
+def sharing_enabled() -> bool:
+    if fcntl is None or SHARED_CATALOG == "0":
+        return False
+    return SHARED_CATALOG == "1" or worker_count() > 1
+
+
+def default_directory(data_file: str) -> str:
+    """A directory per data file, on tmpfs when available"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    key = hashlib.sha1(os.path.realpath(data_file).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(base, f"quantum-radio-{key}")
+
+
+class SharedCatalog:
+    """
+    Shares one catalog between the worker processes of a server.
+
+    Workers elect a coordinator with an exclusive lock on a file. The
+    coordinator is the only process that watches and parses AI_Setlist.json;
+    it writes every new snapshot to a catalog file and then bumps a version
+    counter in a small mapped control block. The other workers (followers)
+    read the counter on access, which costs a few bytes of shared memory, and
+    map the published catalog read-only when it changes, so its pages exist
+    once however many workers serve it.
+
+    Followers ask for reloads by bumping a request counter that the
+    coordinator polls. When the coordinator exits the kernel drops its lock
+    and a waiting follower takes over (on_promoted is called).
+    """
+
+    def __init__(self, directory: str, on_promoted: Callable[[], None], on_reload_request: Callable[[], bool]):
+        self.directory = directory
+        self._on_promoted = on_promoted
+        self._on_reload_request = on_reload_request
+        os.makedirs(directory, exist_ok=True)
+
+        control_path = os.path.join(directory, "control")
+        fd = os.open(control_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _CONTROL.size:
+                os.ftruncate(fd, _CONTROL.size)
+            self._control = mmap.mmap(fd, _CONTROL.size)
+        finally:
+            os.close(fd)
+        # Serializes read-modify-write updates of the control block across
+        # processes (flock) and across threads of this process
+        self._control_lock = FileLock(open(os.path.join(directory, "control.lock"), "a+b"))
+        self._coordinator_lock = open(os.path.join(directory, "coordinator.lock"), "a+b")
+
+        self.is_coordinator = False
+        self.promotions = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        """Try to become the coordinator; followers wait for the role in the background"""
+        if self._try_lock(blocking=False):
+            self._become_coordinator()
+        else:
+            self._thread = threading.Thread(target=self._wait_for_promotion, name="catalog-follower", daemon=True)
+            self._thread.start()
+        return self.is_coordinator
+
+    def stop(self):
+        self._stopped.set()
+
+    def _try_lock(self, blocking: bool) -> bool:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._coordinator_lock.fileno(), flags)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _become_coordinator(self):
+        self.is_coordinator = True
+        self._write_fields({_PID: os.getpid()})
+        self._thread = threading.Thread(target=self._serve_requests, name="catalog-coordinator", daemon=True)
+        self._thread.start()
+
+    def _wait_for_promotion(self):
+        self._try_lock(blocking=True)
+        if self._stopped.is_set():
+            return
+        print(f"Worker {os.getpid()} is taking over as catalog coordinator")
+        self.promotions += 1
+        self._become_coordinator()
+        self._on_promoted()
+
+    def _serve_requests(self):
+        while not self._stopped.wait(REQUEST_POLL_INTERVAL):
+            fields = self._read_fields()
+            requested = fields[_REQUESTED]
+            if requested <= fields[_HANDLED]:
+                continue
+            try:
+                succeeded = self._on_reload_request()
+            except Exception as e:
+                print(f"Requested reload failed: {e}")
+                succeeded = False
+            updates = {_HANDLED: requested}
+            if not succeeded:
+                updates[_FAILED] = requested
+            self._write_fields(updates)
+
+    def _read_fields(self) -> Tuple[int, ...]:
+        return _CONTROL.unpack_from(self._control, 0)
+
+    def _write_fields(self, updates: Dict[int, int]) -> Tuple[int, ...]:
+        with self._control_lock:
+            fields = list(self._read_fields())
+            for field, value in updates.items():
+                fields[field] = value
+            _CONTROL.pack_into(self._control, 0, *fields)
+            return tuple(fields)
+
+    def published_version(self) -> int:
+        """The version counter; an aligned 8-byte read, cheap enough for every request"""
+        return _CONTROL.unpack_from(self._control, 0)[_GENERATION]
+
+    def catalog_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"catalog-{version}.bin")
+
+    def publish(self, snapshot: CatalogSnapshot, metadata: Optional[Dict] = None) -> int:
+        """Write a snapshot for the followers and bump the version counter; returns the file size"""
+        if isinstance(snapshot, MappedCatalogSnapshot):
+            size = copy_catalog(snapshot.catalog.path, self.catalog_path(snapshot.version))
+        else:
+            size = write_catalog(snapshot, self.catalog_path(snapshot.version), metadata)
+        self._write_fields({_GENERATION: snapshot.version})
+        self._remove_old_files(snapshot.version)
+        return size
+
+    def _remove_old_files(self, current: int):
+        for name in os.listdir(self.directory):
+            if not (name.startswith("catalog-") and name.endswith(".bin")):
+                continue
+            try:
+                version = int(name[len("catalog-"):-len(".bin")])
+            except ValueError:
+                continue
+            if version <= current - RETAINED_FILES or version > current:
+                # Mapped files stay readable for processes that still use them
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def open_version(self, version: int) -> Optional[MappedCatalogSnapshot]:
+        """Map a published catalog, or None if its file is gone or unusable"""
+        try:
+            return open_catalog(self.catalog_path(version))
+        except (FileNotFoundError, CatalogFormatError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring shared catalog version {version}: {e}")
+            return None
+
+    def request_reload(self, timeout: float = RELOAD_TIMEOUT) -> Optional[bool]:
+        """
+        Ask the coordinator for a forced reload and wait for it. Returns
+        whether it succeeded, or None on timeout.
+        """
+        with self._control_lock:
+            fields = list(self._read_fields())
+            fields[_REQUESTED] += 1
+            ticket = fields[_REQUESTED]
+            _CONTROL.pack_into(self._control, 0, *fields)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            fields = self._read_fields()
+            if fields[_HANDLED] >= ticket:
+                # Requests that arrive while a reload runs share its outcome
+                return fields[_FAILED] < ticket
+            time.sleep(REQUEST_POLL_INTERVAL / 2)
+        return None
+
+    def status(self) -> Dict:
+        fields = self._read_fields()
+        return {
+            "role": "coordinator" if self.is_coordinator else "follower",
+            "pid": os.getpid(),
+            "coordinator_pid": fields[_PID] or None,
+            "published_version": fields[_GENERATION],
+            "reloads_requested": fields[_REQUESTED],
+            "reloads_handled": fields[_HANDLED],
+            "promotions": self.promotions,
+            "directory": self.directory,
+        }
+
+
+class FileLock:
+    """
+    An exclusive lock held by one thread of one process at a time. Without
+    flock (not on POSIX) it only excludes the threads of this process.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
@@ -0,0 +1,371 @@
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+# NumPy is optional; without it scores are accumulated in pure Python, which
+# gives the same results but is much slower on large catalogs
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from services.aggregates import parse_duration
+from services.search_index import tokenize
+
+# Weight of each feature block in the cosine: the TF-IDF text vector (title,
+# hashtags and the search query a track was scraped for), channel identity,
+# and each of the log-scaled, standardized view count and duration
+TEXT_WEIGHT = 1.0
+CHANNEL_WEIGHT = 0.5
+NUMERIC_WEIGHT = 0.25
+
+# Neighbors computed (and cached) per track; also the largest accepted limit
+MAX_SIMILAR = 50
+
+# Tracks whose neighbor lists are cached, least recently used first out
+NEIGHBOR_CACHE_SIZE = 20000
+
+# A reload that changes more tracks than this drops every cached list
+# instead of checking which ones the changed tracks could enter
+MAX_CARRIED_CHANGES = 1000
+
+# Fields the index reads from each track
+SIMILARITY_FIELDS = ('video_id', 'title', 'hashtags', 'search_query', 'channel_id', 'view_count', 'duration')
+
+
+def _term_counts(track: Mapping) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    tokens = tokenize(track['title'] or '') + tokenize(track['search_query'] or '')
+    for hashtag in track['hashtags'] or ():
+        tokens.extend(tokenize(str(hashtag)))
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def _numeric_features(track: Mapping) -> Tuple[float, float]:
+    return math.log1p(max(track['view_count'] or 0, 0)), math.log1p(parse_duration(track['duration']))
+
+
+def _deviation(values: Sequence[float], mean: float) -> float:
+    return math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)) if values else 0.0
+
+
+class _Features:
+    """One track's vector: text terms with normalized weights, channel, numeric z-scores, overall norm"""
+
+    __slots__ = ('terms', 'weights', 'channel', 'numeric', 'norm')
+
+    def __init__(self, terms: List[int], weights: List[float], channel: int, numeric: Tuple[float, float],
+                 norm: float):
+        self.terms = terms
+        self.weights = weights
+        self.channel = channel
+        self.numeric = numeric
+        self.norm = norm
+
+
+class SimilarityIndex:
+    """
+    Cosine similarity between tracks over TF-IDF text, channel and numeric features.
+
+    Text vectors are stored as posting lists per term, so scoring a track
+    only touches tracks that share one of its terms; the channel and numeric
+    parts are dense and scored for every track. With NumPy each part is one
+    vectorized operation and top-k is an argpartition. Neighbor lists are
+    cached per track, and a rebuilt index keeps the lists a reload cannot
+    have changed (see carry_over()).
+    """
+
+    def __init__(self, version: int, tracks: Sequence[Mapping]):
+        self.version = version
+        self.video_ids: List[str] = [track['video_id'] for track in tracks]
+        self.ordinals = {video_id: ordinal for ordinal, video_id in enumerate(self.video_ids)}
+        n = len(self.video_ids)
+        self._neighbors: Dict[str, Tuple[Tuple[str, ...], array]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # (term, count) entries of every track, flat: track i's are at
+        # doc_start[i]:doc_start[i + 1]
+        self.vocabulary: Dict[str, int] = {}
+        doc_frequency: List[int] = []
+        doc_start, doc_terms, doc_counts = [0], [], []
+        for track in tracks:
+            for term, count in _term_counts(track).items():
+                column = self.vocabulary.get(term)
+                if column is None:
+                    column = self.vocabulary[term] = len(doc_frequency)
+                    doc_frequency.append(0)
+                doc_frequency[column] += 1
+                doc_terms.append(column)
+                doc_counts.append(count)
+            doc_start.append(len(doc_terms))
+        self.idf = [math.log((1 + n) / (1 + df)) + 1.0 for df in doc_frequency]
+
+        self.channels: Dict[str, int] = {}
+        channel_of = [self.channels.setdefault(track['channel_id'], len(self.channels))
+                      if track['channel_id'] else -1 for track in tracks]
+
+        raw = [_numeric_features(track) for track in tracks]
+        columns = list(zip(*raw)) or [(), ()]
+        self.numeric_mean = tuple(sum(values) / len(values) if values else 0.0 for values in columns)
+        self.numeric_scale = tuple(_deviation(values, mean) or 1.0 for values, mean in zip(columns, self.numeric_mean))
+
+        if NUMPY_AVAILABLE:
+            self._doc_start = np.array(doc_start, dtype=np.int64)
+            self._doc_terms = np.array(doc_terms, dtype=np.int32)
+            docs = np.repeat(np.arange(n, dtype=np.int32), np.diff(self._doc_start))
+            weights = (1.0 + np.log(np.array(doc_counts, dtype=np.float64))) * np.array(self.idf)[self._doc_terms]
+            text_norms = np.sqrt(np.bincount(docs, weights=weights * weights, minlength=n))
+            self._doc_weights = (weights / text_norms[docs]).astype(np.float32)
+            self._channel_of = np.array(channel_of, dtype=np.int32)
+            self._numeric = ((np.array(raw, dtype=np.float64).reshape(n, 2) - self.numeric_mean) /
+                             self.numeric_scale).astype(np.float32)
+            self._norms = np.sqrt(TEXT_WEIGHT ** 2 * (text_norms > 0) + CHANNEL_WEIGHT ** 2 * (self._channel_of >= 0) +
+                                  NUMERIC_WEIGHT ** 2 * (self._numeric.astype(np.float64) ** 2).sum(axis=1))
+
+            # Posting lists are runs of the entries sorted by term: term t's
+            # are at post_start[t]:post_start[t + 1]
+            order = np.argsort(self._doc_terms, kind='stable')
+            self._post_docs = docs[order]
+            self._post_weights = self._doc_weights[order]
+            self._post_start = np.concatenate(([0], np.cumsum(np.bincount(self._doc_terms, minlength=len(doc_frequency)))))
+        else:
+            self._doc_start = array('l', doc_start)
+            self._doc_terms = array('i', doc_terms)
+            self._doc_weights = array('f')
+            self._channel_of = channel_of
+            self._numeric, self._norms = [], []
+            self._postings: Dict[int, Tuple[array, array]] = {}
+            for ordinal in range(n):
+                start, stop = doc_start[ordinal], doc_start[ordinal + 1]
+                features = self._vectorize(dict(zip(doc_terms[start:stop], doc_counts[start:stop])),
+                                           channel_of[ordinal], raw[ordinal], known=True)
+                self._doc_weights.extend(features.weights)
+                self._numeric.append(features.numeric)
+                self._norms.append(features.norm)
+                for term, weight in zip(features.terms, features.weights):
+                    entry = self._postings.get(term)
+                    if entry is None:
+                        entry = self._postings[term] = (array('i'), array('f'))
+                    entry[0].append(ordinal)
+                    entry[1].append(weight)
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    def _vectorize(self, counts: Dict, channel: int, raw: Tuple[float, float], known: bool = False) -> _Features:
+        """A track's vector from its term counts, keyed by term or, when known, by column"""
+        terms, weights = [], []
+        text_norm = 0.0
+        for term, count in counts.items():
+            column = term if known else self.vocabulary.get(term)
+            # Terms the index has never seen still count towards the length
+            weight = (1.0 + math.log(count)) * (self.idf[column] if column is not None else
+                                                 math.log(1 + len(self.video_ids)) + 1.0)
+            text_norm += weight * weight
+            if column is not None:
+                terms.append(column)
+                weights.append(weight)
+        text_norm = math.sqrt(text_norm)
+        if text_norm:
+            weights = [weight / text_norm for weight in weights]
+        numeric = tuple((value - mean) / scale
+                        for value, mean, scale in zip(raw, self.numeric_mean, self.numeric_scale))
+        norm = math.sqrt((TEXT_WEIGHT ** 2 if text_norm else 0.0) + (CHANNEL_WEIGHT ** 2 if channel >= 0 else 0.0) +
+                         NUMERIC_WEIGHT ** 2 * sum(value * value for value in numeric))
+        return _Features(terms, weights, channel, numeric, norm)
+
+    def features_of(self, track: Mapping) -> _Features:
+        """The vector of an indexed track, or one computed with this index's statistics"""
+        ordinal = self.ordinals.get(track['video_id'])
+        if ordinal is not None:
+            start, stop = self._doc_start[ordinal], self._doc_start[ordinal + 1]
+            return _Features(self._doc_terms[start:stop], self._doc_weights[start:stop],
+                             int(self._channel_of[ordinal]), tuple(self._numeric[ordinal]), float(self._norms[ordinal]))
+        channel = self.channels.get(track['channel_id'], -1) if track['channel_id'] else -1
+        return self._vectorize(_term_counts(track), channel, _numeric_features(track))
+
+    def similar(self, track: Mapping, limit: int = MAX_SIMILAR) -> List[Tuple[str, float]]:
+        """(video_id, cosine) of the tracks most similar to track, best first"""
+        video_id = track['video_id']
+        with self._lock:
+            cached = self._neighbors.get(video_id)
+            if cached is not None:
+                self._neighbors.move_to_end(video_id)
+        if cached is None:
+            ids, scores = self._top(self.features_of(track), self.ordinals.get(video_id), MAX_SIMILAR)
+            cached = (tuple(ids), array('f', scores))
+            if video_id in self.ordinals:
+                with self._lock:
+                    self._neighbors[video_id] = cached
+                    while len(self._neighbors) > NEIGHBOR_CACHE_SIZE:
+                        self._neighbors.popitem(last=False)
+        ids, scores = cached
+        return [(ids[i], round(scores[i], 4)) for i in range(min(limit, len(ids)))]
+
+    def scores(self, features: _Features):
+        """Cosine of a vector against every indexed track (an ndarray, or a list without NumPy)"""
+        if NUMPY_AVAILABLE:
+            return self._scores_numpy(features)
+        return self._scores_python(features)
+
+    def _scores_numpy(self, features: _Features):
+        n = len(self.video_ids)
+        docs, weights = [], []
+        for term, weight in zip(features.terms, features.weights):
+            start, stop = self._post_start[term], self._post_start[term + 1]
+            docs.append(self._post_docs[start:stop])
+            weights.append(self._post_weights[start:stop] * weight)
+        if docs:
+            dot = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=n)
+            dot *= TEXT_WEIGHT ** 2
+        else:
+            dot = np.zeros(n)
+        if features.channel >= 0:
+            dot += (self._channel_of == features.channel) * CHANNEL_WEIGHT ** 2
+        dot += self._numeric @ np.asarray(features.numeric, dtype=np.float32) * NUMERIC_WEIGHT ** 2
+        denominator = self._norms * features.norm
+        return np.divide(dot, denominator, out=np.zeros(n), where=denominator > 0)
+
+    def _scores_python(self, features: _Features) -> List[float]:
+        z_views, z_duration = features.numeric
+        numeric_weight = NUMERIC_WEIGHT ** 2
+        dot = [numeric_weight * (views * z_views + duration * z_duration) for views, duration in self._numeric]
+        text_weight = TEXT_WEIGHT ** 2
+        for term, weight in zip(features.terms, features.weights):
+            posting = self._postings.get(term)
+            if posting is not None:
+                for ordinal, other in zip(*posting):
+                    dot[ordinal] += text_weight * weight * other
+        if features.channel >= 0:
+            channel_weight = CHANNEL_WEIGHT ** 2
+            for ordinal, channel in enumerate(self._channel_of):
+                if channel == features.channel:
+                    dot[ordinal] += channel_weight
+        return [value / (norm * features.norm) if norm and features.norm else 0.0
+                for value, norm in zip(dot, self._norms)]
+
+    def _top(self, features: _Features, exclude: Optional[int], k: int) -> Tuple[List[str], List[float]]:
+        """
+        The k best (video_id, score) pairs with a positive score; ties go to
+        the track earlier in the catalog
+        """
+        scores = self.scores(features)
+        if NUMPY_AVAILABLE:
+            if exclude is not None:
+                scores[exclude] = -np.inf
+            k = min(k, len(scores) - (exclude is not None))
+            if k <= 0:
+                return [], []
+            candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            # Partition boundaries may split ties; include every track tied with the k-th
+            candidates = np.flatnonzero(scores >= scores[candidates].min())
+            order = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+            order = order[scores[order] > 0]
+            return [self.video_ids[i] for i in order], scores[order].tolist()
+        ranked = sorted((ordinal for ordinal in range(len(scores)) if ordinal != exclude and scores[ordinal] > 0),
+                        key=lambda ordinal: (-scores[ordinal], ordinal))[:k]
+        return [self.video_ids[i] for i in ranked], [scores[i] for i in ranked]
+
+    def carry_over(self, previous: 'SimilarityIndex', changed_ids: Sequence[str], incoming: Sequence[Mapping]) -> int:
+        """
+        Reuse previous neighbor lists that the changes cannot affect: lists of
+        unchanged tracks that contain no changed track and that none of the
+        incoming (added or updated) tracks would now enter. Returns how many
+        lists were kept.
+        """
+        changed = set(changed_ids)
+        with previous._lock:
+            candidates = [(video_id, entry) for video_id, entry in previous._neighbors.items()
+                          if video_id not in changed and video_id in self.ordinals
+                          and not changed.intersection(entry[0])]
+        if not candidates:
+            return 0
+
+        # Lowest cached score per candidate; an incoming track scoring above it
+        # would enter the list (short lists hold every track with a positive score)
+        thresholds = {self.ordinals[video_id]: (min(scores) if len(scores) >= MAX_SIMILAR else 0.0)
+                      for video_id, (_, scores) in candidates}
+        rejected = set()
+        if NUMPY_AVAILABLE:
+            ordinals = np.fromiter(thresholds, dtype=np.int64, count=len(thresholds))
+            limits = np.fromiter(thresholds.values(), dtype=np.float64, count=len(thresholds))
+            for track in incoming:
+                entered = self.scores(self.features_of(track))[ordinals] > limits
+                rejected.update(ordinals[entered].tolist())
+        else:
+            for track in incoming:
+                scores = self.scores(self.features_of(track))
+                rejected.update(ordinal for ordinal, limit in thresholds.items() if scores[ordinal] > limit)
+
+        kept = 0
+        with self._lock:
+            for video_id, entry in candidates:
+                if self.ordinals[video_id] not in rejected:
+                    self._neighbors[video_id] = entry
+                    kept += 1
+        return kept
+
+
+class SimilarTracks:
+    """
+    Keeps a SimilarityIndex in step with the catalog.
+
+    The first request builds the index. When the catalog version moves on,
+    the next index is built on a background thread from the tracks that
+    changed, while requests keep using the previous one; its results are
+    resolved against the current catalog by the caller.
+    """
+
+    def __init__(self):
+        self._index: Optional[SimilarityIndex] = None
+        self._building: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def index(self, version: int, load_tracks: Callable[[], Tuple[int, Sequence[Mapping]]],
+              load_changes: Callable[[int, int], Dict]) -> SimilarityIndex:
+        index = self._index
+        if index is not None and index.version == version:
+            return index
+        with self._lock:
+            if self._index is None or self._index.version == version:
+                if self._index is None:
+                    self._index = self._build(load_tracks, None, load_changes)
+                return self._index
+            if self._building is None:
+                self._building = version
+                threading.Thread(target=self._rebuild, args=(load_tracks, load_changes),
+                                 name="similarity-index", daemon=True).start()
+            return self._index
+
+    def _rebuild(self, load_tracks, load_changes):
+        try:
+            index = self._build(load_tracks, self._index, load_changes)
+            self._index = index
+        except Exception as e:
+            print(f"Error rebuilding the similarity index: {e}")
+        finally:
+            self._building = None
+
+    @staticmethod
+    def _build(load_tracks, previous: Optional[SimilarityIndex], load_changes) -> SimilarityIndex:
+        started = time.perf_counter()
+        version, tracks = load_tracks()
+        index = SimilarityIndex(version, tracks)
+        kept = 0
+        if previous is not None:
+            changes = load_changes(previous.version, version)
+            changed = changes['added'] + changes['removed'] + changes['updated']
+            if not changes['reset'] and len(changed) <= MAX_CARRIED_CHANGES:
+                incoming = set(changes['added'] + changes['updated'])
+                kept = index.carry_over(previous, changed, [track for track in tracks
+                                                            if track['video_id'] in incoming])
+        print(f"Built similarity index for version {version} ({len(index)} tracks, "
+              f"{kept} neighbor lists kept) in {time.perf_counter() - started:.2f}s")
+        return index
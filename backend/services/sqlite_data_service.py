@@ -0,0 +1,905 @@
+import hashlib
+import json
+import math
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services.aggregates import parse_duration
+from services.apify_data_service import (
+    BLOCKING_WORKERS, WATCHDOG_AVAILABLE, ApifyDataService, CatalogLoadError,
+    ExpiredCursorError, ServiceUnavailableError,
+)
+from services.catalog import SORT_KEYS, normalize_channel_name
+from services.change_log import CHANGE_LOG_SIZE, MAX_CHANGED_IDS, change_entry, merge_changes
+from services.facets import FACET_FIELDS, HASHTAG_FACET_SIZE, MAX_HASHTAG_FACET_SIZE, FacetIndex
+from services.query_cache import query_terms
+from services.radio_queue import MAX_RADIO_BATCH_SIZE, RADIO_BATCH_SIZE, normalize_hashtag
+from services.response_cache import PreparedResponse
+from services.search_index import FIELD_CHANNEL, FIELD_DESCRIPTION, FIELD_HASHTAGS, FIELD_TITLE, FIELD_WEIGHTS, \
+    VIEW_BOOST, tokenize
+from services.setlist_reader import SetlistReader
+from services.similarity import MAX_SIMILAR, SIMILARITY_FIELDS
+from services.track_record import TRACK_FIELDS, project_track
+
+# Database file; defaults to AI_Setlist.sqlite3 next to the setlist
+SQLITE_PATH = os.getenv("QUANTUM_RADIO_SQLITE_PATH")
+
+# Rows handed to executemany() at a time while ingesting
+INGEST_BATCH_SIZE = 5000
+
+# video_ids bound per "video_id IN (...)" lookup; SQLite builds before 3.32
+# allow at most 999 parameters per statement
+ID_LOOKUP_CHUNK_SIZE = 500
+
+# Seconds a query waits for a pooled connection before the service reports
+# itself unavailable (503) instead of queueing without limit
+POOL_TIMEOUT = float(os.getenv("QUANTUM_RADIO_SQLITE_POOL_TIMEOUT", "10"))
+
+# Rows a streamed listing reads per connection checkout
+STREAM_PAGE_SIZE = 500
+
+SCHEMA_VERSION = 1
+
+# Every field but the description is stored as one compact JSON array; the
+# description has its own column because the full-text index reads it
+_META_FIELDS = tuple(field for field in TRACK_FIELDS if field != 'description')
+
+# Columns of the tracks table, in insert order
+_COLUMNS = (
+    'video_id', 'position', 'digest', 'meta', 'description', 'title', 'channel_title', 'hashtags_text',
+    'channel_id', 'channel_key', 'has_hashtags', 'view_count', 'likes', 'comments_count', 'upload_date',
+    'duration_seconds', 'title_key', 'view_boost', 'channel_url', 'subscribers',
+)
+
+# Column each API sort key orders by
+_SORT_COLUMNS = {
+    'views': 'view_count',
+    'likes': 'likes',
+    'comments': 'comments_count',
+    'date': 'upload_date',
+    'duration': 'duration_seconds',
+    'title': 'title_key',
+}
+
+# bm25() weights in tracks_fts column order, the same field weights the
+# in-memory search index uses
+_FTS_WEIGHTS = ", ".join(str(FIELD_WEIGHTS[field])
+                         for field in (FIELD_TITLE, FIELD_CHANNEL, FIELD_HASHTAGS, FIELD_DESCRIPTION))
+
+# bm25() is lower for better matches; subtracting the view boost mirrors the
+# in-memory ranking
+_SEARCH_ORDER = f"bm25(tracks_fts, {_FTS_WEIGHTS}) - tracks.view_boost, tracks.position"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    description TEXT,
+    title TEXT,
+    channel_title TEXT,
+    hashtags_text TEXT,
+    channel_id TEXT,
+    channel_key TEXT,
+    has_hashtags INTEGER NOT NULL,
+    view_count INTEGER NOT NULL,
+    likes INTEGER NOT NULL,
+    comments_count INTEGER NOT NULL,
+    upload_date TEXT NOT NULL,
+    duration_seconds INTEGER NOT NULL,
+    title_key TEXT NOT NULL,
+    view_boost REAL NOT NULL,
+    channel_url TEXT,
+    subscribers INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS tracks_position ON tracks (position);
+CREATE INDEX IF NOT EXISTS tracks_channel_id ON tracks (channel_id, position);
+CREATE INDEX IF NOT EXISTS tracks_channel_key ON tracks (channel_key, position);
+CREATE INDEX IF NOT EXISTS tracks_view_count ON tracks (view_count, position);
+CREATE INDEX IF NOT EXISTS tracks_likes ON tracks (likes, position);
+CREATE INDEX IF NOT EXISTS tracks_comments_count ON tracks (comments_count, position);
+CREATE INDEX IF NOT EXISTS tracks_upload_date ON tracks (upload_date, position);
+CREATE INDEX IF NOT EXISTS tracks_duration ON tracks (duration_seconds, position);
+CREATE INDEX IF NOT EXISTS tracks_title_key ON tracks (title_key, position);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5 (
+    title, channel_title, hashtags_text, description,
+    content='tracks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 0'
+);
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts (rowid, title, channel_title, hashtags_text, description)
+    VALUES (new.rowid, new.title, new.channel_title, new.hashtags_text, new.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, title, channel_title, hashtags_text, description)
+    VALUES ('delete', old.rowid, old.title, old.channel_title, old.hashtags_text, old.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE OF title, channel_title, hashtags_text, description
+ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, title, channel_title, hashtags_text, description)
+    VALUES ('delete', old.rowid, old.title, old.channel_title, old.hashtags_text, old.description);
+    INSERT INTO tracks_fts (rowid, title, channel_title, hashtags_text, description)
+    VALUES (new.rowid, new.title, new.channel_title, new.hashtags_text, new.description);
+END;
+"""
+
+
+class SQLiteConnectionPool:
+    """
+    Read-only connections to a WAL database, handed out one per thread at a
+    time. Once all of them are in use a caller waits at most timeout seconds
+    for one to be returned, then gets ServiceUnavailableError.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute("PRAGMA cache_size = -16000")  # 16MB of page cache per connection
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        A connection inside a read transaction, so every statement sees the
+        same version of the catalog even if an ingest commits meanwhile
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is None:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                conn = self._connect()
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise ServiceUnavailableError(
+                        f"All {self.size} database connections stayed busy for {self.timeout:g}s") from None
+        broken = False
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+        except sqlite3.Error:
+            broken = True
+            raise
+        finally:
+            if broken:
+                conn.close()
+                with self._lock:
+                    self._created -= 1
+            else:
+                self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SQLiteDataService(ApifyDataService):
+    """
+    ApifyDataService on top of a SQLite database instead of in-memory
+    snapshots, for catalogs that do not fit in RAM.
+
+    AI_Setlist.json is streamed into the database (see _load_data), which
+    keeps column indexes for the filters and sort keys and an FTS5 table
+    for search. Queries run on pooled read-only connections; in WAL mode
+    they never wait for an ingest, and each sees one committed version.
+
+    Several worker processes can share one database: ingests take SQLite's
+    write lock and skip files already ingested by another process.
+    """
+
+    # Only the small responses; the full listing is streamed from the
+    # database (query_tracks) rather than held in memory, let alone compressed
+    prepared_responses = ('channels', 'stats')
+
+    def __init__(self):
+        super().__init__()
+        self.db_file = SQLITE_PATH or os.path.splitext(self.data_file)[0] + ".sqlite3"
+        self._writer: Optional[sqlite3.Connection] = None
+        self._readers = SQLiteConnectionPool(self.db_file, BLOCKING_WORKERS + 2)
+        # Responses and aggregates built for the version in _cached_version
+        self._cached_version = None
+        self._cached: Dict[str, object] = {}
+        self._cache_lock = threading.Lock()
+        self._loaded_from = "sqlite"
+
+    def _startup(self):
+        started = time.perf_counter()
+        try:
+            self._open_writer()
+            try:
+                self._load_data()
+            except CatalogLoadError as e:
+                print(f"Keeping {self._catalog_state()[1]} tracks in {self.db_file}: {e}")
+
+            if WATCHDOG_AVAILABLE:
+                self._start_file_watcher()
+            else:
+                print("File watching disabled - watchdog library not available")
+        finally:
+            self._startup_duration = time.perf_counter() - started
+            self._ready.set()
+            print(f"Catalog ready in {self._startup_duration * 1000:.0f}ms "
+                  f"({self._catalog_state()[1]} tracks in {self.db_file})")
+
+    def _open_writer(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None, timeout=60)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema', ?), ('version', '0')",
+                     (str(SCHEMA_VERSION),))
+        self._writer = conn
+
+    def shutdown(self):
+        super().shutdown()
+        self._readers.close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    # Loading
+
+    def _load_data(self, force: bool = False) -> Optional[Dict[str, int]]:
+        """
+        Stream the setlist into the database in one write transaction.
+
+        Rows are staged in a temporary table and compared by digest, so only
+        added, removed, updated or moved tracks touch the indexes and the
+        full-text table. Memory stays bounded by the batch size whatever the
+        catalog size. Returns the change counts, or None when the file was
+        not reparsed because it matches what the database was built from.
+        """
+        with self._data_lock:
+            if self._writer is None:
+                self._open_writer()
+            conn = self._writer
+            stat_key = self._file_fingerprint()
+
+            # The write lock is taken up front so that of several workers
+            # noticing the same change, only the first one ingests it
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                changes = self._ingest(conn, stat_key, force)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+            # Serialize and compress the common responses on this (loading)
+            # thread, so no request has to build them on the event loop. This
+            # also covers a version another worker process ingested.
+            for name in self.prepared_responses:
+                self.get_prepared_response(name)
+            return changes
+
+    def _ingest(self, conn: sqlite3.Connection, stat_key, force: bool) -> Optional[Dict[str, int]]:
+        count = conn.execute("SELECT count(*) FROM tracks").fetchone()[0]
+        if stat_key is None:
+            if count:
+                raise CatalogLoadError(f"Data file {self.data_file} not found; keeping the current catalog")
+            print(f"Data file {self.data_file} not found. Starting with empty dataset.")
+            return None
+
+        loaded = self._read_meta(conn, 'source')
+        self._loaded_fingerprint = tuple(loaded) if loaded else None
+        if not force and loaded is not None:
+            if list(stat_key) == loaded[:2]:
+                return None
+            digest = self._file_digest()
+            if digest == loaded[2]:
+                self._write_meta(conn, 'source', list(stat_key) + [digest])
+                self._loaded_fingerprint = stat_key + (digest,)
+                return None
+
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS staging AS SELECT {', '.join(_COLUMNS)} FROM tracks WHERE 0")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS temp.staging_video_id ON staging (video_id)")
+        conn.execute("DELETE FROM staging")
+
+        reader = SetlistReader(self.data_file)
+        insert = f"INSERT OR IGNORE INTO staging VALUES ({', '.join('?' * len(_COLUMNS))})"
+        try:
+            batch = []
+            for row in self._staged_rows(reader):
+                batch.append(row)
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    conn.executemany(insert, batch)
+                    batch = []
+            if batch:
+                conn.executemany(insert, batch)
+        except json.JSONDecodeError as e:
+            raise CatalogLoadError(f"Invalid JSON in data file: {e}") from e
+        except (OSError, UnicodeDecodeError) as e:
+            raise CatalogLoadError(f"Error reading APIFY data: {e}") from e
+
+        staged = conn.execute("SELECT count(*) FROM staging").fetchone()[0]
+        if reader.item_count and not staged:
+            raise CatalogLoadError(f"None of the {reader.item_count} items in the data file is a valid track")
+        print(f"Loaded {staged} tracks from {reader.item_count} APIFY items")
+
+        changes = {
+            'added': conn.execute(
+                "SELECT count(*) FROM staging WHERE video_id NOT IN (SELECT video_id FROM tracks)").fetchone()[0],
+            'removed': conn.execute(
+                "SELECT count(*) FROM tracks WHERE video_id NOT IN (SELECT video_id FROM staging)").fetchone()[0],
+            'updated': conn.execute(
+                "SELECT count(*) FROM staging s JOIN tracks t USING (video_id) WHERE s.digest != t.digest"
+            ).fetchone()[0],
+        }
+        moved = conn.execute(
+            "SELECT count(*) FROM staging s JOIN tracks t USING (video_id) WHERE s.position != t.position"
+        ).fetchone()[0]
+        self._write_meta(conn, 'source', list(stat_key) + [reader.sha256])
+        self._loaded_fingerprint = stat_key + (reader.sha256,)
+        if not any(changes.values()) and not moved:
+            # Same tracks in the same order: keep the version and its caches
+            return changes
+
+        version = int(self._read_meta(conn, 'version') or 0) + 1
+        self._record_changes(conn, version, changes)
+        conn.execute("DELETE FROM tracks WHERE video_id NOT IN (SELECT video_id FROM staging)")
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])
+        conn.execute(
+            f"INSERT INTO tracks ({', '.join(_COLUMNS)}) SELECT {', '.join(_COLUMNS)} FROM staging WHERE 1 "
+            f"ON CONFLICT (video_id) DO UPDATE SET {assignments} "
+            f"WHERE tracks.digest != excluded.digest OR tracks.position != excluded.position"
+        )
+        conn.execute("DELETE FROM staging")
+        self._write_meta(conn, 'version', version)
+        self._write_meta(conn, 'changes', changes)
+        return changes
+
+    def _record_changes(self, conn: sqlite3.Connection, version: int, changes: Dict[str, int]):
+        """Log the IDs staged for the next version (before they are applied) and drop old entries"""
+        queries = (
+            "SELECT video_id FROM staging WHERE video_id NOT IN (SELECT video_id FROM tracks) LIMIT ?",
+            "SELECT video_id FROM tracks WHERE video_id NOT IN (SELECT video_id FROM staging) LIMIT ?",
+            "SELECT video_id FROM staging s JOIN tracks t USING (video_id) WHERE s.digest != t.digest LIMIT ?",
+        )
+        # Past MAX_CHANGED_IDS the entry keeps only the counts anyway
+        ids = [[row[0] for row in conn.execute(query, (MAX_CHANGED_IDS + 1,))] for query in queries]
+        entry = change_entry(version - 1, version, *ids, counts=changes)
+        conn.execute("INSERT OR REPLACE INTO changes (version, entry) VALUES (?, ?)", (version, json.dumps(entry)))
+        conn.execute("DELETE FROM changes WHERE version <= ?", (version - CHANGE_LOG_SIZE,))
+
+    def _staged_rows(self, reader: SetlistReader) -> Iterator[Tuple]:
+        """Table rows for the setlist's valid tracks, in file order"""
+        for position, item in enumerate(reader):
+            track = self._format_track(item)
+            if not track:
+                continue
+            hashtags = list(track['hashtags'] or ())
+            track['hashtags'] = hashtags
+            meta = json.dumps([track[field] for field in _META_FIELDS], ensure_ascii=False, separators=(',', ':'))
+            description = track['description']
+            if description is not None and not isinstance(description, str):
+                description = str(description)
+            digest = hashlib.sha1(f"{meta}\0{description}".encode('utf-8', 'surrogatepass')).hexdigest()
+            yield (
+                track['video_id'], position, digest, meta, description,
+                track['title'], track['channel_title'], " ".join(map(str, hashtags)),
+                track['channel_id'],
+                normalize_channel_name(track['channel_title']) if track['channel_title'] else None,
+                1 if hashtags else 0,
+                _sort_value(SORT_KEYS['views'], track), _sort_value(SORT_KEYS['likes'], track),
+                _sort_value(SORT_KEYS['comments'], track), SORT_KEYS['date'](track),
+                parse_duration(track['duration']), SORT_KEYS['title'](track),
+                VIEW_BOOST * math.log10(1 + max(_sort_value(SORT_KEYS['views'], track), 0)),
+                track['channel_url'], _sort_value(lambda t: t['subscribers'] or 0, track),
+            )
+
+    @staticmethod
+    def _read_meta(conn: sqlite3.Connection, key: str):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    @staticmethod
+    def _write_meta(conn: sqlite3.Connection, key: str, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    # Catalog state
+
+    def _catalog_state(self) -> Tuple[int, int]:
+        if not os.path.exists(self.db_file):
+            return 0, 0
+        try:
+            with self._readers.connection() as conn:
+                version = self._read_meta(conn, 'version') or 0
+                count = self._cached_for(conn, version, 'count', lambda: self._count(conn))
+        except sqlite3.OperationalError:
+            # The schema is not created yet
+            return 0, 0
+        return version, count
+
+    def get_changes(self, since: Optional[int] = None, until: Optional[int] = None) -> Dict:
+        """The changes between two versions, from the log the ingesting process keeps in the database"""
+        if not os.path.exists(self.db_file):
+            return super().get_changes(since, until)
+        try:
+            with self._readers.connection() as conn:
+                version = self._read_meta(conn, 'version') or 0
+                until = version if until is None else min(until, version)
+                since = until if since is None else since
+                entries = [json.loads(entry) for (entry,) in conn.execute(
+                    "SELECT entry FROM changes WHERE version > ? AND version <= ? ORDER BY version", (since, until))]
+        except sqlite3.OperationalError:
+            # The schema is not created yet
+            return super().get_changes(since, until)
+        return merge_changes(entries, since, until)
+
+    def _cached_for(self, conn: sqlite3.Connection, version: int, name: str, build):
+        """A value derived from one catalog version, built once per version"""
+        with self._cache_lock:
+            if self._cached_version == version and name in self._cached:
+                return self._cached[name]
+        value = build()
+        with self._cache_lock:
+            if self._cached_version != version:
+                self._cached_version = version
+                self._cached = {}
+            self._cached[name] = value
+        return value
+
+    # Queries
+
+    @staticmethod
+    def _row_to_dict(meta: str, description: str) -> Dict:
+        values = json.loads(meta)
+        track = dict(zip(_META_FIELDS, values))
+        return {field: description if field == 'description' else track[field] for field in TRACK_FIELDS}
+
+    def _select(self, conn: sqlite3.Connection, where: str = "1", params: Tuple = (),
+                order: str = "tracks.position", limit: Optional[int] = None, offset: int = 0,
+                match: Optional[str] = None) -> List[Dict]:
+        """Tracks matching a WHERE clause (and a full-text query, if given) as API dicts"""
+        return list(self._iter_select(conn, where, params, order, limit, offset, match))
+
+    @staticmethod
+    def _description_column(fields: Optional[Sequence[str]]) -> str:
+        # Descriptions are the bulk of every row; skip reading them when they are not wanted
+        return "tracks.description" if fields is None or 'description' in fields else "NULL"
+
+    def _iter_select(self, conn: sqlite3.Connection, where: str = "1", params: Tuple = (),
+                     order: str = "tracks.position", limit: Optional[int] = None, offset: int = 0,
+                     match: Optional[str] = None, fields: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+        description = self._description_column(fields)
+        source = "tracks"
+        if match is not None:
+            source = "tracks_fts JOIN tracks ON tracks.rowid = tracks_fts.rowid"
+            where = f"tracks_fts MATCH ? AND ({where})"
+            params = (match,) + tuple(params)
+        sql = f"SELECT tracks.meta, {description} FROM {source} WHERE {where} ORDER BY {order}"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = tuple(params) + (-1 if limit is None else limit, offset)
+        for meta, text in conn.execute(sql, params):
+            yield project_track(self._row_to_dict(meta, text), fields)
+
+    def _select_ids(self, conn: sqlite3.Connection, video_ids: Sequence[str],
+                    fields: Optional[Sequence[str]] = None) -> Dict[str, Dict]:
+        """The tracks with these video_ids (missing ones left out), keyed by video_id"""
+        by_id = {}
+        for start in range(0, len(video_ids), ID_LOOKUP_CHUNK_SIZE):
+            chunk = tuple(video_ids[start:start + ID_LOOKUP_CHUNK_SIZE])
+            for track in self._iter_select(conn, f"tracks.video_id IN ({', '.join('?' * len(chunk))})", chunk,
+                                           fields=fields):
+                by_id[track['video_id']] = track
+        return by_id
+
+    def _count(self, conn: sqlite3.Connection, where: str = "1", params: Tuple = (),
+               match: Optional[str] = None) -> int:
+        if match is not None:
+            sql = (f"SELECT count(*) FROM tracks_fts JOIN tracks ON tracks.rowid = tracks_fts.rowid "
+                   f"WHERE tracks_fts MATCH ? AND ({where})")
+            params = (match,) + tuple(params)
+        else:
+            sql = f"SELECT count(*) FROM tracks WHERE {where}"
+        return conn.execute(sql, params).fetchone()[0]
+
+    def _stream_select(self, sort: Optional[str], order: str, limit: int, offset: int = 0,
+                       fields: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+        """
+        The unfiltered listing, read STREAM_PAGE_SIZE rows at a time. A pooled
+        connection is only taken while a page is read, never while a client
+        consumes it; each page continues after the sort key of the last row.
+        """
+        columns = ["tracks.position"] if sort is None else [f"tracks.{_SORT_COLUMNS[sort]}", "tracks.position"]
+        descending = sort is not None and order == 'desc'
+        order_by = ", ".join(f"{column} DESC" if descending else column for column in columns)
+        after = f"({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})"
+        select = f"SELECT tracks.meta, {self._description_column(fields)}, {', '.join(columns)} FROM tracks"
+        key = None
+        while limit > 0:
+            size = min(limit, STREAM_PAGE_SIZE)
+            with self._readers.connection() as conn:
+                if key is None:
+                    cursor = conn.execute(f"{select} ORDER BY {order_by} LIMIT ? OFFSET ?", (size, offset))
+                else:
+                    cursor = conn.execute(f"{select} WHERE {after} ORDER BY {order_by} LIMIT ?", key + (size,))
+                rows = cursor.fetchall()
+            for row in rows:
+                yield project_track(self._row_to_dict(row[0], row[1]), fields)
+            if len(rows) < size:
+                return
+            limit -= size
+            key = tuple(rows[-1][2:])
+
+    def _match_ids(self, conn: sqlite3.Connection, where: str, params: Tuple, order: str,
+                   match: Optional[str] = None) -> Tuple[str, ...]:
+        """The video_ids of every track matching a query, in order"""
+        source = "tracks"
+        if match is not None:
+            source = "tracks_fts JOIN tracks ON tracks.rowid = tracks_fts.rowid"
+            where = f"tracks_fts MATCH ? AND ({where})"
+            params = (match,) + tuple(params)
+        return tuple(video_id for (video_id,) in
+                     conn.execute(f"SELECT tracks.video_id FROM {source} WHERE {where} ORDER BY {order}", params))
+
+    def _page_by_id(self, conn: sqlite3.Connection, video_ids: Sequence[str],
+                    fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        by_id = self._select_ids(conn, video_ids, fields)
+        return [by_id[video_id] for video_id in video_ids if video_id in by_id]
+
+    def _stream_by_id(self, video_ids: Sequence[str], fields: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+        """
+        Cached matches read STREAM_PAGE_SIZE at a time, each page on a pooled
+        connection taken only while it is read. Tracks a version committed
+        meanwhile removed are skipped.
+        """
+        for start in range(0, len(video_ids), STREAM_PAGE_SIZE):
+            with self._readers.connection() as conn:
+                tracks = self._page_by_id(conn, video_ids[start:start + STREAM_PAGE_SIZE], fields)
+            yield from tracks
+
+    def get_all_tracks(self) -> List[Dict]:
+        with self._readers.connection() as conn:
+            return self._select(conn)
+
+    def get_random_track(self) -> Optional[Dict]:
+        with self._readers.connection() as conn:
+            low, high = conn.execute("SELECT min(position), max(position) FROM tracks").fetchone()
+            if low is None:
+                return None
+            tracks = self._select(conn, "tracks.position >= ?", (random.randint(low, high),), limit=1)
+            return tracks[0] if tracks else None
+
+    def get_radio_queue(self, session: Optional[str] = None, count: int = RADIO_BATCH_SIZE,
+                        weighting: str = 'uniform', channel: Optional[str] = None,
+                        hashtag: Optional[str] = None) -> Dict:
+        self._radio.validate(weighting, session)
+        count = max(1, min(count, MAX_RADIO_BATCH_SIZE))
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+            pool = self._radio.pool(self._radio_key(version, weighting, channel, hashtag),
+                                    lambda: self._radio_candidates(conn, channel, hashtag), weighting)
+            session, video_ids = self._radio.deal(session, pool, count)
+            by_id = self._select_ids(conn, video_ids)
+        return {
+            'session': session,
+            'tracks': [by_id[video_id] for video_id in video_ids],
+            'pool_size': len(pool),
+            'version': version
+        }
+
+    def _radio_candidates(self, conn: sqlite3.Connection, channel: Optional[str],
+                          hashtag: Optional[str]) -> List[Dict]:
+        """The columns the pool weights are computed from, for every track matching the filters"""
+        where, params = ["1"], []
+        if channel:
+            where.append("channel_key = ?")
+            params.append(normalize_channel_name(channel))
+        if hashtag:
+            where.append("has_hashtags = 1")
+        tag = normalize_hashtag(hashtag) if hashtag else None
+        rows = conn.execute(f"SELECT video_id, view_count, likes, upload_date, hashtags_text FROM tracks "
+                            f"WHERE {' AND '.join(where)} ORDER BY position", params)
+        return [{'video_id': video_id, 'view_count': views, 'likes': likes, 'upload_date': upload_date}
+                for video_id, views, likes, upload_date, hashtags in rows
+                if tag is None or tag in {normalize_hashtag(h) for h in hashtags.split()}]
+
+    def get_track(self, video_id: str) -> Optional[Dict]:
+        with self._readers.connection() as conn:
+            tracks = self._select(conn, "tracks.video_id = ?", (video_id,))
+            return tracks[0] if tracks else None
+
+    def get_tracks_batch(self, video_ids: Sequence[str], fields: Optional[Sequence[str]] = None) -> Dict:
+        video_ids = self._batch_ids(video_ids)
+        # video_id is needed to put the rows back in request order
+        lookup = fields if fields is None or 'video_id' in fields else ('video_id',) + tuple(fields)
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+            by_id = self._select_ids(conn, video_ids, lookup)
+        return {
+            'tracks': [project_track(by_id[video_id], fields) for video_id in video_ids if video_id in by_id],
+            'missing': [video_id for video_id in video_ids if video_id not in by_id],
+            'version': version
+        }
+
+    def get_similar_tracks(self, video_id: str, limit: int = 10) -> Optional[Dict]:
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+            found = self._select(conn, "tracks.video_id = ?", (video_id,), limit=1)
+            if not found:
+                return None
+            index = self._similar.index(version, self._similarity_tracks, self.get_changes)
+            neighbors = index.similar(found[0], MAX_SIMILAR)
+            by_id = self._select_ids(conn, [similar_id for similar_id, _ in neighbors])
+        tracks = [dict(by_id[similar_id], similarity=score) for similar_id, score in neighbors if similar_id in by_id]
+        return {'video_id': video_id, 'tracks': tracks[:limit], 'version': version}
+
+    def _similarity_tracks(self) -> Tuple[int, List[Dict]]:
+        """The current version and the fields the similarity index reads, on a connection of its own"""
+        with self._readers.connection() as conn:
+            return self._read_meta(conn, 'version') or 0, list(self._iter_select(conn, fields=SIMILARITY_FIELDS))
+
+    def get_tracks_by_channel(self, channel_name: str) -> List[Dict]:
+        with self._readers.connection() as conn:
+            return self._select(conn, "tracks.channel_key = ?", (normalize_channel_name(channel_name),))
+
+    def get_tracks_by_channel_id(self, channel_id: str) -> List[Dict]:
+        with self._readers.connection() as conn:
+            return self._select(conn, "tracks.channel_id = ?", (channel_id,))
+
+    def search_tracks(self, query: str) -> List[Dict]:
+        match = _fts_query(query)
+        if match is None:
+            return []
+        with self._readers.connection() as conn:
+            return self._select(conn, match=match, order=_SEARCH_ORDER)
+
+    def query_tracks(self, search: Optional[str] = None, channel: Optional[str] = None,
+                     has_hashtags: bool = False, sort: Optional[str] = None, order: str = 'desc',
+                     cursor: Optional[str] = None, limit: Optional[int] = None,
+                     fields: Optional[Sequence[str]] = None, stream: bool = False) -> Dict:
+        """
+        Filter, sort and paginate tracks with indexed queries. Cursors only
+        stay valid while the catalog version they were issued for is the
+        current one, since the database keeps no older versions.
+        
+        Filtered queries go through the query cache: the ordered video_ids of
+        all their matches are kept for the catalog version, so paging on or
+        repeating a query only looks up one page of rows by id, without
+        matching, counting or sorting again. Unlike the in-memory backend, a
+        query extending a cached one is matched afresh rather than narrowed.
+        
+        A streamed listing reads its rows a page at a time as it is consumed,
+        holding a pooled connection only while a page is read, so later pages
+        can be from a version committed after the total was counted.
+        """
+        if sort is not None and sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{sort}', expected one of: {', '.join(SORT_KEYS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("Sort order must be 'asc' or 'desc'")
+
+        fingerprint = self._query_fingerprint(search, channel, has_hashtags, sort, order)
+        offset = 0
+        cursor_version = None
+        if cursor:
+            cursor_version, offset = self._decode_cursor(cursor, fingerprint)
+
+        conditions = []
+        params = []
+        match = None
+        order_by = "tracks.position"
+        if search:
+            match = _fts_query(search)
+            if match is None:
+                conditions.append("0")
+                match = None
+            elif sort is None:
+                order_by = _SEARCH_ORDER
+        if channel:
+            conditions.append("tracks.channel_key = ?")
+            params.append(normalize_channel_name(channel))
+        if has_hashtags:
+            conditions.append("tracks.has_hashtags = 1")
+        if sort is not None:
+            direction = "DESC" if order == 'desc' else "ASC"
+            order_by = f"tracks.{_SORT_COLUMNS[sort]} {direction}, tracks.position {direction}"
+        where = " AND ".join(conditions) or "1"
+
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+            if cursor_version is not None and cursor_version != version:
+                raise ExpiredCursorError("Cursor refers to a catalog version that is no longer available")
+            matches = None
+            if search or channel or has_hashtags:
+                key = ('query', query_terms(search) if search else None,
+                       normalize_channel_name(channel) if channel else None, has_hashtags, sort, order)
+                matches = self._query_cache.get(version, key)
+                if matches is None:
+                    matches = self._match_ids(conn, where, tuple(params), order_by, match)
+                    self._query_cache.put(version, key, matches)
+                total = len(matches)
+            else:
+                total = self._count(conn, where, tuple(params), match)
+            end = total if limit is None else min(offset + limit, total)
+            if not stream:
+                tracks = (list(self._iter_select(conn, where, tuple(params), order_by, max(end - offset, 0), offset,
+                                                 match, fields)) if matches is None
+                          else self._page_by_id(conn, matches[offset:end], fields))
+        if stream:
+            tracks = (self._stream_select(sort, order, max(end - offset, 0), offset, fields) if matches is None
+                      else self._stream_by_id(matches[offset:end], fields))
+
+        return {
+            'tracks': tracks,
+            'total': total,
+            'next_cursor': self._encode_cursor(version, end, fingerprint) if end < total else None,
+            'version': version
+        }
+
+    def get_facets(self, search: Optional[str] = None, channel: Optional[str] = None,
+                   has_hashtags: bool = False, hashtag_limit: int = HASHTAG_FACET_SIZE) -> Dict:
+        """
+        Facet counts from an in-memory FacetIndex built once per catalog
+        version; only the full-text filter is a database query
+        """
+        hashtag_limit = max(1, min(hashtag_limit, MAX_HASHTAG_FACET_SIZE))
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+            index = self._cached_for(conn, version, 'facets', lambda: FacetIndex(
+                list(self._iter_select(conn, fields=FACET_FIELDS)),
+                lambda track: normalize_channel_name(track['channel_title']) if track['channel_title'] else None))
+            matches = None
+            if search:
+                match = _fts_query(search)
+                matches = [] if match is None else [video_id for (video_id,) in conn.execute(
+                    "SELECT tracks.video_id FROM tracks_fts JOIN tracks ON tracks.rowid = tracks_fts.rowid "
+                    "WHERE tracks_fts MATCH ?", (match,))]
+        facets = index.facets(matches, normalize_channel_name(channel) if channel else None,
+                              has_hashtags, hashtag_limit)
+        facets['version'] = version
+        return facets
+
+    # Aggregates and prepared responses
+
+    def get_prepared_response(self, name: str, snapshot=None) -> PreparedResponse:
+        """Serialized bodies of the common responses, built once per catalog version"""
+        if name not in self.prepared_responses:
+            raise KeyError(f"No prepared response named '{name}'")
+        with self._readers.connection() as conn:
+            version = self._read_meta(conn, 'version') or 0
+
+            def build():
+                if name == 'channels':
+                    payload = self._channel_summaries(conn, version)
+                else:
+                    payload = self._stats(conn, version)
+                return PreparedResponse(version, payload)
+
+            return self._cached_for(conn, version, f"response:{name}", build)
+
+    def get_channels_summary(self) -> List[Dict]:
+        with self._readers.connection() as conn:
+            return list(self._channel_summaries(conn, self._read_meta(conn, 'version') or 0))
+
+    def get_stats(self) -> Dict:
+        with self._readers.connection() as conn:
+            return dict(self._stats(conn, self._read_meta(conn, 'version') or 0))
+
+    def _channel_summaries(self, conn: sqlite3.Connection, version: int) -> List[Dict]:
+        def build():
+            # Channel metadata follows the most recent upload, as in CatalogAggregates
+            rows = conn.execute("""
+                SELECT channel_id, count(*), sum(view_count), sum(likes), sum(comments_count),
+                       sum(duration_seconds), max(upload_date),
+                       (SELECT json_array(channel_title, channel_url, subscribers) FROM tracks latest
+                        WHERE latest.channel_id = tracks.channel_id
+                        ORDER BY upload_date DESC, video_id DESC LIMIT 1)
+                FROM tracks WHERE channel_id != '' AND channel_id IS NOT NULL
+                GROUP BY channel_id
+            """).fetchall()
+            summaries = []
+            for channel_id, count, views, likes, comments, duration, latest, latest_meta in rows:
+                title, url, subscribers = json.loads(latest_meta)
+                summaries.append({
+                    'channel_title': title or '',
+                    'channel_id': channel_id,
+                    'channel_url': url or '',
+                    'subscribers': subscribers,
+                    'video_count': count,
+                    'total_views': views,
+                    'avg_views': views // count,
+                    'total_likes': likes,
+                    'avg_likes': likes // count,
+                    'total_comments': comments,
+                    'avg_comments': comments // count,
+                    'total_duration': duration,
+                    'avg_duration': duration // count,
+                    'latest_upload': latest
+                })
+            summaries.sort(key=lambda channel: (-channel['subscribers'], channel['channel_id']))
+            return summaries
+
+        return self._cached_for(conn, version, 'channels', build)
+
+    def _stats(self, conn: sqlite3.Connection, version: int) -> Dict:
+        def build():
+            count, views, likes, comments, duration = conn.execute(
+                "SELECT count(*), sum(view_count), sum(likes), sum(comments_count), sum(duration_seconds) FROM tracks"
+            ).fetchone()
+            if not count:
+                return {}
+            channels, latest = conn.execute(
+                "SELECT count(DISTINCT channel_id), max(upload_date) FROM tracks "
+                "WHERE channel_id != '' AND channel_id IS NOT NULL"
+            ).fetchone()
+            return {
+                'total_tracks': count,
+                'total_views': views,
+                'total_likes': likes,
+                'total_comments': comments,
+                'unique_channels': channels,
+                'avg_views_per_track': views // count,
+                'avg_likes_per_track': likes // count,
+                'avg_comments_per_track': comments // count,
+                'total_duration': duration,
+                'avg_duration': duration // count,
+                'latest_upload': latest or ''
+            }
+
+        return self._cached_for(conn, version, 'stats', build)
+
+    def get_watcher_status(self) -> Dict:
+        status = super().get_watcher_status()
+        status["storage"] = {"backend": "sqlite", "database": self.db_file}
+        return status
+
+
+def _sort_value(key, track: Dict) -> int:
+    """Numeric sort values; anything else in the source sorts as 0"""
+    value = key(track)
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def _fts_query(query: str) -> Optional[str]:
+    """
+    FTS5 query for the same matching rules as the in-memory index: every
+    word must match, as a whole word or a word prefix
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' for term in terms)
@@ -0,0 +1,140 @@
+import sys
+from typing import Dict, Optional, Sequence, Tuple
+
+# Formatted track fields, in the order the API has always returned them
+TRACK_FIELDS = (
+    'title', 'video_id', 'channel_title', 'thumbnail', 'description', 'url', 'view_count',
+    'likes', 'duration', 'upload_date', 'channel_url', 'channel_id', 'subscribers', 'hashtags',
+    'search_query', 'comments_count',
+)
+_FIELD_SET = frozenset(TRACK_FIELDS)
+
+
+class TrackRecord:
+    """
+    Compact in-memory form of a formatted track.
+
+    Records use __slots__ instead of a per-track dict, keep hashtags as a
+    tuple and store the (often emoji-laden, kilobyte-sized) description as
+    UTF-8 bytes rather than a 4-byte-per-character str. They support
+    record['field'] lookups so catalog code can treat them like the dicts
+    the API returns; to_dict() produces that dict.
+    """
+
+    __slots__ = ('title', 'video_id', 'channel_title', 'thumbnail', '_description', 'url',
+                 'view_count', 'likes', 'duration', 'upload_date', 'channel_url', 'channel_id',
+                 'subscribers', 'hashtags', 'search_query', 'comments_count')
+
+    def __init__(self, title: str, video_id: str, channel_title: str, thumbnail: str, description: str,
+                 url: str, view_count: int, likes: int, duration: str, upload_date: str, channel_url: str,
+                 channel_id: str, subscribers: int, hashtags: Tuple[str, ...], search_query: str,
+                 comments_count: int):
+        self.title = title
+        self.video_id = video_id
+        self.channel_title = channel_title
+        self.thumbnail = thumbnail
+        self._description = description.encode('utf-8') if isinstance(description, str) else description
+        self.url = url
+        self.view_count = view_count
+        self.likes = likes
+        self.duration = duration
+        self.upload_date = upload_date
+        self.channel_url = channel_url
+        self.channel_id = channel_id
+        self.subscribers = subscribers
+        self.hashtags = hashtags
+        self.search_query = search_query
+        self.comments_count = comments_count
+
+    @classmethod
+    def from_dict(cls, track: Dict) -> 'TrackRecord':
+        """Build a record from a track in the API format"""
+        return cls(
+            track['title'],
+            track['video_id'],
+            _intern(track['channel_title']),
+            track['thumbnail'],
+            track['description'],
+            track['url'],
+            track['view_count'],
+            track['likes'],
+            _intern(track['duration']),
+            track['upload_date'],
+            _intern(track['channel_url']),
+            _intern(track['channel_id']),
+            track['subscribers'],
+            tuple(_intern(tag) for tag in track['hashtags'] or ()),
+            _intern(track['search_query']),
+            track['comments_count'],
+        )
+
+    @property
+    def description(self) -> str:
+        value = self._description
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def __getitem__(self, field: str):
+        if field not in _FIELD_SET:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TrackRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in TrackRecord.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"TrackRecord(video_id={self.video_id!r}, title={self.title!r})"
+
+    def to_dict(self) -> Dict:
+        """The track in the format expected by the frontend"""
+        return {
+            'title': self.title,
+            'video_id': self.video_id,
+            'channel_title': self.channel_title,
+            'thumbnail': self.thumbnail,
+            'description': self.description,
+            'url': self.url,
+            'view_count': self.view_count,
+            'likes': self.likes,
+            'duration': self.duration,
+            'upload_date': self.upload_date,
+            'channel_url': self.channel_url,
+            'channel_id': self.channel_id,
+            'subscribers': self.subscribers,
+            'hashtags': list(self.hashtags),
+            'search_query': self.search_query,
+            'comments_count': self.comments_count
+        }
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def parse_fields(spec: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Parse a comma-separated fields= projection into field names in API
+    order. None (or an empty spec) means every field; unknown names raise
+    ValueError.
+    """
+    if not spec:
+        return None
+    requested = {name.strip() for name in spec.split(',') if name.strip()}
+    unknown = requested - _FIELD_SET
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(sorted(unknown))}, expected any of: {', '.join(TRACK_FIELDS)}")
+    return tuple(field for field in TRACK_FIELDS if field in requested) or None
+
+
+def project_track(track, fields: Optional[Sequence[str]] = None) -> Dict:
+    """A track (record or API dict) in the API format, limited to fields if given"""
+    if fields is None:
+        return track if isinstance(track, dict) else track.to_dict()
+    projected = {}
+    for field in fields:
+        value = track[field]
+        projected[field] = list(value) if isinstance(value, tuple) else value
+    return projected
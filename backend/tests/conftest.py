@@ -0,0 +1,98 @@
+import json
+from typing import Dict, List
+
+import httpx
+import pytest
+
+import routes.channels as channel_routes
+import routes.tracks as track_routes
+import services.sqlite_data_service as sqlite_data_service
+from main import app
+from services.apify_data_service import ApifyDataService
+from services.change_log import ChangeFeed
+from services.sqlite_data_service import SQLiteDataService
+from services.track_record import TrackRecord
+
+# Channels of the fixture setlist: (name, id, subscribers)
+CHANNELS = [
+    ("Lofi Lab", "UClofilab", 120000),
+    ("Synth Forge", "UCsynthforge", 45000),
+    ("Neural Jazz", "UCneuraljazz", 8000),
+    ("Ambient Drift", "UCambientdrift", 300),
+]
+
+# Title words; every track gets two, so searches match overlapping subsets
+WORDS = ["lofi", "chill", "synthwave", "retro", "jazz", "cafe", "ambient", "rain", "study", "beats", "piano"]
+
+HASHTAGS = ["#lofi", "#aimusic", "#synthwave", "#jazz", "#chill"]
+
+
+def apify_item(index: int, **overrides) -> Dict:
+    """A deterministic APIFY item; overrides replace any of its fields"""
+    name, channel_id, subscribers = CHANNELS[index % len(CHANNELS)]
+    video_id = f"vid{index:05d}"
+    item = {
+        "id": video_id,
+        "type": "video",
+        "url": f"https://www.youtube.com/watch?v={video_id}",
+        "title": f"{WORDS[index % len(WORDS)].title()} {WORDS[(index * 3 + 1) % len(WORDS)]} mix {index}",
+        "thumbnailUrl": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "text": f"Track {index} by {name}. " + "An AI generated set for long sessions. " * (index % 4),
+        "viewCount": (index * 7919) % 1000003,
+        "likes": (index * 104729) % 10007,
+        "commentsCount": index % 97,
+        "duration": f"00:{index % 60:02d}:{(index * 7) % 60:02d}",
+        "date": f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T12:00:00.000Z",
+        "channelName": name,
+        "channelUrl": f"https://www.youtube.com/channel/{channel_id}",
+        "channelId": channel_id,
+        "numberOfSubscribers": subscribers,
+        "hashtags": [HASHTAGS[(index + offset) % len(HASHTAGS)] for offset in range(index % 3)],
+        "input": "ai music",
+    }
+    item.update(overrides)
+    return item
+
+
+def write_setlist(path, items: List[Dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f)
+
+
+def track_records(items: List[Dict]) -> List[TrackRecord]:
+    """Records for APIFY items, formatted as the data services format them"""
+    formatter = ApifyDataService()
+    try:
+        return [TrackRecord.from_dict(formatter._format_track(item)) for item in items]
+    finally:
+        formatter.shutdown()
+
+
+def load_service(service_class, setlist_file, tmp_path, monkeypatch):
+    """A data service of either backend loaded from setlist_file, without watcher or catalog cache"""
+    if service_class is SQLiteDataService:
+        monkeypatch.setattr(sqlite_data_service, "SQLITE_PATH", str(tmp_path / "catalog.sqlite3"))
+    service = service_class()
+    service.data_file = str(setlist_file)
+    service._cache_file = None
+    service._load_data()
+    return service
+
+
+def serve(service, monkeypatch):
+    """Point the API routes at a test service"""
+    monkeypatch.setattr(track_routes, "apify_service", service)
+    monkeypatch.setattr(channel_routes, "apify_service", service)
+    monkeypatch.setattr(track_routes, "change_feed", ChangeFeed(service, poll_interval=0.05))
+
+
+def asgi_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.fixture
+def setlist_file(tmp_path):
+    """A small AI_Setlist.json in a temporary directory"""
+    path = tmp_path / "AI_Setlist.json"
+    write_setlist(path, [apify_item(index) for index in range(60)])
+    return path
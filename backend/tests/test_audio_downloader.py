@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from aiohttp import web
+
+import services.audio_downloader as audio_downloader_module
+from services.audio_downloader import AudioDownloader
+
+ETAG = '"v1"'
+
+
+class AudioServer:
+    """
+    Local stand-in for an audio host. mode picks how it answers a Range
+    request: "range" honours it (206, or 416 past the end), "ignore" always
+    sends the whole file (200) and "wrong-start" sends a 206 from byte 0.
+    With drop_first, the first response is cut off halfway through.
+    """
+
+    def __init__(self, files, mode="range", drop_first=False):
+        self.files = files
+        self.mode = mode
+        self.drop_first = drop_first
+        self.requests = []
+        self._runner = None
+        self.port = None
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.port}/{name}"
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{name}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        self.requests.append(dict(request.headers))
+        body = self.files[request.match_info["name"]]
+        start = 0
+        status = 200
+        range_header = request.headers.get("Range")
+        if range_header and self.mode != "ignore" and request.headers.get("If-Range", ETAG) == ETAG:
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            if start >= len(body):
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{len(body)}"})
+            status = 206
+            if self.mode == "wrong-start":
+                start = 0
+
+        response = web.StreamResponse(status=status, headers={"ETag": ETAG})
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        response.content_length = len(body) - start
+        await response.prepare(request)
+        if self.drop_first and len(self.requests) == 1:
+            await response.write(body[start:start + len(body) // 2])
+            request.transport.close()
+            return response
+        await response.write(body[start:])
+        await response.write_eof()
+        return response
+
+
+def audio_bytes(seed, size=20000):
+    return bytes((seed * 31 + i * 7) % 256 for i in range(size))
+
+
+def partial_path(downloader, url, filename):
+    name = hashlib.sha1(f"{filename}\0{url}".encode("utf-8")).hexdigest() + ".part"
+    return os.path.join(downloader.partial_dir, name)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_backoff(monkeypatch):
+    monkeypatch.setattr(audio_downloader_module, "RETRY_BACKOFF", 0)
+
+
+def test_resumes_a_dropped_download_with_range_and_if_range(tmp_path):
+    body = audio_bytes(1)
+
+    async def scenario():
+        async with AudioServer({"a": body}, drop_first=True) as server:
+            downloader = AudioDownloader(str(tmp_path))
+            try:
+                path = await downloader.download_track(server.url("a"), "a.mp3")
+            finally:
+                await downloader.close()
+            return path, server.requests
+
+    path, requests = asyncio.run(scenario())
+    assert read(path) == body
+    assert os.path.basename(path) == hashlib.sha256(body).hexdigest() + ".mp3"
+    assert "Range" not in requests[0]
+    assert requests[1]["Range"] == f"bytes={len(body) // 2}-"
+    assert requests[1]["If-Range"] == ETAG
+
+
+def test_changed_file_is_downloaded_again_from_the_start(tmp_path):
+    body = audio_bytes(2)
+
+    async def scenario():
+        async with AudioServer({"a": body}) as server:
+            downloader = AudioDownloader(str(tmp_path))
+            # A partial download of an older version of the file
+            partial = partial_path(downloader, server.url("a"), "a.mp3")
+            with open(partial, "wb") as f:
+                f.write(b"stale" * 100)
+            with open(partial + ".validator", "w", encoding="utf-8") as f:
+                f.write('"v0"')
+            try:
+                path = await downloader.download_track(server.url("a"), "a.mp3")
+            finally:
+                await downloader.close()
+            return path, server.requests, partial
+
+    path, requests, partial = asyncio.run(scenario())
+    assert requests[0]["If-Range"] == '"v0"'
+    assert read(path) == body
+    assert not os.path.exists(partial) and not os.path.exists(partial + ".validator")
+
+
+@pytest.mark.parametrize("mode", ["ignore", "wrong-start"])
+def test_restarts_when_the_server_does_not_resume_where_asked(tmp_path, mode):
+    body = audio_bytes(3)
+
+    async def scenario():
+        async with AudioServer({"a": body}, mode=mode) as server:
+            downloader = AudioDownloader(str(tmp_path))
+            with open(partial_path(downloader, server.url("a"), "a.mp3"), "wb") as f:
+                f.write(body[:5000])
+            try:
+                return await downloader.download_track(server.url("a"), "a.mp3")
+            finally:
+                await downloader.close()
+
+    assert read(asyncio.run(scenario())) == body
+
+
+def test_416_completes_a_partial_file_that_is_already_whole(tmp_path):
+    body = audio_bytes(4)
+
+    async def scenario():
+        async with AudioServer({"a": body}) as server:
+            downloader = AudioDownloader(str(tmp_path))
+            with open(partial_path(downloader, server.url("a"), "a.mp3"), "wb") as f:
+                f.write(body)
+            try:
+                path = await downloader.download_track(server.url("a"), "a.mp3")
+            finally:
+                await downloader.close()
+            return path, server.requests
+
+    path, requests = asyncio.run(scenario())
+    assert read(path) == body
+    assert len(requests) == 1 and requests[0]["Range"] == f"bytes={len(body)}-"
+
+
+def test_416_discards_a_partial_file_longer_than_the_remote_one(tmp_path):
+    body = audio_bytes(5)
+
+    async def scenario():
+        async with AudioServer({"a": body}) as server:
+            downloader = AudioDownloader(str(tmp_path))
+            with open(partial_path(downloader, server.url("a"), "a.mp3"), "wb") as f:
+                f.write(body + b"trailing garbage")
+            try:
+                path = await downloader.download_track(server.url("a"), "a.mp3")
+            finally:
+                await downloader.close()
+            return path, server.requests
+
+    path, requests = asyncio.run(scenario())
+    assert read(path) == body
+    assert "Range" not in requests[-1]
+
+
+def test_evicts_least_recently_used_names_past_the_size_limit(tmp_path):
+    files = {name: audio_bytes(seed, 1000) for seed, name in enumerate("abc")}
+
+    async def scenario():
+        async with AudioServer(files) as server:
+            downloader = AudioDownloader(str(tmp_path), max_cache_bytes=2500)
+            try:
+                first = await downloader.download_track(server.url("a"), "a.mp3")
+                second = await downloader.download_track(server.url("b"), "b.mp3")
+                # Using a makes b the least recently used
+                assert downloader.get_track_path("a") == first
+                await downloader.download_track(server.url("c"), "c.mp3")
+                return downloader, first, second
+            finally:
+                await downloader.close()
+
+    downloader, first, second = asyncio.run(scenario())
+    assert downloader.get_track_path("b") is None and not os.path.exists(second)
+    assert downloader.get_track_path("a") == first and downloader.get_track_path("c") is not None
+    assert downloader.total_bytes == 2000
+    # The order survives a restart
+    assert list(AudioDownloader(str(tmp_path), max_cache_bytes=2500)._entries) == ["a.mp3", "c.mp3"]
+
+
+def test_processes_sharing_a_directory_keep_each_others_files(tmp_path):
+    files = {"a": audio_bytes(6, 1000), "b": audio_bytes(7, 1000)}
+
+    async def scenario():
+        async with AudioServer(files) as server:
+            # Each worker process has its own downloader over the same directory
+            first, second = AudioDownloader(str(tmp_path)), AudioDownloader(str(tmp_path))
+            try:
+                path_a = await first.download_track(server.url("a"), "a.mp3")
+                path_b = await second.download_track(server.url("b"), "b.mp3")
+                assert first.get_track_path("b") == path_b
+            finally:
+                await first.close()
+                await second.close()
+            return path_a, path_b
+
+    path_a, path_b = asyncio.run(scenario())
+    restarted = AudioDownloader(str(tmp_path))
+    assert restarted.get_track_path("a") == path_a and restarted.get_track_path("b") == path_b
+    assert os.path.exists(path_a) and os.path.exists(path_b)
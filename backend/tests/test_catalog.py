@@ -0,0 +1,103 @@
+import pytest
+
+from conftest import apify_item, track_records
+from services.catalog import SORT_KEYS, CatalogDelta, CatalogSnapshot
+
+SEARCHES = ["lofi", "chill", "synthwave retro", "jazz cafe", "#aimusic", "ambient drift", "mix 8", "edited"]
+
+
+def base_items():
+    return [apify_item(index) for index in range(80)]
+
+
+def edited_items(move=True):
+    """base_items() with tracks removed, updated, added and (optionally) moved, and sort-key ties throughout"""
+    items = {item["id"]: item for item in base_items()}
+    for index in (5, 17, 40, 63):
+        del items[f"vid{index:05d}"]
+    items["vid00002"] = apify_item(2, title="Edited title", viewCount=5)
+    items["vid00030"] = apify_item(30, channelName="Neural Jazz", channelId="UCneuraljazz", hashtags=["#new"])
+    items["vid00050"] = apify_item(50, date="2024-03-04T12:00:00.000Z", likes=apify_item(9)["likes"])
+    items["vid00070"] = apify_item(70, text="Edited description", duration=apify_item(10)["duration"])
+    ordered = list(items.values())
+    # Added tracks tie existing ones on every sort key but views
+    ties = [
+        apify_item(90, likes=apify_item(3)["likes"], commentsCount=3, date=apify_item(3)["date"]),
+        apify_item(91, duration=apify_item(4)["duration"], title=apify_item(4)["title"].upper()),
+        apify_item(92, channelName="New Channel", channelId="UCnew", numberOfSubscribers=99),
+        apify_item(93, commentsCount=apify_item(1)["commentsCount"]),
+    ]
+    ordered[10:10] = ties[:2]
+    ordered[:0] = ties[2:3]
+    ordered.append(ties[3])
+    if move:
+        # A kept track moves to the end
+        ordered.append(ordered.pop(20))
+    return ordered
+
+
+def derived_and_built(previous_items, items):
+    previous = CatalogSnapshot.build(1, track_records(previous_items))
+    # Orderings computed on the previous snapshot are merged rather than rebuilt
+    for sort_key in SORT_KEYS:
+        previous.ordering(sort_key)
+    tracks = track_records(items)
+    derived = CatalogSnapshot.derive(previous, 2, tracks, CatalogDelta.between(previous, tracks))
+    return previous, derived, CatalogSnapshot.build(2, track_records(items))
+
+
+def ids(tracks):
+    return [track['video_id'] for track in tracks]
+
+
+def assert_same_catalog(derived, built):
+    assert [track.to_dict() for track in derived.tracks] == [track.to_dict() for track in built.tracks]
+    assert {video_id: track.to_dict() for video_id, track in derived.by_id.items()} == \
+        {video_id: track.to_dict() for video_id, track in built.by_id.items()}
+    for groups, expected in ((derived.by_channel_id, built.by_channel_id),
+                             (derived.by_channel_name, built.by_channel_name)):
+        assert {key: ids(tracks) for key, tracks in groups.items()} == \
+            {key: ids(tracks) for key, tracks in expected.items()}
+    for sort_key in SORT_KEYS:
+        ordered, ranks = derived.ordering(sort_key)
+        expected_order, expected_ranks = built.ordering(sort_key)
+        assert ids(ordered) == ids(expected_order), sort_key
+        assert ranks == expected_ranks, sort_key
+    for search in SEARCHES:
+        assert derived.search_index.search(search) == built.search_index.search(search), search
+    assert derived.aggregates.stats() == built.aggregates.stats()
+    assert derived.aggregates.channel_summaries() == built.aggregates.channel_summaries()
+    assert derived.facets().facets(None, None, False, 50) == built.facets().facets(None, None, False, 50)
+
+
+@pytest.mark.parametrize("move", [False, True], ids=["in-place", "moved"])
+def test_derive_matches_build(move):
+    previous, derived, built = derived_and_built(base_items(), edited_items(move))
+    assert_same_catalog(derived, built)
+    # Untouched tracks are shared with the previous version
+    assert derived.by_id["vid00001"] is previous.by_id["vid00001"]
+
+
+def test_derive_matches_build_across_versions():
+    items = edited_items()
+    _, derived, _ = derived_and_built(base_items(), items)
+    for sort_key in SORT_KEYS:
+        derived.ordering(sort_key)
+    again = [dict(item, viewCount=position) if position % 9 == 0 else item
+             for position, item in enumerate(items)][::-1]
+    tracks = track_records(again)
+    derived = CatalogSnapshot.derive(derived, 3, tracks, CatalogDelta.between(derived, tracks))
+    assert_same_catalog(derived, CatalogSnapshot.build(3, track_records(again)))
+
+
+def test_derive_matches_build_when_the_search_index_is_rebuilt():
+    # Removing more than MAX_DELETED_FRACTION of the documents rebuilds the index
+    _, derived, built = derived_and_built(base_items(), base_items()[50:] + [apify_item(95)])
+    assert_same_catalog(derived, built)
+
+
+@pytest.mark.parametrize("items", [base_items, lambda: base_items()[::-1]])
+def test_empty_delta(items):
+    # Only the order changed, or nothing at all
+    _, derived, built = derived_and_built(base_items(), items())
+    assert_same_catalog(derived, built)
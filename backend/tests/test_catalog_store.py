@@ -0,0 +1,122 @@
+import os
+import struct
+
+import pytest
+
+import services.catalog_store as catalog_store
+from conftest import apify_item, track_records
+from services.catalog import SORT_KEYS, CatalogSnapshot
+from services.catalog_store import CatalogFormatError, open_catalog, write_catalog
+from services.response_cache import PreparedResponse
+
+SEARCHES = ["lofi", "chill beats", "syn", "#jazz", "lab", "nomatch"]
+
+
+@pytest.fixture
+def snapshot():
+    items = [apify_item(index) for index in range(60)]
+    # Non-ASCII text, an empty description and no hashtags
+    items.append(apify_item(60, title="Café naïve — 夜のジャズ", text="", hashtags=[]))
+    snapshot = CatalogSnapshot.build(7, track_records(items))
+    snapshot.responses['stats'] = PreparedResponse(7, snapshot.aggregates.stats())
+    return snapshot
+
+
+@pytest.fixture
+def catalog_file(snapshot, tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    size = write_catalog(snapshot, path, {'source': [1, 2, "abc"], 'changes': {'added': 61}})
+    assert size == os.path.getsize(path)
+    return path
+
+
+def ids(tracks):
+    return [track['video_id'] for track in tracks]
+
+
+def test_round_trip(snapshot, catalog_file):
+    mapped = open_catalog(catalog_file)
+    assert mapped.version == 7 and len(mapped) == 61
+    assert mapped.catalog.metadata == {'source': [1, 2, "abc"], 'changes': {'added': 61}}
+    assert [track.to_dict() for track in mapped.tracks] == [track.to_dict() for track in snapshot.tracks]
+
+    assert mapped.by_id['vid00060'].to_dict() == snapshot.by_id['vid00060'].to_dict()
+    assert mapped.by_id['vid00060']['hashtags'] == ()
+    assert 'missing' not in mapped.by_id
+    for groups, expected in ((mapped.by_channel_id, snapshot.by_channel_id),
+                             (mapped.by_channel_name, snapshot.by_channel_name)):
+        assert sorted(groups) == sorted(expected)
+        assert all(ids(groups[key]) == ids(expected[key]) for key in expected)
+
+    for sort_key in SORT_KEYS:
+        ordered, ranks = mapped.ordering(sort_key)
+        expected_order, expected_ranks = snapshot.ordering(sort_key)
+        assert ids(ordered) == ids(expected_order)
+        assert {video_id: ranks[video_id] for video_id in expected_ranks} == expected_ranks
+
+    for search in SEARCHES:
+        assert (mapped.search_index.video_ids(mapped.search_index.rank(search))
+                == snapshot.search_index.video_ids(snapshot.search_index.rank(search)))
+
+    assert mapped.aggregates.stats() == snapshot.aggregates.stats()
+    assert mapped.aggregates.channel_summaries() == snapshot.aggregates.channel_summaries()
+    assert mapped.responses['stats'].etag == snapshot.responses['stats'].etag
+    assert bytes(mapped.responses['stats'].body) == bytes(snapshot.responses['stats'].body)
+
+
+def test_lookups_switch_to_a_position_map(snapshot, catalog_file, monkeypatch):
+    monkeypatch.setattr(catalog_store, "POSITION_MAP_THRESHOLD", 3)
+    mapped = open_catalog(catalog_file)
+    for track in snapshot.tracks:
+        assert mapped.by_id[track.video_id].video_id == track.video_id
+    assert mapped.catalog._positions is not None
+    assert 'missing' not in mapped.by_id
+
+
+def corrupt_trailer(path):
+    with open(path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"NOTMAGIC")
+
+
+def corrupt_directory(path):
+    with open(path, "r+b") as f:
+        f.seek(-catalog_store._TRAILER.size, os.SEEK_END)
+        offset, length, _ = catalog_store._TRAILER.unpack(f.read(catalog_store._TRAILER.size))
+        f.seek(offset)
+        f.write(b"{" * length)
+
+
+def truncate(path):
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+
+def bump_format(path):
+    with open(path, "r+b") as f:
+        f.write(struct.pack("<8sI", catalog_store.MAGIC, catalog_store.FORMAT_VERSION + 1))
+
+
+@pytest.mark.parametrize("damage", [truncate, corrupt_trailer, corrupt_directory, bump_format,
+                                    lambda path: open(path, "wb").close()])
+def test_damaged_files_are_rejected(catalog_file, damage):
+    damage(catalog_file)
+    with pytest.raises(ValueError):
+        open_catalog(catalog_file)
+
+
+def test_other_format_versions_are_rejected(catalog_file, monkeypatch):
+    monkeypatch.setattr(catalog_store, "FORMAT_VERSION", catalog_store.FORMAT_VERSION + 1)
+    with pytest.raises(CatalogFormatError, match="format"):
+        open_catalog(catalog_file)
+
+
+def test_failed_write_leaves_the_previous_file(snapshot, catalog_file, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(catalog_store, "_write_search_index", fail)
+    with pytest.raises(OSError):
+        write_catalog(CatalogSnapshot.build(8, []), catalog_file)
+    assert open_catalog(catalog_file).version == 7
+    assert os.listdir(os.path.dirname(catalog_file)) == ["catalog.bin"]
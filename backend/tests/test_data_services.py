@@ -0,0 +1,374 @@
+import json
+import os
+import time
+
+import pytest
+
+from conftest import apify_item, load_service, write_setlist
+import services.apify_data_service as apify_data_service
+import services.sqlite_data_service as sqlite_data_service
+from services.apify_data_service import ApifyDataService, ServiceUnavailableError
+from services.catalog import SORT_KEYS
+from services.catalog_store import MappedCatalogSnapshot, open_catalog
+from services.setlist_reader import SetlistReader
+from services.sqlite_data_service import SQLiteConnectionPool, SQLiteDataService
+
+
+@pytest.fixture(params=[ApifyDataService, SQLiteDataService], ids=["memory", "sqlite"])
+def service(request, setlist_file, tmp_path, monkeypatch):
+    service = load_service(request.param, setlist_file, tmp_path, monkeypatch)
+    yield service
+    service.shutdown()
+
+
+@pytest.fixture
+def tracks(setlist_file):
+    """The fixture setlist formatted as the API returns it, in file order"""
+    formatter = ApifyDataService()
+    try:
+        with open(setlist_file, "r", encoding="utf-8") as f:
+            return [formatter._format_track(item) for item in json.load(f)]
+    finally:
+        formatter.shutdown()
+
+
+def cached_service(setlist_file, cache_file, settle_delay=0.0):
+    """A memory service that keeps its catalog cache in cache_file"""
+    service = ApifyDataService()
+    service.data_file = str(setlist_file)
+    service._cache_file = str(cache_file)
+    service._cache_writer.settle_delay = settle_delay
+    return service
+
+
+def wait_for_cache_writes(service, runs, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = service._cache_writer.stats()
+        if stats["runs"] >= runs and not stats["pending"] and not stats["running"]:
+            return stats
+        assert time.monotonic() < deadline, stats
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def parsed_files(monkeypatch):
+    """Paths of the setlists the data services parse from now on"""
+    parsed = []
+
+    class CountingReader(SetlistReader):
+        def __init__(self, path, *args, **kwargs):
+            parsed.append(path)
+            super().__init__(path, *args, **kwargs)
+
+    monkeypatch.setattr(apify_data_service, "SetlistReader", CountingReader)
+    return parsed
+
+
+def write_cache(setlist_file, cache_file):
+    """Save the catalog cache of setlist_file, as a previous run would; returns its version"""
+    service = cached_service(setlist_file, cache_file)
+    try:
+        service._load_data()
+        wait_for_cache_writes(service, 1)
+        return service._current.version
+    finally:
+        service.shutdown()
+
+
+def started(service):
+    service.start()
+    assert service.wait_until_ready(10)
+    return service
+
+
+def ids(tracks):
+    return [track["video_id"] for track in tracks]
+
+
+def page_through(service, limit, **query):
+    """Every track of a query, fetched limit at a time by following next_cursor"""
+    collected, cursor = [], None
+    while True:
+        page = service.query_tracks(limit=limit, cursor=cursor, **query)
+        assert len(page["tracks"]) <= limit
+        collected.extend(page["tracks"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            assert len(collected) == page["total"]
+            return collected
+
+
+def test_stats(service, tracks):
+    stats = service.get_stats()
+    views = sum(track["view_count"] for track in tracks)
+    assert stats["total_tracks"] == len(tracks)
+    assert stats["total_views"] == views
+    assert stats["total_likes"] == sum(track["likes"] for track in tracks)
+    assert stats["total_comments"] == sum(track["comments_count"] for track in tracks)
+    assert stats["unique_channels"] == len({track["channel_id"] for track in tracks})
+    assert stats["avg_views_per_track"] == views // len(tracks)
+    assert stats["latest_upload"] == max(track["upload_date"] for track in tracks)
+    assert json.loads(service.get_prepared_response("stats").body) == stats
+
+
+def test_prepared_responses(service):
+    for name in service.prepared_responses:
+        assert service.get_prepared_response(name).version == service.query_tracks(limit=1)["version"]
+    if isinstance(service, SQLiteDataService):
+        assert "tracks" not in service.prepared_responses
+        with pytest.raises(KeyError):
+            service.get_prepared_response("tracks")
+
+
+def test_channels(service, tracks):
+    channels = service.get_channels_summary()
+    assert [channel["channel_id"] for channel in channels] == [
+        "UClofilab", "UCsynthforge", "UCneuraljazz", "UCambientdrift"]
+    for channel in channels:
+        own = [track for track in tracks if track["channel_id"] == channel["channel_id"]]
+        assert channel["video_count"] == len(own)
+        assert channel["total_views"] == sum(track["view_count"] for track in own)
+        assert channel["latest_upload"] == max(track["upload_date"] for track in own)
+    assert json.loads(service.get_prepared_response("channels").body) == channels
+
+
+def test_filtered_queries(service, tracks):
+    result = service.query_tracks(channel="  lofi LAB ")
+    assert ids(result["tracks"]) == ids(track for track in tracks if track["channel_title"] == "Lofi Lab")
+    assert result["total"] == len(result["tracks"])
+
+    result = service.query_tracks(channel="Synth Forge", has_hashtags=True)
+    assert ids(result["tracks"]) == ids(track for track in tracks
+                                        if track["channel_title"] == "Synth Forge" and track["hashtags"])
+    assert service.query_tracks(channel="No Such Channel")["total"] == 0
+
+
+@pytest.mark.parametrize("sort", sorted(SORT_KEYS))
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_sorted_queries(service, tracks, sort, order):
+    # Ties keep file order ascending and reverse it descending, in both backends
+    expected = sorted(tracks, key=SORT_KEYS[sort])
+    if order == "desc":
+        expected.reverse()
+    assert ids(service.query_tracks(sort=sort, order=order)["tracks"]) == ids(expected)
+
+
+def test_facets(service, setlist_file, tmp_path, monkeypatch):
+    reference = load_service(ApifyDataService, setlist_file, tmp_path, monkeypatch)
+    try:
+        for query in ({}, {"search": "lofi"}, {"channel": "Neural Jazz", "has_hashtags": True},
+                      {"search": "jazz cafe", "channel": "Lofi Lab"}):
+            facets = service.get_facets(**query)
+            expected = reference.get_facets(**query)
+            facets.pop("version"), expected.pop("version")
+            assert facets == expected
+            assert facets["total"] == service.query_tracks(**query)["total"]
+    finally:
+        reference.shutdown()
+
+
+@pytest.mark.parametrize("search", ["lofi", "LOFI chill", "syn", "lab", "#jazz", "ambient rain", "nomatch"])
+def test_search_matches_the_same_tracks(service, setlist_file, tmp_path, monkeypatch, search):
+    reference = load_service(ApifyDataService, setlist_file, tmp_path, monkeypatch)
+    try:
+        expected = set(ids(reference.search_tracks(search)))
+    finally:
+        reference.shutdown()
+    # Rankings may differ between the backends; the matches may not
+    assert set(ids(service.search_tracks(search))) == expected
+    assert set(ids(service.query_tracks(search=search)["tracks"])) == expected
+    assert (search == "nomatch") == (not expected)
+
+
+@pytest.mark.parametrize("query", [{}, {"search": "lofi"}, {"sort": "views"},
+                                   {"search": "chill", "sort": "date", "order": "asc"},
+                                   {"channel": "Lofi Lab", "has_hashtags": True}])
+def test_cursor_paging_returns_every_track_once(service, query):
+    everything = service.query_tracks(**query)["tracks"]
+    assert ids(page_through(service, 7, **query)) == ids(everything)
+
+
+def test_cursor_is_tied_to_its_query(service):
+    page = service.query_tracks(sort="views", limit=5)
+    with pytest.raises(ValueError):
+        service.query_tracks(sort="likes", limit=5, cursor=page["next_cursor"])
+
+
+def test_repeated_queries_hit_the_query_cache(service):
+    query = {"search": "lofi chill", "sort": "views"}
+    first = service.query_tracks(**query)
+    hits = service._query_cache.stats()["hits"]
+    # Same terms in another order and case, paged and streamed
+    again = service.query_tracks(search="Chill LOFI", sort="views")
+    assert again["tracks"] == first["tracks"] and again["total"] == first["total"]
+    assert page_through(service, 3, **query) == first["tracks"]
+    streamed = service.query_tracks(limit=4, stream=True, fields=["video_id", "title"], **query)["tracks"]
+    assert list(streamed) == [{"video_id": track["video_id"], "title": track["title"]}
+                              for track in first["tracks"][:4]]
+    assert service._query_cache.stats()["hits"] > hits
+
+
+def test_tracks_batch(service):
+    requested = ["vid00042", "missing1", "vid00003", "vid00042", "vid00017", "missing2"]
+    batch = service.get_tracks_batch(requested)
+    # Request order, duplicates once
+    assert batch["tracks"] == [service.get_track(video_id) for video_id in ("vid00042", "vid00003", "vid00017")]
+    assert batch["missing"] == ["missing1", "missing2"]
+    assert batch["version"] == service.query_tracks(limit=1)["version"]
+
+    projected = service.get_tracks_batch(requested, ("title", "hashtags", "view_count"))["tracks"]
+    assert projected == [{"title": track["title"], "hashtags": track["hashtags"], "view_count": track["view_count"]}
+                         for track in batch["tracks"]]
+    assert service.get_tracks_batch([]) == {"tracks": [], "missing": [], "version": batch["version"]}
+
+
+def test_tracks_batch_size_limit(service):
+    video_ids = [f"vid{index:05d}" for index in range(apify_data_service.MAX_TRACK_BATCH_SIZE)]
+    batch = service.get_tracks_batch(video_ids, ("video_id",))
+    assert ids(batch["tracks"]) == video_ids[:60] and batch["missing"] == video_ids[60:]
+    with pytest.raises(ValueError, match="At most 500"):
+        service.get_tracks_batch(video_ids + ["vid99999"])
+
+
+@pytest.mark.parametrize("video_id", ["vid00000", "vid00007", "vid00033"])
+def test_similar_tracks(service, setlist_file, tmp_path, monkeypatch, video_id):
+    reference = load_service(ApifyDataService, setlist_file, tmp_path, monkeypatch)
+    try:
+        expected = reference.get_similar_tracks(video_id, 50)
+    finally:
+        reference.shutdown()
+    similar = service.get_similar_tracks(video_id, 50)
+    assert similar.pop("version") == expected.pop("version")
+    assert similar == expected
+
+    tracks = similar["tracks"]
+    assert 10 < len(tracks) <= 50 and video_id not in ids(tracks)
+    assert len(set(ids(tracks))) == len(tracks)
+    scores = [track["similarity"] for track in tracks]
+    assert scores == sorted(scores, reverse=True) and all(0 < score <= 1 for score in scores)
+    for limit in (1, 5, 10):
+        assert service.get_similar_tracks(video_id, limit)["tracks"] == tracks[:limit]
+    assert service.get_similar_tracks("missing") is None
+
+
+def test_similar_tracks_skip_removed_tracks(service, setlist_file):
+    best = ids(service.get_similar_tracks("vid00007", 5)["tracks"])
+    write_setlist(setlist_file, [apify_item(index) for index in range(60) if f"vid{index:05d}" != best[0]])
+    assert service.force_reload()["success"]
+    # The previous index may still answer while the new one is built
+    tracks = service.get_similar_tracks("vid00007", 5)["tracks"]
+    assert best[0] not in ids(tracks) and len(tracks) == 5
+
+
+def test_pool_reports_unavailable_when_every_connection_stays_busy(tmp_path):
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.sqlite3"), 1, timeout=0.05)
+    try:
+        with pool.connection():
+            with pytest.raises(ServiceUnavailableError):
+                with pool.connection():
+                    pass
+        # The connection is handed out again once it is returned
+        with pool.connection() as conn:
+            assert conn.execute("SELECT 1").fetchone() == (1,)
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize("query", [{}, {"sort": "views"}, {"sort": "title", "order": "asc"},
+                                   {"search": "lofi"}, {"channel": "Lofi Lab", "sort": "date"}])
+def test_streams_release_their_connection_between_pages(setlist_file, tmp_path, monkeypatch, query):
+    monkeypatch.setattr(sqlite_data_service, "STREAM_PAGE_SIZE", 7)
+    service = load_service(SQLiteDataService, setlist_file, tmp_path, monkeypatch)
+    try:
+        expected = service.query_tracks(**query)["tracks"]
+        pool = service._readers
+        tracks = service.query_tracks(stream=True, **query)["tracks"]
+        streamed = [next(tracks)]
+        # A client still reading the stream holds no connection
+        assert pool._idle.qsize() == pool._created
+        streamed.extend(tracks)
+        assert streamed == expected
+
+        # Streamed pages continue after an offset (a cursor) too
+        first = service.query_tracks(limit=10, **query)
+        rest = service.query_tracks(cursor=first["next_cursor"], stream=True, **query)["tracks"]
+        assert list(rest) == expected[10:]
+    finally:
+        service.shutdown()
+
+
+def test_reloads_write_the_catalog_cache_in_the_background(setlist_file, tmp_path):
+    cache_file = tmp_path / "AI_Setlist.catalog"
+    service = cached_service(setlist_file, cache_file, settle_delay=0.3)
+    try:
+        service._load_data()
+        # The load returned without writing the cache
+        assert not cache_file.exists()
+        for likes in range(3):
+            write_setlist(setlist_file, [apify_item(index, likes=likes) for index in range(60)])
+            service._load_data()
+        # The burst of reloads is written once, at its last version
+        assert wait_for_cache_writes(service, 1)["outcomes"] == {"written": 1}
+        assert open_catalog(str(cache_file)).version == service._current.version == 4
+
+        # The cache already holds this version
+        service._cache_writer.request()
+        assert wait_for_cache_writes(service, 2)["outcomes"] == {"written": 1, "unchanged": 1}
+    finally:
+        service.shutdown()
+
+
+def test_start_from_the_catalog_cache(setlist_file, tmp_path, monkeypatch, parsed_files):
+    cache_file = tmp_path / "AI_Setlist.catalog"
+    version = write_cache(setlist_file, cache_file)
+    reference = load_service(ApifyDataService, setlist_file, tmp_path, monkeypatch)
+    # Rewritten with the same content: the cache still matches it by hash
+    os.utime(setlist_file, ns=(time.time_ns(), time.time_ns()))
+    del parsed_files[:]
+    service = cached_service(setlist_file, cache_file)
+    try:
+        readiness = started(service).get_readiness()
+        # Ready without the setlist ever being parsed
+        assert parsed_files == []
+        assert readiness["ready"] and readiness["loaded_from"] == "cache"
+        assert readiness["version"] == version and readiness["tracks"] == 60
+        assert isinstance(service._current, MappedCatalogSnapshot)
+
+        assert service.get_all_tracks() == reference.get_all_tracks()
+        assert service.get_stats() == reference.get_stats()
+        assert service.get_channels_summary() == reference.get_channels_summary()
+        for query in ({"search": "lofi chill"}, {"sort": "views"}, {"channel": "Synth Forge", "sort": "title"}):
+            assert service.query_tracks(**query)["tracks"] == reference.query_tracks(**query)["tracks"]
+    finally:
+        service.shutdown()
+        reference.shutdown()
+
+
+@pytest.mark.parametrize("stale", ["edited", "corrupt"])
+def test_stale_catalog_cache_falls_back_to_the_setlist(setlist_file, tmp_path, monkeypatch, parsed_files, stale):
+    cache_file = tmp_path / "AI_Setlist.catalog"
+    version = write_cache(setlist_file, cache_file)
+    if stale == "edited":
+        write_setlist(setlist_file, [apify_item(index, title=f"Edited {index}") for index in range(50)])
+    else:
+        with open(cache_file, "r+b") as f:
+            f.truncate(os.path.getsize(cache_file) // 2)
+    reference = load_service(ApifyDataService, setlist_file, tmp_path, monkeypatch)
+    del parsed_files[:]
+    service = cached_service(setlist_file, cache_file)
+    try:
+        readiness = started(service).get_readiness()
+        assert parsed_files == [str(setlist_file)]
+        assert readiness["ready"] and readiness["loaded_from"] == "json"
+        assert service.get_all_tracks() == reference.get_all_tracks()
+        if stale == "edited":
+            # Versions keep counting up from the cached one
+            assert readiness["version"] == version + 1
+
+        # The cache is brought up to date for the next start
+        wait_for_cache_writes(service, 1)
+        assert open_catalog(str(cache_file)).version == readiness["version"]
+    finally:
+        service.shutdown()
+        reference.shutdown()
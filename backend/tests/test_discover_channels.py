@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+import discover_channels
+from discover_channels import CHANNEL_TTL, CHANNELS_PER_REQUEST, SEARCH_TTL, QuotaTracker, ResponseCache
+
+# Channels every search term finds; more than two channels.list batches' worth
+CHANNELS_PER_TERM = 40
+TERMS = ["ai pop", "ai rock", "ai jazz"]
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self._response = response
+
+    def execute(self):
+        return self._response
+
+
+class FakeResource:
+    def __init__(self, api, name):
+        self._api = api
+        self._name = name
+
+    def list(self, **params):
+        return FakeRequest(self._api.respond(f"{self._name}.list", params))
+
+
+class FakeYouTube:
+    """
+    Stand-in for the googleapiclient YouTube client. Each term finds its
+    own CHANNELS_PER_TERM channels and one playlist. Every call is recorded.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def build(self, service, version, developerKey=None):
+        assert (service, version) == ("youtube", "v3")
+        return self
+
+    def search(self):
+        return FakeResource(self, "search")
+
+    def channels(self):
+        return FakeResource(self, "channels")
+
+    def respond(self, method, params):
+        with self._lock:
+            self.calls.append((method, params))
+        if method == "channels.list":
+            return {"items": [{
+                "id": channel_id,
+                "snippet": {"title": f"Channel {channel_id}"},
+                "statistics": {"subscriberCount": "1000", "videoCount": "25"},
+            } for channel_id in params["id"].split(",")]}
+        term = TERMS.index(params["q"])
+        if params["type"] == "channel":
+            return {"items": [{"snippet": {"title": f"Channel {term}-{i}", "channelId": f"UC{term}-{i}"}}
+                              for i in range(CHANNELS_PER_TERM)]}
+        return {"items": [{
+            "id": {"playlistId": f"PL{term}"},
+            "snippet": {"title": f"Playlist {term}", "channelId": f"UC{term}-0", "channelTitle": f"Channel {term}-0",
+                        "description": "", "thumbnails": {"high": {"url": f"https://i.ytimg.com/{term}.jpg"}}},
+        }]}
+
+    def count(self, method):
+        return sum(1 for called, _ in self.calls if called == method)
+
+
+@pytest.fixture
+def data_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(discover_channels, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(discover_channels, "CHANNELS_FILE", str(tmp_path / "channels.json"))
+    monkeypatch.setattr(discover_channels, "PLAYLISTS_FILE", str(tmp_path / "playlists.json"))
+    return tmp_path
+
+
+def run(api, cache, quota=None):
+    return discover_channels.main(build_client=api.build, terms=TERMS, workers=2, cache=cache,
+                                  quota=quota or QuotaTracker(budget=10000))
+
+
+def test_looks_up_channels_in_batches_of_50(data_files):
+    api = FakeYouTube()
+    result = run(api, ResponseCache(str(data_files / "cache.json")))
+
+    batches = [params["id"].split(",") for method, params in api.calls if method == "channels.list"]
+    found = [f"UC{term}-{i}" for term in range(len(TERMS)) for i in range(CHANNELS_PER_TERM)]
+    assert [len(batch) for batch in batches] == [CHANNELS_PER_REQUEST, CHANNELS_PER_REQUEST, 20]
+    assert sorted(sum(batches, [])) == sorted(found)
+    assert all(params["maxResults"] == 50 for method, params in api.calls if method == "search.list")
+    assert result == {"channels": len(found), "playlists": len(TERMS),
+                      "quota_spent": 100 * 2 * len(TERMS) + len(batches)}
+
+
+def test_stops_calling_the_api_at_the_quota_budget(data_files):
+    api = FakeYouTube()
+    quota = QuotaTracker(budget=201)
+    result = run(api, ResponseCache(str(data_files / "cache.json")), quota)
+
+    # Two searches use 200 units, leaving one for a single channels.list batch
+    assert api.count("search.list") == 2 and api.count("channels.list") == 1
+    assert quota.spent == result["quota_spent"] == 201
+    assert (data_files / "channels.json").exists()
+
+
+def test_reuses_cached_responses_until_they_expire(data_files, monkeypatch):
+    cache_path = str(data_files / "cache.json")
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(discover_channels.time, "time", lambda: now[0])
+
+    run(FakeYouTube(), ResponseCache(cache_path))
+
+    # A fresh cache loaded from disk answers everything
+    api = FakeYouTube()
+    quota = QuotaTracker()
+    run(api, ResponseCache(cache_path), quota)
+    assert api.calls == [] and quota.spent == 0 and quota.cache_hits > 0
+
+    # Channel details expire first; searches are still fresh
+    now[0] += CHANNEL_TTL + 1
+    api = FakeYouTube()
+    run(api, ResponseCache(cache_path))
+    assert api.count("search.list") == 0 and api.count("channels.list") == 3
+
+    now[0] += SEARCH_TTL
+    api = FakeYouTube()
+    run(api, ResponseCache(cache_path))
+    assert api.count("search.list") == 2 * len(TERMS)
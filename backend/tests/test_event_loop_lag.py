@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+import services.apify_data_service as apify_data_service
+from conftest import apify_item, asgi_client, serve, write_setlist
+from services.apify_data_service import ApifyDataService
+
+# Large enough that a reload run on the event loop would stall it for far
+# longer than MAX_LAG
+TRACKS = 20000
+
+# Ticker period, and the longest a tick may be late while the reload runs
+TICK = 0.001
+MAX_LAG = 0.05
+
+# Longest a request may take while the reload runs
+MAX_REQUEST_LATENCY = 0.1
+
+# Routes that used to read the catalog on the event loop
+PATHS = ["/api/tracks/stats", "/api/tracks/vid00001", "/api/tracks/random", "/api/tracks/ready",
+         "/api/tracks/watcher/status", "/api/channels"]
+
+
+@pytest.fixture
+def reloading_service(tmp_path, monkeypatch):
+    """A started service of TRACKS tracks whose setlist has just changed every track, serving the API routes"""
+    data_file = tmp_path / "AI_Setlist.json"
+    write_setlist(data_file, [apify_item(index) for index in range(TRACKS)])
+    service = ApifyDataService()
+    service.data_file = str(data_file)
+    service._cache_file = None
+    # Started as the app starts it, without a watcher racing the forced reload
+    monkeypatch.setattr(apify_data_service, "WATCHDOG_AVAILABLE", False)
+    try:
+        service.start()
+        assert service.wait_until_ready(30)
+        # Change every track, so the reload builds a whole new snapshot
+        write_setlist(data_file, [apify_item(index, title=f"Remastered mix {index}") for index in range(TRACKS)])
+        serve(service, monkeypatch)
+        yield service
+    finally:
+        service.shutdown()
+
+
+async def reload_while(service, during):
+    """
+    Force a reload while a 1 ms ticker and during() run on the event loop;
+    returns the reload result, its duration, the ticker's lags and whatever
+    during() returned
+    """
+    loop = asyncio.get_running_loop()
+    lags = []
+    reloading = True
+
+    async def ticker():
+        while reloading:
+            started = loop.time()
+            await asyncio.sleep(TICK)
+            lags.append(loop.time() - started - TICK)
+
+    async def until_reloaded():
+        outcomes = []
+        while reloading:
+            outcomes.append(await during())
+        return outcomes
+
+    tasks = [asyncio.create_task(ticker()), asyncio.create_task(until_reloaded())]
+    started = time.perf_counter()
+    result = await service.force_reload_async()
+    duration = time.perf_counter() - started
+    reloading = False
+    _, outcomes = await asyncio.gather(*tasks)
+    return result, duration, lags, outcomes
+
+
+def assert_reloaded(result, duration, lags):
+    assert result['success'] and result['changes']['updated'] == TRACKS
+    assert lags, "the ticker never ran during the reload"
+    assert max(lags) < MAX_LAG, (f"event loop stalled for {max(lags) * 1000:.0f} ms "
+                                 f"during a {duration * 1000:.0f} ms reload")
+
+
+def test_forced_reload_does_not_stall_the_event_loop(reloading_service):
+    result, duration, lags, _ = asyncio.run(reload_while(reloading_service, lambda: asyncio.sleep(TICK)))
+    assert_reloaded(result, duration, lags)
+
+
+def test_requests_are_answered_during_a_reload(reloading_service):
+    async def scenario():
+        async with asgi_client() as client:
+            async def request_each():
+                timings = []
+                for path in PATHS:
+                    started = time.perf_counter()
+                    response = await client.get(path)
+                    timings.append((path, response.status_code, time.perf_counter() - started))
+                return timings
+
+            return await reload_while(reloading_service, request_each)
+
+    result, duration, lags, outcomes = asyncio.run(scenario())
+    assert_reloaded(result, duration, lags)
+    timings = [timing for timings in outcomes for timing in timings]
+    assert len(timings) >= len(PATHS), "no requests completed during the reload"
+    assert {status for _, status, _ in timings} == {200}
+    path, _, latency = max(timings, key=lambda timing: timing[2])
+    assert latency < MAX_REQUEST_LATENCY, (f"GET {path} took {latency * 1000:.0f} ms "
+                                           f"during a {duration * 1000:.0f} ms reload")
@@ -0,0 +1,163 @@
+import os
+
+import anyio
+import pytest
+from starlette.requests import Request
+
+import routes.file_stream as file_stream
+from routes.file_stream import CHUNK_SIZE, ZEROCOPY_EXTENSION, FileRangeResponse, StreamLimiter, file_range_response
+
+SIZE = CHUNK_SIZE * 40
+SCOPE = {"type": "http", "method": "GET", "extensions": {}}
+
+
+def stream(tmp_path, monkeypatch, disconnect_after=None):
+    """Run a FileRangeResponse for a whole file; returns (body sent, preads, limiter)"""
+    path = tmp_path / "track.mp3"
+    path.write_bytes(os.urandom(SIZE))
+    preads = []
+    real_pread = os.pread
+    monkeypatch.setattr(file_stream.os, "pread", lambda *args: preads.append(args) or real_pread(*args))
+
+    limiter = StreamLimiter(limit=1)
+    assert limiter.acquire("client")
+    response = FileRangeResponse(str(path), 0, SIZE - 1, 200, {}, "audio/mpeg",
+                                 on_close=lambda: limiter.release("client"))
+    body = []
+
+    async def run():
+        disconnected = anyio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # Like uvicorn, messages sent after the client left are dropped
+            if disconnected.is_set():
+                return
+            body.append(message.get("body", b""))
+            if disconnect_after is not None and len(body) > disconnect_after:
+                disconnected.set()
+
+        await response(SCOPE, receive, send)
+
+    anyio.run(run)
+    return b"".join(body), preads, limiter, path
+
+
+def test_sends_the_whole_range(tmp_path, monkeypatch):
+    body, preads, limiter, path = stream(tmp_path, monkeypatch)
+    assert body == path.read_bytes()
+    assert len(preads) == SIZE // CHUNK_SIZE
+    assert limiter.acquire("client")
+
+
+def test_stops_reading_and_frees_the_slot_when_the_client_disconnects(tmp_path, monkeypatch):
+    body, preads, limiter, _ = stream(tmp_path, monkeypatch, disconnect_after=3)
+    assert len(preads) <= 4
+    assert limiter.acquire("client")
+
+
+def test_hands_the_file_to_servers_offering_zerocopy(tmp_path, monkeypatch):
+    path = tmp_path / "track.mp3"
+    path.write_bytes(os.urandom(1000))
+    monkeypatch.setattr(file_stream.os, "pread", lambda *args: pytest.fail("read the file itself"))
+    messages = []
+
+    async def receive():
+        await anyio.sleep_forever()
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            message = dict(message, file=message["file"].read())
+        messages.append(message)
+
+    response = FileRangeResponse(str(path), 100, 599, 206, {}, "audio/mpeg")
+    anyio.run(response, dict(SCOPE, extensions={ZEROCOPY_EXTENSION: {}}), receive, send)
+    assert [message["type"] for message in messages] == ["http.response.start", ZEROCOPY_EXTENSION]
+    assert (messages[1]["offset"], messages[1]["count"]) == (100, 500)
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    path = tmp_path / "track.mp3"
+    path.write_bytes(os.urandom(5000))
+    return path
+
+
+def respond(path, method="GET", **headers):
+    """file_range_response() for a request with headers; returns (status, headers, body, closed)"""
+    scope = dict(SCOPE, method=method, headers=[(name.replace("_", "-").lower().encode(), value.encode())
+                                                for name, value in headers.items()])
+    closed = []
+    response = file_range_response(Request(scope), str(path), on_close=lambda: closed.append(True))
+    messages = []
+
+    async def run():
+        async def receive():
+            await anyio.sleep_forever()
+
+        async def send(message):
+            messages.append(message)
+
+        await response(scope, receive, send)
+
+    anyio.run(run)
+    start = messages[0]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}, body, closed
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=100-199", 100, 199),
+    ("bytes=4000-", 4000, 4999),
+    ("bytes=4000-99999", 4000, 4999),
+    ("bytes=-500", 4500, 4999),
+    ("bytes=-99999", 0, 4999),
+])
+def test_single_ranges(audio_file, header, start, end):
+    status, headers, body, closed = respond(audio_file, range=header)
+    assert status == 206
+    assert headers["content-range"] == f"bytes {start}-{end}/5000"
+    assert headers["content-length"] == str(end - start + 1)
+    assert body == audio_file.read_bytes()[start:end + 1]
+    assert closed == [True]
+
+
+@pytest.mark.parametrize("header", ["bytes=5000-", "bytes=5000-5100", "bytes=-0", "bytes=300-200"])
+def test_unsatisfiable_ranges(audio_file, header):
+    status, headers, body, closed = respond(audio_file, range=header)
+    assert status == 416
+    assert headers["content-range"] == "bytes */5000"
+    assert body == b"" and closed == [True]
+
+
+@pytest.mark.parametrize("header", [None, "bytes=0-10,20-30", "bytes=abc-", "items=0-10"])
+def test_no_or_unsupported_range_sends_the_whole_file(audio_file, header):
+    status, headers, body, _ = respond(audio_file, **({"range": header} if header else {}))
+    assert status == 200 and "content-range" not in headers
+    assert headers["content-length"] == "5000" and headers["accept-ranges"] == "bytes"
+    assert body == audio_file.read_bytes()
+
+
+def test_if_range(audio_file):
+    validators = file_stream.file_validators(audio_file.stat())
+    for current in (validators["ETag"], validators["Last-Modified"]):
+        status, _, body, _ = respond(audio_file, range="bytes=-10", if_range=current)
+        assert status == 206 and body == audio_file.read_bytes()[-10:]
+
+    # The client's copy is out of date: the whole current file instead of a range of it
+    for stale in ('"0-0"', "Mon, 01 Jan 2001 00:00:00 GMT"):
+        status, headers, body, _ = respond(audio_file, range="bytes=-10", if_range=stale)
+        assert status == 200 and "content-range" not in headers
+        assert body == audio_file.read_bytes()
+
+
+def test_conditional_and_head_requests(audio_file):
+    etag = file_stream.file_validators(audio_file.stat())["ETag"]
+    status, headers, body, closed = respond(audio_file, if_none_match=f'"other", {etag}')
+    assert status == 304 and headers["etag"] == etag and body == b"" and closed == [True]
+
+    status, headers, body, _ = respond(audio_file, method="HEAD", range="bytes=0-99")
+    assert status == 206 and headers["content-length"] == "100" and body == b""
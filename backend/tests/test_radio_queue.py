@@ -0,0 +1,116 @@
+import random
+from collections import Counter
+
+import pytest
+
+from services.radio_queue import AliasTable, RadioPool, RadioQueue
+
+DRAWS = 100000
+
+
+def candidates(count, **fields):
+    return [dict({'video_id': f"vid{index:05d}", 'view_count': index, 'likes': 0, 'upload_date': None}, **fields)
+            for index in range(count)]
+
+
+def queue_with_seed(seed=1, **kwargs):
+    queue = RadioQueue(**kwargs)
+    queue._rng = random.Random(seed)
+    return queue
+
+
+@pytest.mark.parametrize("weights", [[1, 2, 3, 4], [5, 0, 1], [0.001, 1000, 0.5, 0.5, 7], [3]])
+def test_alias_table_draws_in_proportion_to_the_weights(weights):
+    table = AliasTable(weights)
+    rng = random.Random(7)
+    drawn = Counter(table.draw(rng) for _ in range(DRAWS))
+    total = sum(weights)
+    for index, weight in enumerate(weights):
+        assert abs(drawn[index] / DRAWS - weight / total) < 0.01, (index, drawn)
+    assert set(drawn) <= set(range(len(weights)))
+
+
+def test_alias_table_is_reproducible_with_a_seed():
+    table = AliasTable([1, 5, 2, 8])
+    assert ([table.draw(random.Random(3)) for _ in range(50)] ==
+            [table.draw(random.Random(3)) for _ in range(50)])
+
+
+def test_view_weighting_plays_heavier_tracks_more_often():
+    tracks = candidates(3)
+    for track, views in zip(tracks, (0, 1000, 10 ** 6)):
+        track['view_count'] = views
+    pool = RadioPool(tracks, 'views')
+    rng = random.Random(11)
+    played = Counter(video_id for _ in range(30000) for video_id in pool.sample(1, (), rng))
+    assert played['vid00000'] < played['vid00001'] < played['vid00002']
+    # log1p weighting: 1 : 7.9 : 14.8
+    assert abs(played['vid00002'] / played['vid00000'] - 14.8) < 1.5
+
+
+def test_uniform_pools_deal_every_track_as_often():
+    pool = RadioPool(candidates(10), 'uniform')
+    rng = random.Random(5)
+    played = Counter(video_id for _ in range(20000) for video_id in pool.sample(3, (), rng))
+    assert set(played) == set(pool.video_ids)
+    assert max(played.values()) / min(played.values()) < 1.1
+
+
+@pytest.mark.parametrize("weighting", ['uniform', 'views'])
+def test_sessions_do_not_repeat_within_the_window(weighting):
+    queue = queue_with_seed(repeat_window=50)
+    pool = RadioPool(candidates(200), weighting)
+    session, played = queue.deal(None, pool, 7)
+    for _ in range(300):
+        session, video_ids = queue.deal(session, pool, 7)
+        played += video_ids
+    for start in range(len(played) - 50):
+        assert len(set(played[start:start + 51])) == 51, start
+
+
+def test_small_pools_cap_the_window_at_half():
+    queue = queue_with_seed(repeat_window=50)
+    pool = RadioPool(candidates(6), 'uniform')
+    session, played = queue.deal(None, pool, 1)
+    for _ in range(200):
+        session, video_ids = queue.deal(session, pool, 1)
+        played += video_ids
+    assert set(played) == set(pool.video_ids)
+    for start in range(len(played) - 3):
+        assert len(set(played[start:start + 4])) == 4, start
+
+
+def test_a_batch_as_large_as_the_pool_deals_every_track():
+    queue = queue_with_seed()
+    pool = RadioPool(candidates(8), 'views')
+    session, _ = queue.deal(None, pool, 5)
+    _, video_ids = queue.deal(session, pool, 50)
+    assert sorted(video_ids) == sorted(pool.video_ids)
+
+
+def test_sessions_are_evicted_least_recently_used_first():
+    queue = queue_with_seed(repeat_window=10, max_sessions=3)
+    pool = RadioPool(candidates(100), 'uniform')
+    dealt = {name: queue.deal(name, pool, 5)[1] for name in ("a", "b", "c")}
+    queue.deal("a", pool, 1)
+    queue.deal("d", pool, 1)
+    assert list(queue._sessions) == ["c", "a", "d"]
+    assert list(queue._sessions["c"]) == dealt["c"]
+    # An evicted session starts over with an empty history
+    queue.deal("b", pool, 1)
+    assert list(queue._sessions) == ["a", "d", "b"]
+    assert len(queue._sessions["b"]) == 1
+
+
+def test_new_sessions_get_an_id():
+    queue = queue_with_seed()
+    pool = RadioPool(candidates(20), 'uniform')
+    first, _ = queue.deal(None, pool, 1)
+    second, _ = queue.deal(None, pool, 1)
+    assert first != second and 0 < len(first) <= 64
+
+
+@pytest.mark.parametrize("weighting, session", [("loudness", None), ("uniform", ""), ("uniform", "x" * 65)])
+def test_validate_rejects_bad_requests(weighting, session):
+    with pytest.raises(ValueError):
+        RadioQueue.validate(weighting, session)
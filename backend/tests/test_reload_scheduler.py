@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+import pytest
+
+import services.apify_data_service as apify_data_service
+import services.sqlite_data_service as sqlite_data_service
+from conftest import apify_item, write_setlist
+from services.apify_data_service import ApifyDataService
+from services.reload_scheduler import ReloadScheduler
+from services.sqlite_data_service import SQLiteDataService
+
+
+def wait_for_runs(scheduler, runs, timeout=5.0):
+    """Stats once scheduler has finished at least runs reloads and has none pending"""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = scheduler.stats()
+        if stats["runs"] >= runs and not stats["pending"] and not stats["running"]:
+            return stats
+        assert time.monotonic() < deadline, stats
+        time.sleep(0.01)
+
+
+def test_a_burst_of_requests_runs_once():
+    calls = []
+    scheduler = ReloadScheduler(lambda: calls.append(time.monotonic()) or "reloaded", settle_delay=0.1)
+    try:
+        started = time.monotonic()
+        for _ in range(20):
+            scheduler.request()
+            time.sleep(0.005)
+        stats = wait_for_runs(scheduler, 1)
+        assert len(calls) == 1
+        # Trailing debounce: the reload waits for the end of the burst
+        assert calls[0] - started >= 0.1 + 19 * 0.005
+        assert stats["events"] == 20 and stats["coalesced"] == 19
+        assert stats["outcomes"] == {"reloaded": 1}
+    finally:
+        scheduler.stop()
+
+
+def test_requests_during_a_reload_run_it_once_more():
+    release = threading.Event()
+    calls = []
+
+    def reload():
+        calls.append(None)
+        release.wait(5)
+        return "reloaded"
+
+    scheduler = ReloadScheduler(reload, settle_delay=0)
+    try:
+        scheduler.request()
+        deadline = time.monotonic() + 5
+        while not scheduler.stats()["running"]:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        for _ in range(5):
+            scheduler.request()
+        release.set()
+        stats = wait_for_runs(scheduler, 2)
+        assert len(calls) == 2 and stats["coalesced"] == 4
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_failures_are_counted():
+    def reload():
+        raise RuntimeError("broken")
+
+    scheduler = ReloadScheduler(reload, settle_delay=0)
+    try:
+        scheduler.request()
+        stats = wait_for_runs(scheduler, 1)
+        assert stats["outcomes"] == {"failed": 1}
+        assert stats["last_error"] == "RuntimeError: broken"
+    finally:
+        scheduler.stop()
+
+
+@pytest.fixture(params=[ApifyDataService, SQLiteDataService], ids=["memory", "sqlite"])
+def service(request, setlist_file, tmp_path, monkeypatch):
+    """A started service watching setlist_file, reloading 0.2s after the last file event"""
+    monkeypatch.setattr(sqlite_data_service, "SQLITE_PATH", str(tmp_path / "catalog.sqlite3"))
+    service = request.param()
+    service.data_file = str(setlist_file)
+    service._cache_file = None
+    service._reload_scheduler.settle_delay = 0.2
+    service.start()
+    assert service.wait_until_ready(10)
+    yield service
+    service.shutdown()
+
+
+@pytest.mark.skipif(not apify_data_service.WATCHDOG_AVAILABLE, reason="needs watchdog")
+def test_a_burst_of_file_events_reloads_once(service, setlist_file):
+    assert service.get_watcher_status()["file_watcher_active"]
+    for count in range(61, 66):
+        write_setlist(setlist_file, [apify_item(index) for index in range(count)])
+        time.sleep(0.02)
+    stats = wait_for_runs(service._reload_scheduler, 1)
+    time.sleep(0.3)
+    stats = service._reload_scheduler.stats()
+    assert stats["runs"] == 1 and stats["events"] >= 5
+    assert stats["outcomes"] == {"reloaded": 1}
+    assert service.get_readiness()["tracks"] == 65
+
+
+def test_unchanged_content_skips_the_reload(service, setlist_file):
+    version = service.get_readiness()["version"]
+    # Same bytes, new mtime
+    with open(setlist_file, "rb") as f:
+        content = f.read()
+    time.sleep(0.01)
+    with open(setlist_file, "wb") as f:
+        f.write(content)
+    service.schedule_reload()
+    stats = wait_for_runs(service._reload_scheduler, 1)
+    assert stats["outcomes"] == {"unchanged": 1}
+    assert service.get_readiness()["version"] == version
+
+
+@pytest.mark.parametrize("content, error", [
+    ('[{"id": "vid00000", "title": ', "Invalid JSON"),
+    ('[{"type": "video"}, {"url": "https://example.com/no-id"}]', "None of the 2 items"),
+])
+def test_a_bad_file_keeps_the_previous_catalog(service, setlist_file, content, error):
+    before = service.get_readiness()
+    tracks = service.query_tracks(sort="views")["tracks"]
+    with open(setlist_file, "w", encoding="utf-8") as f:
+        f.write(content)
+    service.schedule_reload()
+    stats = wait_for_runs(service._reload_scheduler, 1)
+    assert stats["outcomes"] == {"failed": 1}
+    assert error in stats["last_error"]
+
+    after = service.get_readiness()
+    assert after["ready"] and after["version"] == before["version"] and after["tracks"] == 60
+    assert service.query_tracks(sort="views")["tracks"] == tracks
+    assert service.force_reload()["success"] is False
+
+    # A fixed file is picked up again
+    write_setlist(setlist_file, [apify_item(index) for index in range(61)])
+    service.schedule_reload()
+    wait_for_runs(service._reload_scheduler, 2)
+    assert service.get_readiness()["tracks"] == 61
+    assert os.path.exists(setlist_file)
@@ -0,0 +1,246 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+import services.sqlite_data_service as sqlite_data_service
+from conftest import apify_item, asgi_client, load_service, serve, write_setlist
+from main import app
+from services.apify_data_service import ApifyDataService
+from services.change_log import ChangeLog
+from services.sqlite_data_service import SQLiteDataService
+
+# Ticker period, and the longest a tick may be late while requests wait
+TICK = 0.001
+MAX_LAG = 0.05
+
+
+@pytest.fixture(params=[ApifyDataService, SQLiteDataService], ids=["memory", "sqlite"])
+def service(request, setlist_file, tmp_path, monkeypatch):
+    service = load_service(request.param, setlist_file, tmp_path, monkeypatch)
+    serve(service, monkeypatch)
+    yield service
+    service.shutdown()
+
+
+def call(method: str, path: str, **kwargs) -> httpx.Response:
+    """One request to the app, on an event loop of its own"""
+    async def send():
+        async with asgi_client() as client:
+            return await client.request(method, path, **kwargs)
+
+    return asyncio.run(send())
+
+
+async def get_with_ticker(paths):
+    """Responses to concurrent GETs of paths, and the event loop's longest stall meanwhile"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    requesting = True
+
+    async def ticker():
+        while requesting:
+            started = loop.time()
+            await asyncio.sleep(TICK)
+            lags.append(loop.time() - started - TICK)
+
+    task = asyncio.create_task(ticker())
+    async with asgi_client() as client:
+        responses = await asyncio.gather(*(client.get(path) for path in paths))
+    requesting = False
+    await task
+    return responses, max(lags)
+
+
+@asynccontextmanager
+async def open_event_stream(path: str, headers=None):
+    """
+    A streaming GET to the app, yielding a function that returns its next
+    Server-Sent Event as a field dict (ASGITransport would wait for the end
+    of the body, which an event stream never reaches)
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "client": ("127.0.0.1", 1234), "server": ("test", 80),
+        "headers": [(b"host", b"test")] + [(name.lower().encode(), value.encode())
+                                          for name, value in (headers or {}).items()],
+    }
+    messages = asyncio.Queue()
+    disconnected = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    task = asyncio.create_task(app(scope, receive, messages.put))
+    start = await asyncio.wait_for(messages.get(), 5)
+    assert start["type"] == "http.response.start" and start["status"] == 200
+    assert dict(start["headers"])[b"content-type"].startswith(b"text/event-stream")
+    buffer = b""
+
+    async def next_event(timeout: float = 5.0):
+        nonlocal buffer
+        while b"\n\n" not in buffer:
+            message = await asyncio.wait_for(messages.get(), timeout)
+            buffer += message.get("body", b"")
+        event, buffer = buffer.split(b"\n\n", 1)
+        return dict(line.split(": ", 1) for line in event.decode().splitlines())
+
+    try:
+        yield next_event
+    finally:
+        disconnected.set()
+        await asyncio.wait_for(task, 5)
+
+
+def test_sqlite_routes_wait_for_connections_off_the_event_loop(setlist_file, tmp_path, monkeypatch):
+    service = load_service(SQLiteDataService, setlist_file, tmp_path, monkeypatch)
+    serve(service, monkeypatch)
+    pool = service._readers
+    pool.timeout = 0.3
+    paths = ["/api/tracks", "/api/tracks/stats", "/api/tracks/random", "/api/tracks/vid00001",
+             "/api/tracks/vid00001/audio", "/api/tracks/ready", "/api/tracks/watcher/status", "/api/channels"]
+    try:
+        # Every connection checked out, as by slow clients
+        held = [pool.connection() for _ in range(pool.size)]
+        for connection in held:
+            connection.__enter__()
+        try:
+            responses, lag = asyncio.run(get_with_ticker(paths))
+        finally:
+            for connection in held:
+                connection.__exit__(None, None, None)
+        assert [response.status_code for response in responses] == [503] * len(paths)
+        assert all(response.headers["retry-after"] == "1" for response in responses)
+        assert lag < MAX_LAG
+
+        responses, _ = asyncio.run(get_with_ticker(paths[:4] + paths[6:]))
+        assert [response.status_code for response in responses] == [200] * (len(paths) - 2)
+    finally:
+        service.shutdown()
+
+
+def test_unfiltered_listing(service):
+    response = call("GET", "/api/tracks")
+    assert response.status_code == 200
+    tracks = response.json()
+    assert [track["video_id"] for track in tracks] == [f"vid{index:05d}" for index in range(60)]
+    assert tracks == service.query_tracks()["tracks"]
+    if isinstance(service, SQLiteDataService):
+        # Streamed from the database, never kept as a prepared body
+        assert response.headers["x-total-count"] == "60"
+        assert not any(name.startswith("response:tracks") for name in service._cached)
+    else:
+        assert "etag" in response.headers
+
+
+def reload_with(service, setlist_file, indexes, **edits):
+    """Reload the catalog with the tracks of indexes, edits mapping an index to field overrides"""
+    write_setlist(setlist_file, [apify_item(index, **edits.get(f"vid{index:05d}", {})) for index in indexes])
+    assert service.force_reload()["success"]
+    return service.get_changes()["version"]
+
+
+def changes_since(version):
+    response = call("GET", f"/api/tracks/changes?since={version}")
+    assert response.status_code == 200
+    changes = response.json()
+    return {key: sorted(value) if isinstance(value, list) else value for key, value in changes.items()}
+
+
+def test_changes_since_a_version(service, setlist_file):
+    first = service.get_changes()["version"]
+    second = reload_with(service, setlist_file, [index for index in range(62) if index != 3],
+                         vid00004={"title": "Edited title"})
+    third = reload_with(service, setlist_file, [index for index in range(61) if index != 3] + [62],
+                        vid00004={"title": "Edited title"}, vid00005={"likes": 1})
+    assert first < second < third
+
+    assert changes_since(first) == {"since": first, "version": third, "reset": False,
+                                    "added": ["vid00060", "vid00062"], "removed": ["vid00003"],
+                                    "updated": ["vid00004", "vid00005"]}
+    assert changes_since(second) == {"since": second, "version": third, "reset": False,
+                                     "added": ["vid00062"], "removed": ["vid00061"], "updated": ["vid00005"]}
+    assert changes_since(third) == {"since": third, "version": third, "reset": False,
+                                    "added": [], "removed": [], "updated": []}
+    assert call("GET", "/api/tracks/changes").status_code == 422
+
+
+def test_changes_older_than_the_log_ask_for_a_resync(service, setlist_file, monkeypatch):
+    monkeypatch.setattr(sqlite_data_service, "CHANGE_LOG_SIZE", 2)
+    monkeypatch.setattr(service, "_change_log", ChangeLog(size=2))
+    first = service.get_changes()["version"]
+    versions = [reload_with(service, setlist_file, range(60 + count)) for count in range(1, 4)]
+
+    resync = changes_since(first)
+    assert resync["reset"] is True and resync["version"] == versions[-1]
+    assert resync["added"] == resync["removed"] == resync["updated"] == []
+    # A version from before a restart of the versions
+    assert changes_since(versions[-1] + 5)["reset"] is True
+    assert changes_since(versions[0]) == {"since": versions[0], "version": versions[-1], "reset": False,
+                                          "added": ["vid00061", "vid00062"], "removed": [], "updated": []}
+
+
+def test_change_stream_sends_an_event_after_a_reload(service, setlist_file):
+    async def scenario():
+        async with open_event_stream("/api/tracks/changes/stream") as next_event:
+            ready = await next_event()
+            assert ready["event"] == "ready"
+            version = int(ready["id"])
+            assert json.loads(ready["data"]) == {"version": version}
+
+            write_setlist(setlist_file, [apify_item(index) for index in range(61)])
+            assert (await service.force_reload_async())["success"]
+            event = await next_event()
+        assert event["event"] == "changes"
+        changes = json.loads(event["data"])
+        assert int(event["id"]) == changes["version"] > version
+        assert (changes["since"], changes["added"], changes["removed"]) == (version, ["vid00060"], [])
+
+        # A reconnecting client catches up from Last-Event-ID in one event
+        async with open_event_stream("/api/tracks/changes/stream", {"Last-Event-ID": str(version)}) as next_event:
+            assert (await next_event())["id"] == event["id"]
+            catch_up = await next_event()
+        assert catch_up == event
+
+    asyncio.run(scenario())
+
+
+def test_similar_tracks_route(service):
+    response = call("GET", "/api/tracks/vid00007/similar?limit=3")
+    assert response.status_code == 200
+    similar = response.json()
+    assert similar == service.get_similar_tracks("vid00007", 3)
+    assert len(similar["tracks"]) == 3 and "vid00007" not in [track["video_id"] for track in similar["tracks"]]
+    assert len(call("GET", "/api/tracks/vid00007/similar").json()["tracks"]) == 10
+
+    assert call("GET", "/api/tracks/missing/similar").status_code == 404
+    for limit in (0, 51):
+        assert call("GET", f"/api/tracks/vid00007/similar?limit={limit}").status_code == 422
+
+
+def test_tracks_batch_route(service):
+    requested = ["vid00042", "missing", "vid00003", "vid00042"]
+    response = call("POST", "/api/tracks/batch?fields=video_id,title", json={"video_ids": requested})
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch == service.get_tracks_batch(requested, ("title", "video_id"))
+    # Fields come back in API order, whatever the order asked for
+    assert [list(track) for track in batch["tracks"]] == [["title", "video_id"]] * 2
+    assert batch["missing"] == ["missing"]
+
+    too_many = [f"vid{index:05d}" for index in range(501)]
+    assert call("POST", "/api/tracks/batch", json={"video_ids": too_many[:500]}).status_code == 200
+    response = call("POST", "/api/tracks/batch", json={"video_ids": too_many})
+    assert response.status_code == 400 and "500" in response.json()["detail"]
+    assert call("POST", "/api/tracks/batch?fields=nosuch", json={"video_ids": requested}).status_code == 400
+    assert call("POST", "/api/tracks/batch", json={}).status_code == 422
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+
+import pytest
+from aiohttp import web
+
+import services.scraper as scraper_module
+from services.scraper import HostRateLimiter, normalize_video, refresh_playlist, write_setlist
+
+API_KEY = "test-key"
+
+# PLbig spans three pages; PLsmall shares a video with it. v0007 is private:
+# listed in the playlist, but missing from the videos response
+PLAYLISTS = {
+    "PLbig": [f"v{i:04d}" for i in range(120)],
+    "PLsmall": ["v0003", "v0500", "v0501"],
+}
+PRIVATE = {"v0007"}
+
+
+def video_resource(video_id):
+    number = int(video_id[1:])
+    channel_id = f"UCchannel{number % 2}"
+    return {
+        "id": video_id,
+        "snippet": {
+            "title": f"Song {number}",
+            "description": f"Track {number} #AIMusic #lofi #AIMusic #chill #extra",
+            "channelId": channel_id,
+            "channelTitle": f"Channel {number % 2}",
+            "publishedAt": "2025-02-03T13:45:03Z",
+            "thumbnails": {"default": {"url": "https://i.ytimg.com/default.jpg"},
+                           "high": {"url": "https://i.ytimg.com/high.jpg"}},
+        },
+        "statistics": {"viewCount": str(number * 10), "likeCount": str(number), "commentCount": "2"},
+        "contentDetails": {"duration": "PT1H2M3S"},
+    }
+
+
+class FakeYouTubeApi:
+    """The three Data API endpoints the scraper calls, serving PLAYLISTS"""
+
+    def __init__(self, fail_first_videos_call=False):
+        self.fail_next_videos_call = fail_first_videos_call
+        self.calls = []
+        self._runner = None
+        self.base = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/playlistItems", self._playlist_items)
+        app.router.add_get("/videos", self._videos)
+        app.router.add_get("/channels", self._channels)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+    def _record(self, request):
+        assert request.query["key"] == API_KEY
+        self.calls.append((request.path, dict(request.query)))
+
+    async def _playlist_items(self, request):
+        self._record(request)
+        video_ids = PLAYLISTS.get(request.query["playlistId"])
+        if video_ids is None:
+            return web.json_response({"error": "playlistNotFound"}, status=404)
+        start = int(request.query.get("pageToken", 0))
+        size = int(request.query["maxResults"])
+        page = {"items": [{"contentDetails": {"videoId": video_id}} for video_id in video_ids[start:start + size]]}
+        if start + size < len(video_ids):
+            page["nextPageToken"] = str(start + size)
+        return web.json_response(page)
+
+    async def _videos(self, request):
+        self._record(request)
+        if self.fail_next_videos_call:
+            self.fail_next_videos_call = False
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        return web.json_response({"items": [video_resource(video_id) for video_id in request.query["id"].split(",")
+                                            if video_id not in PRIVATE]})
+
+    async def _channels(self, request):
+        self._record(request)
+        return web.json_response({"items": [{
+            "id": channel_id,
+            "snippet": {"customUrl": f"@{channel_id.lower()}"},
+            "statistics": {"subscriberCount": "1500"},
+        } for channel_id in request.query["id"].split(",")]})
+
+    def count(self, path):
+        return sum(1 for called, _ in self.calls if called == path)
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(scraper_module, "RETRY_BACKOFF", 0)
+    return {
+        "setlist_file": str(tmp_path / "AI_Setlist.json"),
+        "checkpoint_file": str(tmp_path / "checkpoint.json"),
+        "spool_file": str(tmp_path / "spool.jsonl"),
+    }
+
+
+def scrape(files, playlists, **api_options):
+    async def scenario():
+        async with FakeYouTubeApi(**api_options) as api:
+            scraped = await refresh_playlist(playlists, api_base=api.base, api_key=API_KEY,
+                                             rate_limiter=HostRateLimiter(rate=1000), **files)
+            return scraped, api
+
+    return asyncio.run(scenario())
+
+
+def read_setlist(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_refresh_scrapes_every_page_into_the_setlist(files):
+    playlists = [{"playlist_id": "PLbig", "title": "Big mix"}, {"playlist_id": "PLsmall"},
+                 {"playlist_id": "PLmissing"}]
+    scraped, api = scrape(files, playlists, fail_first_videos_call=True)
+
+    expected = (set(PLAYLISTS["PLbig"]) | set(PLAYLISTS["PLsmall"])) - PRIVATE
+    setlist = read_setlist(files["setlist_file"])
+    assert {item["id"] for item in setlist} == {item["id"] for item in scraped} == expected
+    assert len(setlist) == len(expected)
+    # 3 + 1 pages and one 404; each page costs one videos call (plus the retried 503)
+    assert api.count("/playlistItems") == 5 and api.count("/videos") == 5
+    # Channels are looked up once, not per page
+    assert api.count("/channels") == 1
+    assert not os.path.exists(files["checkpoint_file"]) and not os.path.exists(files["spool_file"])
+
+
+def test_normalize_video_produces_the_apify_schema():
+    channel = {"snippet": {"customUrl": "@lofilab"}, "statistics": {"subscriberCount": "1500"}}
+    item = normalize_video(video_resource("v0042"), channel, "PLbig", "Big mix")
+    assert item == {
+        "id": "v0042",
+        "url": "https://www.youtube.com/watch?v=v0042&list=PLbig",
+        "title": "Song 42",
+        "type": "video",
+        "thumbnailUrl": "https://i.ytimg.com/high.jpg",
+        "text": "Track 42 #AIMusic #lofi #AIMusic #chill #extra",
+        "viewCount": 420,
+        "likes": 42,
+        "commentsCount": 2,
+        "duration": "01:02:03",
+        "date": "2025-02-03T13:45:03.000Z",
+        "channelName": "Channel 0",
+        "channelUrl": "https://www.youtube.com/@lofilab",
+        "channelId": "UCchannel0",
+        "numberOfSubscribers": 1500,
+        "hashtags": ["#AIMusic", "#lofi", "#chill"],
+        "input": "Big mix",
+    }
+    # Without channel details the channel URL falls back to its ID
+    assert normalize_video(video_resource("v0001"), None, "PLbig", "x")["channelUrl"] == \
+        "https://www.youtube.com/channel/UCchannel1"
+
+
+def test_write_setlist_merges_into_the_existing_items(files):
+    path = files["setlist_file"]
+    existing = [{"id": "a", "title": "Old A", "formats": ["kept"]}, {"id": "b", "title": "Old B"}]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(existing, f)
+
+    written = write_setlist(path, [{"id": "b", "title": "New B"}, {"id": "c", "title": "New C"}])
+
+    assert written == 3
+    assert read_setlist(path) == [existing[0], {"id": "b", "title": "New B"}, {"id": "c", "title": "New C"}]
+
+
+def test_write_setlist_leaves_a_corrupt_setlist_alone(files):
+    path = files["setlist_file"]
+    corrupt = '[{"id": "a", "title": "A"}, {"id": "b", "title": '
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(corrupt)
+
+    with pytest.raises(ValueError):
+        write_setlist(path, [{"id": "c", "title": "C"}])
+
+    with open(path, "r", encoding="utf-8") as f:
+        assert f.read() == corrupt
+    assert os.listdir(os.path.dirname(path)) == ["AI_Setlist.json"]
+
+
+def test_scraped_items_survive_a_corrupt_setlist_until_it_is_fixed(files):
+    with open(files["setlist_file"], "w", encoding="utf-8") as f:
+        f.write('[{"id": "old"}, {"id": ')
+
+    with pytest.raises(ValueError):
+        scrape(files, [{"playlist_id": "PLsmall"}])
+    assert os.path.exists(files["spool_file"])
+
+    with open(files["setlist_file"], "w", encoding="utf-8") as f:
+        json.dump([{"id": "old"}], f)
+    scraped, api = scrape(files, [{"playlist_id": "PLsmall"}])
+
+    # The playlist was finished before the failed write, so nothing is fetched again
+    assert api.calls == []
+    assert [item["id"] for item in read_setlist(files["setlist_file"])] == ["old"] + PLAYLISTS["PLsmall"]
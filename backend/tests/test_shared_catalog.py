@@ -0,0 +1,132 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import services.shared_catalog as shared_catalog
+from conftest import apify_item, track_records
+from services.catalog import CatalogSnapshot
+from services.catalog_store import write_catalog
+from services.shared_catalog import SharedCatalog
+
+pytestmark = pytest.mark.skipif(shared_catalog.fcntl is None, reason="needs flock")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A coordinator in another process: publishes the catalog file it is given,
+# then holds the coordinator lock until it is killed
+COORDINATOR = """
+import sys
+from services.catalog_store import open_catalog
+from services.shared_catalog import SharedCatalog
+
+shared = SharedCatalog(sys.argv[1], on_promoted=lambda: None, on_reload_request=lambda: True)
+assert shared.start()
+shared.publish(open_catalog(sys.argv[2]), {})
+print("published", flush=True)
+sys.stdin.read()
+"""
+
+
+def snapshot(version, count=20, **overrides):
+    return CatalogSnapshot.build(version, track_records([apify_item(index, **overrides) for index in range(count)]))
+
+
+def shared(directory, promoted=None, on_reload_request=lambda: True):
+    return SharedCatalog(str(directory), on_promoted=promoted.set if promoted else lambda: None,
+                         on_reload_request=on_reload_request)
+
+
+@pytest.fixture
+def coordinator_process(tmp_path):
+    """Start a coordinator process publishing version 3; returns (process, published snapshot)"""
+    published = snapshot(3)
+    source = str(tmp_path / "source.bin")
+    write_catalog(published, source)
+    process = subprocess.Popen([sys.executable, "-c", COORDINATOR, str(tmp_path / "shared"), source],
+                               cwd=BACKEND_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert process.stdout.readline().strip() == "published"
+        yield process, published
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_followers_map_the_version_another_process_published(tmp_path, coordinator_process):
+    process, published = coordinator_process
+    follower = shared(tmp_path / "shared")
+    try:
+        assert not follower.start()
+        assert follower.published_version() == 3
+        assert follower.status()["coordinator_pid"] == process.pid
+        mapped = follower.open_version(3)
+        assert [track.to_dict() for track in mapped.tracks] == [track.to_dict() for track in published.tracks]
+        assert follower.open_version(4) is None
+    finally:
+        follower.stop()
+
+
+def test_a_follower_takes_over_when_the_coordinator_exits(tmp_path, coordinator_process):
+    process, _ = coordinator_process
+    promoted = threading.Event()
+    follower = shared(tmp_path / "shared", promoted)
+    try:
+        assert not follower.start()
+        assert not promoted.wait(0.3)
+        process.kill()
+        assert promoted.wait(10)
+        assert follower.is_coordinator and follower.promotions == 1
+        assert follower.status()["coordinator_pid"] == os.getpid()
+
+        # The new coordinator publishes on from the version it found
+        follower.publish(snapshot(4, count=5))
+        assert follower.published_version() == 4
+        assert len(follower.open_version(4)) == 5
+        assert follower.open_version(3) is not None
+    finally:
+        follower.stop()
+
+
+def test_followers_see_each_publication(tmp_path):
+    coordinator = shared(tmp_path)
+    follower = shared(tmp_path)
+    try:
+        assert coordinator.start() and not follower.start()
+        for version in range(1, 8):
+            coordinator.publish(snapshot(version, title=f"Version {version}"))
+            assert follower.published_version() == version
+            assert follower.open_version(version).tracks[0]['title'] == f"Version {version}"
+        # Older files are removed once more than RETAINED_FILES versions are newer
+        assert follower.open_version(7 - shared_catalog.RETAINED_FILES) is None
+        assert follower.open_version(8 - shared_catalog.RETAINED_FILES) is not None
+    finally:
+        coordinator.stop()
+        follower.stop()
+
+
+def test_followers_request_reloads_from_the_coordinator(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_catalog, "REQUEST_POLL_INTERVAL", 0.01)
+    outcomes = [True, False]
+    reloads = []
+
+    def reload():
+        reloads.append(time.monotonic())
+        return outcomes[len(reloads) - 1]
+
+    coordinator = shared(tmp_path, on_reload_request=reload)
+    follower = shared(tmp_path)
+    try:
+        assert coordinator.start() and not follower.start()
+        assert follower.request_reload(timeout=5) is True
+        assert follower.request_reload(timeout=5) is False
+        assert len(reloads) == 2
+        assert follower.status()["reloads_handled"] == 2
+        coordinator.stop()
+        assert follower.request_reload(timeout=0.2) is None
+    finally:
+        coordinator.stop()
+        follower.stop()
@@ -9,6 +9,7 @@ import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
 import { Filter, BarChart3, Shuffle, Grid, List } from "lucide-react";
 import { QuantumLogo } from "@/components/QuantumLogo";
+import { shuffle } from "@/lib/utils";
 import OnboardingSplash from "@/components/OnboardingSplash";
 
 const IndexWithSplash = () => {
@@ -130,7 +131,7 @@ const IndexWithSplash = () => {
   const totalPages = Math.ceil(filteredTracks.length / tracksPerPage);
 
   const handleShuffle = () => {
-    const shuffled = [...filteredTracks].sort(() => Math.random() - 0.5);
+    const shuffled = shuffle(filteredTracks);
     setFilteredTracks(shuffled);
     setCurrentPage(1);
   };
@@ -24,6 +24,11 @@ export interface TrackStats {
   unique_channels: number;
   avg_views_per_track: number;
   avg_likes_per_track: number;
+  total_comments?: number;
+  avg_comments_per_track?: number;
+  total_duration?: number;
+  avg_duration?: number;
+  latest_upload?: string;
 }
 
 export interface Channel {
@@ -33,6 +38,14 @@ export interface Channel {
   subscribers: number;
   video_count: number;
   total_views: number;
+  avg_views?: number;
+  total_likes?: number;
+  avg_likes?: number;
+  total_comments?: number;
+  avg_comments?: number;
+  total_duration?: number;
+  avg_duration?: number;
+  latest_upload?: string;
 }
 
 const API_BASE_URL = 'http://localhost:8000/api';
@@ -41,11 +54,13 @@ export async function fetchTracks(params?: {
   limit?: number;
   channel?: string;
   search?: string;
+  fields?: (keyof Track)[];
 }): Promise<Track[]> {
   const searchParams = new URLSearchParams();
   if (params?.limit) searchParams.append('limit', params.limit.toString());
   if (params?.channel) searchParams.append('channel', params.channel);
   if (params?.search) searchParams.append('search', params.search);
+  if (params?.fields?.length) searchParams.append('fields', params.fields.join(','));
   
   const url = `${API_BASE_URL}/tracks${searchParams.toString() ? '?' + searchParams.toString() : ''}`;
   const response = await fetch(url);
@@ -55,6 +70,145 @@ export async function fetchTracks(params?: {
   return response.json();
 }
 
+export type TrackSortKey = 'views' | 'likes' | 'comments' | 'date' | 'duration' | 'title';
+
+export interface TrackQuery {
+  search?: string;
+  channel?: string;
+  hasHashtags?: boolean;
+  sort?: TrackSortKey;
+  order?: 'asc' | 'desc';
+  pageSize?: number;
+  cursor?: string | null;
+  // Only these fields are returned (e.g. skip the long description in list views)
+  fields?: (keyof Track)[];
+}
+
+export interface TrackPage {
+  tracks: Track[];
+  total: number;
+  nextCursor: string | null;
+  version: number;
+}
+
+export async function fetchTrackPage(params: TrackQuery = {}): Promise<TrackPage> {
+  const searchParams = new URLSearchParams();
+  if (params.search) searchParams.append('search', params.search);
+  if (params.channel) searchParams.append('channel', params.channel);
+  if (params.hasHashtags) searchParams.append('has_hashtags', 'true');
+  if (params.sort) searchParams.append('sort', params.sort);
+  if (params.order) searchParams.append('order', params.order);
+  if (params.pageSize) searchParams.append('limit', params.pageSize.toString());
+  if (params.cursor) searchParams.append('cursor', params.cursor);
+  if (params.fields?.length) searchParams.append('fields', params.fields.join(','));
+
+  const url = `${API_BASE_URL}/tracks${searchParams.toString() ? '?' + searchParams.toString() : ''}`;
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error('Failed to fetch tracks');
+  }
+  const tracks: Track[] = await response.json();
+  return {
+    tracks,
+    total: Number(response.headers.get('X-Total-Count') ?? tracks.length),
+    nextCursor: response.headers.get('X-Next-Cursor'),
+    version: Number(response.headers.get('X-Catalog-Version') ?? 0),
+  };
+}
+
+export interface CatalogChanges {
+  since: number;
+  version: number;
+  // The server no longer has the changes since that version: refetch the tracks
+  reset: boolean;
+  added: string[];
+  removed: string[];
+  updated: string[];
+}
+
+export async function fetchCatalogChanges(since: number): Promise<CatalogChanges> {
+  const response = await fetch(`${API_BASE_URL}/tracks/changes?since=${since}`);
+  if (!response.ok) {
+    throw new Error('Failed to fetch catalog changes');
+  }
+  return response.json();
+}
+
+// Calls onChange with the video_ids changed by every new catalog version,
+// starting from `since` (the X-Catalog-Version of the tracks already loaded).
+// Returns a function that closes the stream.
+export function subscribeToCatalogChanges(
+  since: number,
+  onChange: (changes: CatalogChanges) => void
+): () => void {
+  const source = new EventSource(`${API_BASE_URL}/tracks/changes/stream?since=${since}`);
+  source.addEventListener('changes', (event) => {
+    onChange(JSON.parse((event as MessageEvent).data));
+  });
+  return () => source.close();
+}
+
+export type RadioWeighting = 'uniform' | 'views' | 'likes' | 'recency';
+
+export interface RadioBatch {
+  session: string;
+  tracks: Track[];
+  pool_size: number;
+  version: number;
+}
+
+// The next tracks for continuous playback. Pass the session from the previous
+// batch so the server does not repeat recently played tracks.
+export async function fetchRadioQueue(params: {
+  session?: string;
+  count?: number;
+  weight?: RadioWeighting;
+  channel?: string;
+  hashtag?: string;
+} = {}): Promise<RadioBatch> {
+  const searchParams = new URLSearchParams();
+  if (params.session) searchParams.append('session', params.session);
+  if (params.count) searchParams.append('count', params.count.toString());
+  if (params.weight) searchParams.append('weight', params.weight);
+  if (params.channel) searchParams.append('channel', params.channel);
+  if (params.hashtag) searchParams.append('hashtag', params.hashtag);
+
+  const response = await fetch(`${API_BASE_URL}/tracks/queue?${searchParams.toString()}`);
+  if (!response.ok) {
+    throw new Error('Failed to fetch radio queue');
+  }
+  return response.json();
+}
+
+export interface TrackFacets {
+  total: number;
+  // Counted without the channel filter, so other channels stay selectable
+  channels: { channel_title: string; count: number }[];
+  hashtags: { hashtag: string; count: number }[];
+  // [min, max) ranges; the last one has max null
+  durations: { min_seconds: number; max_seconds: number | null; count: number }[];
+  upload_months: { month: string; count: number }[];
+  views: { min_views: number; max_views: number | null; count: number }[];
+  version: number;
+}
+
+// Filter sidebar counts for the tracks matching the current filters
+export async function fetchTrackFacets(
+  params: Pick<TrackQuery, 'search' | 'channel' | 'hasHashtags'> & { hashtags?: number } = {}
+): Promise<TrackFacets> {
+  const searchParams = new URLSearchParams();
+  if (params.search) searchParams.append('search', params.search);
+  if (params.channel) searchParams.append('channel', params.channel);
+  if (params.hasHashtags) searchParams.append('has_hashtags', 'true');
+  if (params.hashtags) searchParams.append('hashtags', params.hashtags.toString());
+
+  const response = await fetch(`${API_BASE_URL}/tracks/facets?${searchParams.toString()}`);
+  if (!response.ok) {
+    throw new Error('Failed to fetch track facets');
+  }
+  return response.json();
+}
+
 export async function fetchRandomTrack(): Promise<Track> {
   const response = await fetch(`${API_BASE_URL}/tracks/random`);
   if (!response.ok) {
@@ -86,3 +240,32 @@ export async function fetchTrackById(videoId: string): Promise<Track> {
   }
   return response.json();
 }
+
+export interface TrackBatch {
+  // In the order requested
+  tracks: Track[];
+  // Requested IDs that are not in the catalog
+  missing: string[];
+  version: number;
+}
+
+// Resolve a playlist or queue in one request instead of one fetchTrackById per
+// track (at most 500 IDs per call)
+export async function fetchTracksByIds(videoIds: string[], fields?: (keyof Track)[]): Promise<TrackBatch> {
+  const query = fields?.length ? `?fields=${encodeURIComponent(fields.join(','))}` : '';
+  const response = await fetch(`${API_BASE_URL}/tracks/batch${query}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ video_ids: videoIds }),
+  });
+  if (!response.ok) {
+    throw new Error('Failed to fetch tracks');
+  }
+  return response.json();
+}
+
+// URL of the cached audio file for a track; supports seeking via HTTP Range.
+// Responds 404 when the audio has not been downloaded yet.
+export function getTrackAudioUrl(videoId: string): string {
+  return `${API_BASE_URL}/tracks/${encodeURIComponent(videoId)}/audio`;
+}